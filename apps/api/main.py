@@ -1,18 +1,45 @@
 
+import asyncio
 import base64
 import hashlib
 import hmac
 import json
+import math
 import os
+import threading
 import time
-import fcntl
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
+from apps.api.rtp.audit_ledger import audit_hash_line, get_ledger, read_tail_lines, verify as audit_verify
+from apps.api.rtp.audit_export import CursorError, export_ndjson, parse_cursor
+from apps.api.rtp.audit_index import AuditIndex, explain as audit_explain
+from apps.api.rtp.audit_merkle import default_merkle
+from apps.api.rtp.audit_query import parse_filters, query_ndjson
+from apps.api.rtp.audit_rollup import default_rollups
+from apps.api.rtp.audit_segments import list_segments, read_line_at
+from apps.api.rtp.audit_sink import AsyncAuditSink, LedgerSink
+from apps.api.rtp.audit_tail import AuditBroadcaster, TailFilter, TooManySubscribers
+from apps.api.rtp.authz import check_access as _authz_check
+from apps.api.rtp.emergency_cache import EmergencyState, load_state_async as emergency_load_state_async
+from apps.api.rtp.keyspace import KEYS, same_slot, slot_tag
+from apps.api.rtp.quota_lease import KASBAH_RL_LEASE, QuotaLeaser
+from apps.api.rtp.redis_scripts import (
+    PRECHECK_BRITTLE,
+    PRECHECK_OK,
+    PRECHECK_RATE_LIMITED,
+    PRECHECK_REPLAY,
+    Precheck,
+    RateLimit,
+)
+from apps.api.rtp.state_backend import KASBAH_STATE_BACKEND, StateUnavailable, make_backend
+from apps.api.rtp.thermo import ThermoBrake
+
 
 # __KASBAH_REPLAY_GUARD_V1__
 def _ticket_fp(ticket: str) -> str:
@@ -40,24 +67,9 @@ def _remaining_ttl_from_payload(payload: dict, default_ttl: int = 600) -> int:
         return max(1, remaining)
     return max(1, ttl)
 
-def _mark_consumed_once(ticket: str, payload: dict) -> bool:
-    """
-    Returns True if ticket is newly marked consumed, False if replay.
-    Atomic in Redis. Fail-closed if Redis unavailable.
-    """
-    ttl = _remaining_ttl_from_payload(payload, 600)
-    key = "kasbah:ticket:consumed:" + _ticket_fp(ticket)
-    try:
-        rc = _redis_client()  # exists in this file
-    except Exception:
-        rc = None
-    if rc is None:
-        return False
-    try:
-        ok = rc.set(key, "1", nx=True, ex=ttl)
-        return bool(ok)
-    except Exception:
-        return False
+def _consumed_key(ticket: str) -> str:
+    # depends on the ticket only: a request's agent_id is not authenticated
+    return KEYS.consumed(_ticket_fp(ticket))
 
 APP_NAME = "Kasbah Core"
 APP_VERSION = os.environ.get("KASBAH_VERSION", "dev")
@@ -69,11 +81,43 @@ KASBAH_AUTHZ = os.environ.get("KASBAH_AUTHZ", "1").strip().lower() in ("1", "tru
 DATA_DIR = Path(os.environ.get("KASBAH_DATA_DIR", ".kasbah"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 AUDIT_PATH = DATA_DIR / "audit.jsonl"
-AUDIT_LOCK_PATH = (DATA_DIR_PATH / "audit.lock")
+AUDIT_LOCK_PATH = (DATA_DIR / "audit.lock")
+AUDIT_TIP_PATH = DATA_DIR / "audit.tip.json"
+
+AUDIT_INDEX_PATH = DATA_DIR / "audit.index.sqlite"
+
+# __KASBAH_AUDIT_GROUP_COMMIT_V1__
+_AUDIT_LEDGER = get_ledger(AUDIT_PATH, AUDIT_LOCK_PATH, tip_path=AUDIT_TIP_PATH)
+
+# __KASBAH_AUDIT_ASYNC_SINK_V1__ (durability: KASBAH_AUDIT_DURABILITY=strict|interval|relaxed)
+_AUDIT_SINK = AsyncAuditSink(_AUDIT_LEDGER)
+
+# __KASBAH_AUDIT_UNIFIED_SINK_V1__ (sync producers; auxiliary logs use audit_sink.get_sink)
+_AUDIT_LEDGER_SINK = LedgerSink(_AUDIT_LEDGER)
+
+# __KASBAH_AUDIT_JTI_INDEX_V1__
+_AUDIT_INDEX = AuditIndex(AUDIT_INDEX_PATH)
+_AUDIT_LEDGER.add_listener(_AUDIT_INDEX.on_commit)
+
+# __KASBAH_AUDIT_MERKLE_V1__
+_AUDIT_MERKLE = default_merkle(AUDIT_PATH)
+_AUDIT_LEDGER.add_listener(_AUDIT_MERKLE.on_commit)
+
+# __KASBAH_AUDIT_LIVE_TAIL_V1__
+_AUDIT_TAIL = AuditBroadcaster(AUDIT_PATH, index=_AUDIT_INDEX)
+_AUDIT_LEDGER.add_listener(_AUDIT_TAIL.on_commit)
+
+# __KASBAH_AUDIT_ROLLUPS_V1__ (per-minute counts by event / agent_id / tool_name)
+_AUDIT_ROLLUPS = default_rollups(AUDIT_PATH)
+_AUDIT_LEDGER.add_listener(_AUDIT_ROLLUPS.on_commit)
 
 
 REDIS_URL = os.environ.get("REDIS_URL", "redis://redis:6379/0")
 
+# __KASBAH_STATE_BACKEND_V1__: rate limits, brittleness, emergency flags and replay
+# marks in Redis, or in this process with KASBAH_STATE_BACKEND=memory (rtp/state_backend.py)
+_STATE = make_backend(KASBAH_STATE_BACKEND, REDIS_URL)
+
 # __KASBAH_BEARER_AUTH_V1__
 KASBAH_REQUIRE_BEARER = os.environ.get("KASBAH_REQUIRE_BEARER", "0").strip().lower() in ("1","true","yes","on")
 KASBAH_BEARER_TOKENS = [t.strip() for t in os.environ.get("KASBAH_BEARER_TOKENS","").split(",") if t.strip()]
@@ -106,42 +150,21 @@ KASBAH_THERMO_EMA_MS_THRESHOLD = float(os.environ.get("KASBAH_THERMO_EMA_MS_THRE
 KASBAH_THERMO_ALPHA = float(os.environ.get("KASBAH_THERMO_ALPHA","0.20"))
 KASBAH_THERMO_COOLDOWN_SEC = int(os.environ.get("KASBAH_THERMO_COOLDOWN_SEC","10"))
 
-def _thermo_keys() -> tuple[str,str]:
-    return ("kasbah:thermo:ema_ms", "kasbah:thermo:lock_until")
+# __KASBAH_THERMO_LOCAL_EMA_V1__: per-process EMA, merged across instances by a timer (rtp/thermo.py)
+_THERMO = ThermoBrake(
+    lambda: _redis_client(),
+    threshold_ms=KASBAH_THERMO_EMA_MS_THRESHOLD,
+    alpha=KASBAH_THERMO_ALPHA,
+    cooldown_sec=KASBAH_THERMO_COOLDOWN_SEC,
+    force=KASBAH_THERMO_FORCE,
+)
 
 def _thermo_is_locked() -> bool:
-    if KASBAH_THERMO_FORCE:
-        return True
-    rc = _redis_client()
-    if rc is None:
-        return False  # don't fail closed on thermo; thermo is a safety brake, not core security
-    _, k_lock = _thermo_keys()
-    try:
-        v = rc.get(k_lock)
-        if not v:
-            return False
-        return float(v) > time.time()
-    except Exception:
-        return False
+    # memory only; the cluster decision is refreshed every KASBAH_THERMO_PUBLISH_SEC
+    return _THERMO.locked()
 
 def _thermo_update(lat_ms: float) -> None:
-    rc = _redis_client()
-    if rc is None:
-        return
-    k_ema, k_lock = _thermo_keys()
-    try:
-        cur = rc.get(k_ema)
-        if cur is None:
-            ema = float(lat_ms)
-        else:
-            ema0 = float(cur)
-            ema = (KASBAH_THERMO_ALPHA * float(lat_ms)) + ((1.0 - KASBAH_THERMO_ALPHA) * ema0)
-        rc.set(k_ema, str(ema), ex=3600)
-
-        if ema >= KASBAH_THERMO_EMA_MS_THRESHOLD:
-            rc.set(k_lock, str(time.time() + float(KASBAH_THERMO_COOLDOWN_SEC)), ex=max(2, KASBAH_THERMO_COOLDOWN_SEC + 2))
-    except Exception:
-        return
+    _THERMO.observe(lat_ms)
 
 # __KASBAH_BRITTLENESS_V1__
 KASBAH_BRITTLE_ENABLE = os.environ.get("KASBAH_BRITTLE_ENABLE","1").strip().lower() in ("1","true","yes","on")
@@ -150,49 +173,43 @@ KASBAH_BRITTLE_WINDOW_SEC = int(os.environ.get("KASBAH_BRITTLE_WINDOW_SEC","600"
 KASBAH_BRITTLE_LOCK_SEC = int(os.environ.get("KASBAH_BRITTLE_LOCK_SEC","120"))
 
 def _brittle_lock_key(agent_id: str) -> str:
-    return f"kasbah:brittle:lock:{agent_id}"
+    return KEYS.brittle_lock(agent_id)
 
 def _brittle_strike_key(agent_id: str) -> str:
-    return f"kasbah:brittle:strikes:{agent_id}"
+    return KEYS.brittle_strikes(agent_id)
 
-def _brittle_is_locked(agent_id: str) -> bool:
+async def _brittle_add_strike(agent_id: str) -> None:
     if not KASBAH_BRITTLE_ENABLE:
-        return False
-    rc = _redis_client()
-    if rc is None:
-        return False
-    try:
-        v = rc.get(_brittle_lock_key(agent_id))
-        if not v:
-            return False
-        return float(v) > time.time()
-    except Exception:
-        return False
-
-def _brittle_add_strike(agent_id: str) -> None:
-    if not KASBAH_BRITTLE_ENABLE:
-        return
-    rc = _redis_client()
-    if rc is None:
-        return
-    try:
-        k = _brittle_strike_key(agent_id)
-        n = rc.incr(k)
-        rc.expire(k, KASBAH_BRITTLE_WINDOW_SEC)
-        if int(n) >= KASBAH_BRITTLE_STRIKES:
-            rc.set(_brittle_lock_key(agent_id), str(time.time() + float(KASBAH_BRITTLE_LOCK_SEC)), ex=max(2, KASBAH_BRITTLE_LOCK_SEC + 2))
-    except Exception:
         return
+    until = await _STATE.brittle_strike(
+        _brittle_strike_key(agent_id),
+        _brittle_lock_key(agent_id),
+        strikes=KASBAH_BRITTLE_STRIKES,
+        window_sec=KASBAH_BRITTLE_WINDOW_SEC,
+        lock_sec=KASBAH_BRITTLE_LOCK_SEC,
+        now=time.time(),
+    )
+    if until is not None and _QUOTA_LEASES is not None:
+        _QUOTA_LEASES.note_brittle(_brittle_lock_key(agent_id), until)
 
 
 
 
 def _redis_client():
-    try:
-        import redis  # type: ignore
-        return redis.Redis.from_url(REDIS_URL, decode_responses=True)
-    except Exception:
-        return None
+    # __KASBAH_REDIS_POOL_V1__: one pooled client per process (see rtp/redis_pool.py);
+    # None with the in-process state backend
+    return _STATE.client()
+
+def _redis_async_client():
+    # __KASBAH_ASYNC_REDIS_V1__: redis.asyncio client of the running loop, for async handlers
+    return _STATE.async_client()
+
+def _emergency_state() -> Optional[EmergencyState]:
+    """
+    Emergency flags known in this process (__KASBAH_EMERGENCY_CACHE_V1__: the
+    pub/sub-invalidated cache with Redis); None when not known to be current.
+    """
+    return _STATE.emergency_flags()
 
 
 
@@ -203,6 +220,91 @@ KASBAH_RL_DECIDE_LIMIT = int(os.environ.get("KASBAH_RL_DECIDE_LIMIT", "60"))
 KASBAH_RL_DECIDE_WINDOW_SEC = int(os.environ.get("KASBAH_RL_DECIDE_WINDOW_SEC", "60"))
 KASBAH_RL_CONSUME_LIMIT = int(os.environ.get("KASBAH_RL_CONSUME_LIMIT", "120"))
 KASBAH_RL_CONSUME_WINDOW_SEC = int(os.environ.get("KASBAH_RL_CONSUME_WINDOW_SEC", "60"))
+# __KASBAH_GCRA_RATE_LIMIT_V1__: per-tool / per-principal limits with their own rates (0 = off)
+KASBAH_RL_DECIDE_TOOL_LIMIT = int(os.environ.get("KASBAH_RL_DECIDE_TOOL_LIMIT", "0"))
+KASBAH_RL_DECIDE_TOOL_WINDOW_SEC = int(os.environ.get("KASBAH_RL_DECIDE_TOOL_WINDOW_SEC", "60"))
+KASBAH_RL_DECIDE_PRINCIPAL_LIMIT = int(os.environ.get("KASBAH_RL_DECIDE_PRINCIPAL_LIMIT", "0"))
+KASBAH_RL_DECIDE_PRINCIPAL_WINDOW_SEC = int(os.environ.get("KASBAH_RL_DECIDE_PRINCIPAL_WINDOW_SEC", "60"))
+KASBAH_RL_CONSUME_TOOL_LIMIT = int(os.environ.get("KASBAH_RL_CONSUME_TOOL_LIMIT", "0"))
+KASBAH_RL_CONSUME_TOOL_WINDOW_SEC = int(os.environ.get("KASBAH_RL_CONSUME_TOOL_WINDOW_SEC", "60"))
+KASBAH_RL_CONSUME_PRINCIPAL_LIMIT = int(os.environ.get("KASBAH_RL_CONSUME_PRINCIPAL_LIMIT", "0"))
+KASBAH_RL_CONSUME_PRINCIPAL_WINDOW_SEC = int(os.environ.get("KASBAH_RL_CONSUME_PRINCIPAL_WINDOW_SEC", "60"))
+
+# __KASBAH_HIERARCHICAL_QUOTAS_V1__: a global limit, and cost budgets per level (0 = off).
+# Cost limits charge each request its usage.tokens (or, when not reported,
+# the tool's weight from KASBAH_RL_TOOL_COSTS, e.g. "shell=50,search=5"; default 1).
+def _rl_env(name: str) -> Tuple[int, int]:
+    return (
+        int(os.environ.get(f"KASBAH_RL_{name}_LIMIT", "0")),
+        int(os.environ.get(f"KASBAH_RL_{name}_WINDOW_SEC", "60")),
+    )
+
+def _parse_tool_costs(raw: str) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        try:
+            if name.strip():
+                out[name.strip()] = max(0, int(weight))
+        except ValueError:
+            continue
+    return out
+
+KASBAH_RL_TOOL_COSTS = _parse_tool_costs(os.environ.get("KASBAH_RL_TOOL_COSTS", ""))
+
+# (scope, level, counted by cost, limit, window); checked together in one
+# script, a refusal reports the scope, e.g. "tool:cost"
+_RL_SCOPES = {
+    "decide": (
+        ("global", "global", False, *_rl_env("DECIDE_GLOBAL")),
+        ("principal", "principal", False, KASBAH_RL_DECIDE_PRINCIPAL_LIMIT, KASBAH_RL_DECIDE_PRINCIPAL_WINDOW_SEC),
+        ("agent", "agent", False, KASBAH_RL_DECIDE_LIMIT, KASBAH_RL_DECIDE_WINDOW_SEC),
+        ("tool", "tool", False, KASBAH_RL_DECIDE_TOOL_LIMIT, KASBAH_RL_DECIDE_TOOL_WINDOW_SEC),
+        ("global:cost", "global", True, *_rl_env("DECIDE_GLOBAL_COST")),
+        ("principal:cost", "principal", True, *_rl_env("DECIDE_PRINCIPAL_COST")),
+        ("agent:cost", "agent", True, *_rl_env("DECIDE_AGENT_COST")),
+        ("tool:cost", "tool", True, *_rl_env("DECIDE_TOOL_COST")),
+    ),
+    "consume": (
+        ("global", "global", False, *_rl_env("CONSUME_GLOBAL")),
+        ("principal", "principal", False, KASBAH_RL_CONSUME_PRINCIPAL_LIMIT, KASBAH_RL_CONSUME_PRINCIPAL_WINDOW_SEC),
+        ("agent", "agent", False, KASBAH_RL_CONSUME_LIMIT, KASBAH_RL_CONSUME_WINDOW_SEC),
+        ("tool", "tool", False, KASBAH_RL_CONSUME_TOOL_LIMIT, KASBAH_RL_CONSUME_TOOL_WINDOW_SEC),
+        ("global:cost", "global", True, *_rl_env("CONSUME_GLOBAL_COST")),
+        ("principal:cost", "principal", True, *_rl_env("CONSUME_PRINCIPAL_COST")),
+        ("agent:cost", "agent", True, *_rl_env("CONSUME_AGENT_COST")),
+        ("tool:cost", "tool", True, *_rl_env("CONSUME_TOOL_COST")),
+    ),
+}
+
+def _request_cost(usage: Any, tool_name: Optional[str]) -> int:
+    """usage.tokens when the caller reports it, else the tool's configured weight."""
+    tokens = usage.get("tokens") if isinstance(usage, dict) else None
+    if isinstance(tokens, (int, float)) and not isinstance(tokens, bool) and tokens >= 0:
+        return int(math.ceil(tokens))
+    return KASBAH_RL_TOOL_COSTS.get(tool_name or "", 1)
+
+def _rate_limits(
+    op: str, agent_id: str, tool_name: Optional[str], principal: Optional[str], cost: int = 1
+) -> List[RateLimit]:
+    """The GCRA limits one `op` request is charged to (one key per scope)."""
+    ids = {"global": "all", "agent": agent_id, "tool": tool_name, "principal": principal}
+    return [
+        RateLimit(scope, KEYS.rate_limit(op, scope, level, ids[level]), limit, window, cost if weighted else 1)
+        for scope, level, weighted, limit, window in _RL_SCOPES[op]
+        if limit > 0 and ids[level]
+    ]
+
+# __KASBAH_RL_LEASE_V1__: decide admits from locally leased tokens (rtp/quota_lease.py)
+_QUOTA_LEASES: Optional[QuotaLeaser] = QuotaLeaser() if KASBAH_RL_LEASE and not _STATE.local else None
+
+def _rate_limited(op: str, pre: Precheck) -> HTTPException:
+    scope = "" if pre.limited_by in (None, "agent") else f":{pre.limited_by}"
+    return HTTPException(
+        status_code=429,
+        detail=f"rate limited ({op}{scope})",
+        headers={"Retry-After": str(pre.retry_after_sec)},
+    )
 
 def _admin_token_ok(authorization: Optional[str]) -> bool:
     if not authorization:
@@ -220,50 +322,133 @@ def _require_admin(authorization: Optional[str]) -> None:
     if not _admin_token_ok(authorization):
         raise HTTPException(status_code=403, detail="admin denied")
 
-def _rl_check(bucket: str, limit: int, window_sec: int) -> int:
-    """Returns remaining requests in the current window; fail-open if Redis unavailable."""
-    rc = _redis_client()
-    if rc is None:
-        return limit
-    key = f"kasbah:rl:{bucket}"
-    try:
-        n = int(rc.incr(key, 1))
-        if n == 1:
-            rc.expire(key, max(1, int(window_sec)))
-        return int(limit) - n
-    except Exception:
-        return limit
-
 def _em_key_all() -> str:
-    return "kasbah:emergency:all"
+    return KEYS.emergency("all")
 
 def _em_key_tool(tool_name: str) -> str:
-    return f"kasbah:emergency:tool:{tool_name}"
+    return KEYS.emergency(f"tool:{tool_name}")
 
 def _em_key_principal(principal: str) -> str:
-    return f"kasbah:emergency:principal:{principal}"
+    return KEYS.emergency(f"principal:{principal}")
 
-def _emergency_blocked(tool_name: str, principal: Optional[str]) -> Optional[str]:
-    rc = _redis_client()
-    if rc is None:
-        return None
-    try:
-        if rc.get(_em_key_all()):
-            return "emergency:all"
-        if tool_name and rc.get(_em_key_tool(tool_name)):
-            return "emergency:tool"
-        if principal and rc.get(_em_key_principal(principal)):
-            return "emergency:principal"
-    except Exception:
-        return None
-    return None
+# __KASBAH_CLUSTER_KEYS_V1__: on Redis Cluster each agent's script stays in the agent's slot (rtp/keyspace.py)
+async def _cluster_split(
+    agent_id: str, limits: List[RateLimit], st: Optional[EmergencyState]
+) -> Tuple[List[RateLimit], Optional[EmergencyState], Optional[Precheck]]:
+    """
+    Redis Cluster only: charge the limits outside the agent's slot (global /
+    principal / tool; one script per slot, concurrently) and make sure the
+    emergency flags are known without reading their slot in the agent's
+    script. Returns the agent's own limits, the flags and a refusal, if any.
+    A limit charged in one slot is not refunded when another slot refuses.
+    """
+    if not KEYS.cluster or _STATE.local:
+        return limits, st, None
+    if st is None:
+        # fail open like the scripts when the flags cannot be read
+        st = await emergency_load_state_async(_redis_async_client()) or EmergencyState()
+    home = _brittle_lock_key(agent_id)
+    own = [lim for lim in limits if same_slot(lim.key, home)]
+    groups: Dict[str, List[RateLimit]] = {}
+    for lim in limits:
+        if not same_slot(lim.key, home):
+            groups.setdefault(slot_tag(lim.key), []).append(lim)
+    if not groups:
+        return own, st, None
+    res = await asyncio.gather(*(_STATE.rate_limit(g) for g in groups.values()))
+    refused = [p for p in res if p.code != PRECHECK_OK]
+    if refused:
+        return own, st, max(refused, key=lambda p: p.retry_after_ms)
+    return own, st, None
+
+def _em_keys(agent_id: str, tool_name: Optional[str], principal: Optional[str]) -> List[str]:
+    if KEYS.cluster and not _STATE.local:
+        # not read (the flags are known): any key of the agent's slot keeps the script single-slot
+        return [_brittle_lock_key(agent_id)] * 3
+    return [_em_key_all(), _em_key_tool(tool_name or ""), _em_key_principal(principal or "")]
+
+# __KASBAH_DECIDE_PRECHECK_V1__
+async def _decide_precheck(agent_id: str, tool_name: str, principal: Optional[str], cost: int = 1) -> Precheck:
+    """
+    Brittle lock + decide rate limits + emergency flags in one step of the
+    state backend (one Redis round trip; the emergency flags come from the
+    in-process cache while it is current).
+    """
+    limits, st, refused = await _cluster_split(
+        agent_id, _rate_limits("decide", agent_id, tool_name, principal, cost), _emergency_state()
+    )
+    if refused is not None:
+        return refused
+    if _QUOTA_LEASES is not None and st is not None and limits:
+        # brittle lock + rate limits from this process's leases; Redis only to renew them
+        pre = await _QUOTA_LEASES.precheck(
+            _redis_async_client(),
+            _brittle_lock_key(agent_id),
+            limits,
+            now=time.time(),
+            brittle_enabled=KASBAH_BRITTLE_ENABLE,
+        )
+        if pre is not None:
+            if pre.code == PRECHECK_OK:
+                return Precheck(st.code(tool_name, principal), pre.remaining)
+            return pre
+    pre = await _STATE.decide_precheck(
+        _brittle_lock_key(agent_id),
+        _em_keys(agent_id, tool_name, principal),
+        limits,
+        now=time.time(),
+        brittle_enabled=KASBAH_BRITTLE_ENABLE,
+        check_tool=st is None and bool(tool_name),
+        check_principal=st is None and bool(principal),
+        check_all=st is None,
+    )
+    if st is not None and pre.code == PRECHECK_OK:
+        return Precheck(st.code(tool_name, principal), pre.remaining)
+    return pre
+
+# __KASBAH_CONSUME_GATE_V1__
+async def _consume_gate(agent_id: str, tool_name: str, ticket: str, payload: Optional[dict], cost: int = 1) -> Precheck:
+    """
+    Brittle lock + consume rate limits + emergency flags + consume-once mark,
+    atomically in one step of the state backend (one Redis round trip).
+    payload=None (ticket failed
+    verification): brittle lock and rate limits only.
+    """
+    principal = None
+    if payload is not None:
+        principal = str((payload.get("claims", {}) or {}).get("principal") or agent_id)
+    limits, st, refused = await _cluster_split(
+        agent_id, _rate_limits("consume", agent_id, tool_name, principal, cost), _emergency_state()
+    )
+    if refused is not None:
+        return refused
+    # a ticket stopped by a cached emergency flag is not marked consumed
+    em = st.code(tool_name, principal) if st is not None and payload is not None else PRECHECK_OK
+    mark = payload is not None and em == PRECHECK_OK
+    mark_key = _consumed_key(ticket)
+    ttl = _remaining_ttl_from_payload(payload, 600) if mark else None
+    # Redis Cluster: the mark is in the ticket's slot, set once the agent's gate passed
+    split = mark and not _STATE.local and not same_slot(mark_key, _brittle_lock_key(agent_id))
+    gate = await _STATE.consume_gate(
+        _brittle_lock_key(agent_id),
+        _em_keys(agent_id, tool_name, principal),
+        _brittle_lock_key(agent_id) if split else mark_key,
+        limits,
+        now=time.time(),
+        mark_ttl_sec=None if split else ttl,
+        brittle_enabled=KASBAH_BRITTLE_ENABLE,
+        check_tool=st is None and bool(tool_name),
+        check_principal=st is None and bool(principal),
+        check_all=st is None,
+    )
+    if em != PRECHECK_OK and gate.code == PRECHECK_OK:
+        return Precheck(em, gate.remaining)
+    if split and gate.code == PRECHECK_OK and not await _STATE.mark_once_async(mark_key, ttl or 1):
+        return Precheck(PRECHECK_REPLAY, gate.remaining)
+    return gate
 
 def _audit_hash_line(prev_hex: str, line: str) -> str:
-    h = hashlib.sha256()
-    h.update((prev_hex or "").encode("utf-8"))
-    h.update(b"\n")
-    h.update(line.encode("utf-8"))
-    return h.hexdigest()
+    return audit_hash_line(prev_hex, line)
 
 app = FastAPI(title=APP_NAME, version=APP_VERSION)
 
@@ -314,77 +499,107 @@ def _hash_tool_args(tool_name: str, args: Any) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
 
-def append_audit(event: str, agent_id: str, jti: Optional[str], extra: Optional[Dict[str, Any]] = None) -> None:
-    """
-    Append hash-chained audit record.
-    IMPORTANT: This must be globally serialized; otherwise concurrent requests create many chain breaks.
-    """
-    rec = {
-        "ts_ns": _now_ns(),
-        "event": event,
+# __KASBAH_TICKETS_V1__: HMAC-signed "<payload b64url>.<sig b64url>" tickets, bound to tool and args
+class DecisionRequest(BaseModel):
+    tool_name: str
+    agent_id: Optional[str] = None
+    usage: Optional[Dict[str, Any]] = None
+    signals: Optional[Dict[str, Any]] = None
+    principal: Optional[str] = None
+    action: Optional[str] = None
+    resource: Optional[str] = None
+    acting_as: Optional[str] = None
+
+
+class DecisionResponse(BaseModel):
+    decision: str
+    decision_kind: str
+    reason: str
+    rule_id: str
+    ticket: Optional[str] = None
+    explain: str = ""
+
+
+class ConsumeRequest(BaseModel):
+    ticket: str
+    tool_name: Optional[str] = None
+    agent_id: Optional[str] = None
+    usage: Optional[Dict[str, Any]] = None
+
+
+class ConsumeResponse(BaseModel):
+    status: str
+    action: str
+    tool: str
+    consumed_at: float
+
+
+def generate_ticket(tool_name: str, agent_id: str, args: Any, claims: Dict[str, Any]) -> str:
+    payload = {
+        "jti": os.urandom(16).hex(),
+        "tool_name": tool_name,
         "agent_id": agent_id,
-        "jti": jti,
-        "extra": extra or {},
+        "tool_hash": _hash_tool_args(tool_name, args),
+        "issued_ns": _now_ns(),
+        "ttl_sec": TICKET_TTL_SEC,
+        "claims": claims or {},
     }
+    payload_b64 = _b64url_encode(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    return payload_b64 + "." + _sign(payload_b64)
 
-    # Ensure dir exists
+
+def verify_ticket(ticket: str, tool_name: str, args: Any) -> dict:
+    """The ticket's payload if it is valid for this tool call; raises HTTPException otherwise."""
     try:
-        DATA_DIR_PATH.mkdir(parents=True, exist_ok=True)
+        payload_b64, sig = ticket.split(".", 1)
+        payload = json.loads(_b64url_decode(payload_b64).decode("utf-8"))
     except Exception:
-        pass
-
-    # Global critical section: lock -> read last hash -> append line -> fsync -> unlock
-    prev = ""
-    tmp = dict(rec)
-    tmp.pop("hash", None)
-    line = json.dumps(tmp, separators=(",", ":"), sort_keys=True)
-
+        raise HTTPException(status_code=400, detail="bad ticket")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="bad ticket")
+    if not hmac.compare_digest(sig, _sign(payload_b64)):
+        raise HTTPException(status_code=403, detail="bad signature")
+    if payload.get("tool_name") != tool_name:
+        raise HTTPException(status_code=403, detail="tool mismatch")
+    if payload.get("tool_hash") != _hash_tool_args(tool_name, args):
+        raise HTTPException(status_code=403, detail="args mismatch")
     try:
-        with open(AUDIT_LOCK_PATH, "a+", encoding="utf-8") as lockf:
-            try:
-                fcntl.flock(lockf.fileno(), fcntl.LOCK_EX)
-            except Exception:
-                # If lock fails, fail-open (still write, but chain might break)
-                pass
+        expires_ns = int(payload["issued_ns"]) + int(payload.get("ttl_sec") or TICKET_TTL_SEC) * 1_000_000_000
+    except Exception:
+        raise HTTPException(status_code=400, detail="bad ticket")
+    if _now_ns() > expires_ns:
+        raise HTTPException(status_code=403, detail="expired")
+    return payload
 
-            try:
-                if AUDIT_PATH.exists():
-                    try:
-                        lines = AUDIT_PATH.read_text(encoding="utf-8", errors="replace").splitlines()
-                        if lines:
-                            try:
-                                last = json.loads(lines[-1])
-                                if isinstance(last, str):
-                                    last = json.loads(last)
-                                prev = str(last.get("hash", ""))[:64]
-                            except Exception:
-                                prev = ""
-                    except Exception:
-                        prev = ""
-            except Exception:
-                prev = ""
 
-            rec["prev_hash"] = prev
-            rec["hash"] = _audit_hash_line(prev, line)
+def _audit_record(event: str, agent_id: str, jti: Optional[str], extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return {
+        "ts_ns": _now_ns(),
+        "event": event,
+        "agent_id": agent_id,
+        "jti": jti,
+        "extra": extra or {},
+    }
+
 
-            out_line = json.dumps(rec, separators=(",", ":"), sort_keys=True)
+def append_audit(event: str, agent_id: str, jti: Optional[str], extra: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Append hash-chained audit record.
+    IMPORTANT: This must be globally serialized; otherwise concurrent requests create many chain breaks.
+    Serialization is owned by the ledger's single writer thread (group commit); how long
+    this call blocks follows KASBAH_AUDIT_DURABILITY (strict: until the batch is fsynced,
+    interval: until it is written, relaxed: until queued). Fails open on error.
+    """
+    # ultimate fail-open: the sink never raises into the request path
+    _AUDIT_LEDGER_SINK.emit(_audit_record(event, agent_id, jti, extra))
 
-            with open(AUDIT_PATH, "a", encoding="utf-8") as f:
-                f.write(out_line + "\n")
-                try:
-                    f.flush()
-                    import os
-                    os.fsync(f.fileno())
-                except Exception:
-                    pass
 
-            try:
-                fcntl.flock(lockf.fileno(), fcntl.LOCK_UN)
-            except Exception:
-                pass
+async def append_audit_async(event: str, agent_id: str, jti: Optional[str], extra: Optional[Dict[str, Any]] = None) -> None:
+    """append_audit() for async handlers: waits on the commit without holding a thread."""
+    try:
+        await _AUDIT_SINK.append(_audit_record(event, agent_id, jti, extra))
     except Exception:
-        # ultimate fail-open: do not crash request path
-        return
+        pass
 
 
 @app.get("/")
@@ -398,21 +613,18 @@ def health():
 
 
 @app.post("/api/rtp/decide", response_model=DecisionResponse)
-def rtp_decide(req: DecisionRequest):
+async def rtp_decide(req: DecisionRequest):
     agent_id = req.agent_id or "anon"
 
-    if _brittle_is_locked(agent_id):
+    # one round trip; the emergency verdict is applied after authz, as before
+    pre = await _decide_precheck(agent_id, req.tool_name, req.principal or agent_id, _request_cost(req.usage, req.tool_name))
+    if pre.code == PRECHECK_BRITTLE:
         raise HTTPException(status_code=403, detail="brittle lock")
 
     args = (req.usage or {}).get("args", {}) if isinstance(req.usage, dict) else {}
 
-    rl_rem = _rl_check(
-        f"decide:{agent_id}",
-        KASBAH_RL_DECIDE_LIMIT,
-        KASBAH_RL_DECIDE_WINDOW_SEC,
-    )
-    if rl_rem < 0:
-        raise HTTPException(status_code=429, detail="rate limited (decide)")
+    if pre.code == PRECHECK_RATE_LIMITED:
+        raise _rate_limited("decide", pre)
 
     claims = {}
 
@@ -423,7 +635,7 @@ def rtp_decide(req: DecisionRequest):
         acting_as = req.acting_as
 
         if not principal or not action or not resource:
-            append_audit(
+            await append_audit_async(
                 "AUTHZ_DENY",
                 agent_id=agent_id,
                 jti=None,
@@ -442,7 +654,7 @@ def rtp_decide(req: DecisionRequest):
         )
 
         if not az.allow:
-            append_audit(
+            await append_audit_async(
                 "AUTHZ_DENY",
                 agent_id=agent_id,
                 jti=None,
@@ -466,9 +678,9 @@ def rtp_decide(req: DecisionRequest):
             "acting_as": acting_as,
         }
 
-    em = _emergency_blocked(req.tool_name, req.principal or agent_id)
+    em = pre.emergency
     if em:
-        append_audit(
+        await append_audit_async(
             "DECIDE_DENY",
             agent_id=agent_id,
             jti=None,
@@ -482,7 +694,7 @@ def rtp_decide(req: DecisionRequest):
         payload = json.loads(
             _b64url_decode(token.split(".", 1)[0]).decode("utf-8")
         )
-        append_audit(
+        await append_audit_async(
             "DECIDE",
             agent_id=agent_id,
             jti=payload.get("jti"),
@@ -512,62 +724,234 @@ def rtp_audit_export(limit: int = 2000, authorization: Optional[str] = Header(de
     try:
         if not AUDIT_PATH.exists():
             return {"meta": {"exported_at_ns": _now_ns(), "version": APP_VERSION}, "lines": [], "last_hash": ""}
-        lines = AUDIT_PATH.read_text(encoding="utf-8", errors="replace").splitlines()
-        if limit and limit > 0:
-            lines = lines[-int(limit):]
-        last_hash = ""
-        if lines:
-            try:
-                last = json.loads(lines[-1])
-                last_hash = str(last.get("hash", ""))
-            except Exception:
-                last_hash = ""
+        # O(1) chain tip from the checkpoint; only the requested tail is read.
+        tip = _AUDIT_LEDGER.tip()
+        # across rotations: sealed segments too, all of them when limit <= 0
+        lines = read_tail_lines(AUDIT_PATH, int(limit or 0))
         return {
-            "meta": {"exported_at_ns": _now_ns(), "version": APP_VERSION},
+            "meta": {"exported_at_ns": _now_ns(), "version": APP_VERSION, "count": tip.count},
             "lines": lines,
-            "last_hash": last_hash,
+            "last_hash": tip.last_hash,
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/rtp/audit/export/stream")
+def rtp_audit_export_stream(
+    cursor: Optional[str] = None,
+    limit: int = 10000,
+    authorization: Optional[str] = Header(default=None),
+):
+    """
+    Admin-only NDJSON export of audit records after `cursor` (a record sequence
+    number or the next_cursor token of a previous page). The last line is
+    {"meta": {...}} with next_cursor, last_hash and the chain tip.
+    """
+    _require_admin(authorization)
+    try:
+        parse_cursor(cursor)
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    tip = _AUDIT_LEDGER.tip()
+    body = export_ndjson(
+        AUDIT_PATH,
+        cursor=cursor,
+        limit=max(0, int(limit)),
+        end_index=tip.count,
+        index=_AUDIT_INDEX,
+        meta={
+            "exported_at_ns": _now_ns(),
+            "version": APP_VERSION,
+            "tip_count": tip.count,
+            "tip_hash": tip.last_hash,
+        },
+    )
+    return StreamingResponse(body, media_type="application/x-ndjson")
+
+@app.get("/api/rtp/audit/query")
+def rtp_audit_query(
+    event: Optional[str] = None,
+    agent_id: Optional[str] = None,
+    tool_name: Optional[str] = None,
+    principal: Optional[str] = None,
+    since_ns: Optional[int] = None,
+    until_ns: Optional[int] = None,
+    last_sec: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = 1000,
+    authorization: Optional[str] = Header(default=None),
+):
+    """
+    Admin-only indexed search, e.g. ?event=AUTHZ_DENY&agent_id=a1&last_sec=21600.
+    Filters take comma-separated values. NDJSON page; the trailing meta line
+    carries next_cursor and done.
+    """
+    _require_admin(authorization)
+    if last_sec is not None:
+        since_ns = _now_ns() - max(0, int(last_sec)) * 1_000_000_000
+    try:
+        start, _pos = parse_cursor(cursor)
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filters = parse_filters(event=event, agent_id=agent_id, tool_name=tool_name, principal=principal)
+    tip = _AUDIT_LEDGER.tip()
+    body = query_ndjson(
+        _AUDIT_INDEX,
+        AUDIT_PATH,
+        filters,
+        since_ns=since_ns,
+        until_ns=until_ns,
+        cursor=start,
+        limit=max(1, min(int(limit), 10000)),
+        end_index=tip.count,
+        meta={
+            "queried_at_ns": _now_ns(),
+            "version": APP_VERSION,
+            "tip_count": tip.count,
+            "indexed_through": _AUDIT_INDEX.indexed_through(),
+        },
+    )
+    return StreamingResponse(body, media_type="application/x-ndjson")
+
+def _tail_filter(event: Optional[str], agent_id: Optional[str], tool_name: Optional[str]) -> TailFilter:
+    # comma-separated lists: ?event=DECIDE,CONSUME_DENY&agent_id=a1
+    return TailFilter(*(v.split(",") if v else None for v in (event, agent_id, tool_name)))
+
+
+@app.get("/api/rtp/audit/tail")
+def rtp_audit_tail(
+    request: Request,
+    event: Optional[str] = None,
+    agent_id: Optional[str] = None,
+    tool_name: Optional[str] = None,
+    cursor: Optional[str] = None,
+    authorization: Optional[str] = Header(default=None),
+):
+    """
+    Admin-only Server-Sent Events feed of newly committed audit records,
+    pushed by the audit writer (no file polling). Each event's id is the
+    resume cursor; reconnecting with Last-Event-ID (or ?cursor=) replays
+    what was missed.
+    """
+    _require_admin(authorization)
+    cursor = cursor or request.headers.get("last-event-id") or None
+    try:
+        parse_cursor(cursor)
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if _AUDIT_TAIL.subscribers() >= _AUDIT_TAIL.max_subscribers:
+        raise HTTPException(status_code=503, detail="too many audit tail subscribers")
+    feed = _AUDIT_TAIL.stream(_tail_filter(event, agent_id, tool_name), cursor=cursor)
+
+    async def _sse():
+        try:
+            async for item in feed:
+                if item is None:
+                    yield b": keepalive\n\n"
+                    continue
+                _idx, next_cursor, line = item
+                yield f"id: {next_cursor}\nevent: audit\ndata: {line}\n\n".encode("utf-8")
+        except TooManySubscribers:
+            return
+
+    return StreamingResponse(
+        _sse(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/api/rtp/audit/tail/ws")
+async def rtp_audit_tail_ws(
+    ws: WebSocket,
+    event: Optional[str] = None,
+    agent_id: Optional[str] = None,
+    tool_name: Optional[str] = None,
+    cursor: Optional[str] = None,
+    token: Optional[str] = None,
+):
+    """
+    WebSocket variant of /api/rtp/audit/tail: one {"cursor", "record"} text
+    frame per record. Admin-only: the handshake carries the Authorization
+    header, or ?token= for clients that cannot set headers.
+    """
+    authorization = ws.headers.get("authorization") or (f"Bearer {token}" if token else None)
+    if not _admin_token_ok(authorization):
+        await ws.close(code=1008)
+        return
+    try:
+        parse_cursor(cursor)
+    except CursorError:
+        await ws.close(code=1008)
+        return
+    await ws.accept()
+    try:
+        async for item in _AUDIT_TAIL.stream(_tail_filter(event, agent_id, tool_name), cursor=cursor):
+            if item is None:
+                await ws.send_text('{"keepalive":true}')
+                continue
+            _idx, next_cursor, line = item
+            await ws.send_text('{"cursor":' + json.dumps(next_cursor) + ',"record":' + line + "}")
+    except TooManySubscribers:
+        await ws.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/api/rtp/audit_chain/verify")
+def rtp_audit_chain_verify(full: bool = False, authorization: Optional[str] = Header(default=None)) -> Dict[str, Any]:
+    """
+    Admin-only chain verification. Incremental by default: only records
+    appended since the last successful run are checked.
+    """
+    _require_admin(authorization)
+    _AUDIT_LEDGER.flush()
+    return audit_verify(str(DATA_DIR), full=full, workers=1)
+
 @app.post("/api/rtp/consume", response_model=ConsumeResponse)
-def rtp_consume(req: ConsumeRequest, authorization: Optional[str] = Header(default=None)):
+async def rtp_consume(req: ConsumeRequest, authorization: Optional[str] = Header(default=None)):
     ticket = req.ticket
     tool_name = req.tool_name or "unknown"
     agent_id = req.agent_id or "anon"
-    if _brittle_is_locked(agent_id):
-        raise HTTPException(status_code=403, detail="brittle lock")
     args = (req.usage or {}).get("args", {}) if isinstance(req.usage, dict) else {}
 
-    rl_rem = _rl_check(f"consume:{agent_id}", KASBAH_RL_CONSUME_LIMIT, KASBAH_RL_CONSUME_WINDOW_SEC)
-    if rl_rem < 0:
-        raise HTTPException(status_code=429, detail="rate limited (consume)")
+    # Verify locally first (no I/O) so that the Redis checks and the
+    # consume-once mark run as one atomic script; a failed verification is
+    # reported only after the brittle lock and rate limit, as before.
+    try:
+        payload: Optional[dict] = verify_ticket(ticket, tool_name, args)
+        verify_err: Optional[HTTPException] = None
+    except HTTPException as e:
+        payload, verify_err = None, e
+    gate = await _consume_gate(agent_id, tool_name, ticket, payload, _request_cost(req.usage, tool_name))
+    if gate.code == PRECHECK_BRITTLE:
+        raise HTTPException(status_code=403, detail="brittle lock")
+    if gate.code == PRECHECK_RATE_LIMITED:
+        raise _rate_limited("consume", gate)
     try:
               # __BRITTLE_STRIKE_ON_VERIFY_FAIL_V1__
       try:
-          payload = verify_ticket(ticket, tool_name, args)
+          if verify_err is not None:
+              raise verify_err
       except HTTPException as e:
           # Any ticket failure is a strike for this agent_id (tamper / swap / expiry / format).
           try:
-              _brittle_add_strike(agent_id, reason=str(getattr(e, 'detail', 'verify_fail')))
-              append_audit("BRITTLE_STRIKE", agent_id=agent_id, jti=None, extra={"reason": str(getattr(e, 'detail', 'verify_fail')), "status": int(getattr(e, 'status_code', 0) or 0)})
+              await append_audit_async("BRITTLE_STRIKE", agent_id=agent_id, jti=None, extra={"reason": str(getattr(e, 'detail', 'verify_fail')), "status": int(getattr(e, 'status_code', 0) or 0)})
           except Exception:
               pass
           raise
 
     except HTTPException as e:
         if int(getattr(e, "status_code", 0)) in (400, 401, 403):
-            _brittle_add_strike(agent_id)
+            await _brittle_add_strike(agent_id)
         raise
     # emergency gate (consume)
-    _claims = payload.get("claims", {}) or {}
-    _principal = _claims.get("principal") or agent_id
-    em = _emergency_blocked(tool_name, str(_principal))
+    em = gate.emergency
     if em:
-        append_audit("CONSUME_DENY", agent_id=agent_id, jti=payload.get("jti"), extra={"tool_name": tool_name, "reason": em})
+        await append_audit_async("CONSUME_DENY", agent_id=agent_id, jti=payload.get("jti"), extra={"tool_name": tool_name, "reason": em})
         raise HTTPException(status_code=403, detail=em)
-    # replay protection: consume once (fail-closed)
-    if not _mark_consumed_once(req.ticket, payload):
+    # replay protection: consume once (fail-closed; marked by the gate script)
+    if gate.code == PRECHECK_REPLAY:
         raise HTTPException(status_code=403, detail="replay")
     if KASBAH_AUTHZ:
         claims = payload.get("claims", {}) or {}
@@ -582,7 +966,7 @@ def rtp_consume(req: ConsumeRequest, authorization: Optional[str] = Header(defau
             raise HTTPException(status_code=403, detail=f"authz deny: {az.reason}")
 
     try:
-        append_audit("CONSUME", agent_id=agent_id, jti=payload.get("jti"), extra={"tool_name": tool_name})
+        await append_audit_async("CONSUME", agent_id=agent_id, jti=payload.get("jti"), extra={"tool_name": tool_name})
     except Exception:
         pass
 
@@ -590,75 +974,188 @@ def rtp_consume(req: ConsumeRequest, authorization: Optional[str] = Header(defau
 
 
 
+def _emergency_set(field: str, on: bool) -> None:
+    try:
+        _STATE.set_emergency_flag(field, on)
+    except StateUnavailable as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/system/emergency/status")
 def emergency_status(authorization: Optional[str] = Header(default=None)) -> Dict[str, Any]:
     _require_admin(authorization)
-    rc = _redis_client()
-    if rc is None:
-        return {"redis": False, "all": False}
-    return {"redis": True, "all": bool(rc.get(_em_key_all()))}
+    cache = _STATE.emergency_metrics()
+    all_ = _STATE.emergency_all()
+    return {"backend": _STATE.name, "redis": _STATE.name == "redis" and all_ is not None, "all": bool(all_), "cache": cache}
 
 @app.post("/api/system/emergency/disable_all")
 def emergency_disable_all(authorization: Optional[str] = Header(default=None)) -> Dict[str, Any]:
     _require_admin(authorization)
-    rc = _redis_client()
-    if rc is None:
-        raise HTTPException(status_code=500, detail="redis unavailable")
-    rc.set(_em_key_all(), "1")
+    _emergency_set("all", True)
     return {"ok": True, "all": True}
 
 @app.post("/api/system/emergency/enable_all")
 def emergency_enable_all(authorization: Optional[str] = Header(default=None)) -> Dict[str, Any]:
     _require_admin(authorization)
-    rc = _redis_client()
-    if rc is None:
-        raise HTTPException(status_code=500, detail="redis unavailable")
-    rc.delete(_em_key_all())
+    _emergency_set("all", False)
     return {"ok": True, "all": False}
 
 @app.post("/api/system/emergency/disable_tool/{tool_name}")
 def emergency_disable_tool(tool_name: str, authorization: Optional[str] = Header(default=None)) -> Dict[str, Any]:
     _require_admin(authorization)
-    rc = _redis_client()
-    if rc is None:
-        raise HTTPException(status_code=500, detail="redis unavailable")
-    rc.set(_em_key_tool(tool_name), "1")
+    _emergency_set(f"tool:{tool_name}", True)
     return {"ok": True, "tool": tool_name, "disabled": True}
 
 @app.post("/api/system/emergency/enable_tool/{tool_name}")
 def emergency_enable_tool(tool_name: str, authorization: Optional[str] = Header(default=None)) -> Dict[str, Any]:
     _require_admin(authorization)
-    rc = _redis_client()
-    if rc is None:
-        raise HTTPException(status_code=500, detail="redis unavailable")
-    rc.delete(_em_key_tool(tool_name))
+    _emergency_set(f"tool:{tool_name}", False)
     return {"ok": True, "tool": tool_name, "disabled": False}
 
 
+@app.on_event("startup")
+def _audit_index_catch_up() -> None:
+    # Index / Merkle-leaf records written while those listeners were absent
+    # (e.g. first start on an existing audit.jsonl) without holding up startup.
+    def _run() -> None:
+        for catch_up in (_AUDIT_INDEX.catch_up, _AUDIT_MERKLE.catch_up, _AUDIT_ROLLUPS.catch_up):
+            try:
+                catch_up(AUDIT_PATH)
+            except Exception:
+                pass
+    threading.Thread(target=_run, name="kasbah-audit-index-catch-up", daemon=True).start()
+
+
+@app.on_event("startup")
+def _redis_pool_start() -> None:
+    _STATE.start()
+    _THERMO.start()
+
+
+@app.on_event("shutdown")
+def _redis_background_stop() -> None:
+    _STATE.stop()
+    _THERMO.stop()
+
+
+@app.get("/api/system/thermo/status")
+def thermo_status(authorization: Optional[str] = Header(default=None)) -> Dict[str, Any]:
+    """Local and cluster latency EMA behind the thermo lockdown."""
+    _require_admin(authorization)
+    return _THERMO.metrics()
+
+
+@app.get("/api/system/redis/metrics")
+def redis_metrics(authorization: Optional[str] = Header(default=None)) -> Dict[str, Any]:
+    """Connection pool utilisation of the shared Redis client (or the in-process store's size)."""
+    _require_admin(authorization)
+    out = _STATE.metrics()
+    out["quota_leases"] = _QUOTA_LEASES.metrics() if _QUOTA_LEASES is not None else {"enabled": False}
+    return out
+
+
+@app.on_event("shutdown")
+async def _audit_shutdown_flush() -> None:
+    # Drain the queue and fsync whatever interval/relaxed mode left unsynced.
+    try:
+        await _AUDIT_SINK.aclose()
+    except Exception:
+        pass
+    _AUDIT_ROLLUPS.flush()
+    if _QUOTA_LEASES is not None:
+        await _QUOTA_LEASES.release_all(_redis_async_client())
+    await _STATE.aclose()
+
+
+@app.get("/api/rtp/audit/metrics")
+def rtp_audit_metrics(authorization: Optional[str] = Header(default=None)) -> Dict[str, Any]:
+    """Admin-only audit pipeline health: queue depth, commit latency, drops, fsyncs."""
+    _require_admin(authorization)
+    return _AUDIT_SINK.metrics()
+
+
+@app.get("/api/rtp/audit/aggregates")
+def rtp_audit_aggregates(
+    event: Optional[str] = None,
+    agent_id: Optional[str] = None,
+    tool_name: Optional[str] = None,
+    group_by: str = "event,agent_id,tool_name",
+    since_ns: Optional[int] = None,
+    until_ns: Optional[int] = None,
+    last_sec: Optional[int] = None,
+    step_sec: int = 0,
+    authorization: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    """
+    Admin-only record counts over any (minute-aligned) window from the
+    per-minute rollups, e.g.
+    ?event=AUTHZ_DENY,BRITTLE_STRIKE&group_by=agent_id&last_sec=3600&step_sec=300.
+    """
+    _require_admin(authorization)
+    if last_sec is not None:
+        since_ns = _now_ns() - max(0, int(last_sec)) * 1_000_000_000
+    try:
+        filters = {f: v.split(",") for f, v in (("event", event), ("agent_id", agent_id), ("tool_name", tool_name)) if v}
+        return _AUDIT_ROLLUPS.aggregate(
+            since_ns=since_ns,
+            until_ns=until_ns,
+            filters=filters,
+            group_by=[g.strip() for g in group_by.split(",") if g.strip()],
+            step_sec=max(0, int(step_sec)),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.get("/api/rtp/explain/{jti}")
 def rtp_explain(jti: str, limit: int = 200) -> Dict[str, Any]:
-    if not AUDIT_PATH.exists():
-        return {"jti": jti, "found": False, "trace": []}
-    lines = AUDIT_PATH.read_text(encoding="utf-8", errors="replace").splitlines()
-    trace = []
-    for ln in lines[-max(1, min(limit, 2000)):]:
-        try:
-            rec = json.loads(ln)
-        except Exception:
-            continue
-        if str(rec.get("jti") or "") == str(jti):
-            trace.append(rec)
+    try:
+        trace = audit_explain(_AUDIT_INDEX, AUDIT_PATH, jti, limit=max(1, min(limit, 2000)))
+    except Exception:
+        # index unavailable: fall back to the recent tail
+        trace = []
+        for ln in read_tail_lines(AUDIT_PATH, max(1, min(limit, 2000))):
+            try:
+                rec = json.loads(ln)
+            except Exception:
+                continue
+            if str(rec.get("jti") or "") == str(jti):
+                trace.append(rec)
     return {"jti": jti, "found": bool(trace), "trace": trace}
 
 
+@app.get("/api/rtp/audit/proof/{jti}")
+def rtp_audit_proof(jti: str, authorization: Optional[str] = Header(default=None)) -> Dict[str, Any]:
+    """Admin-only Merkle inclusion proof(s) for the audit records of a ticket."""
+    _require_admin(authorization)
+    proofs = []
+    for idx, seq, off in _AUDIT_INDEX.lookup(jti, limit=200):
+        p = _AUDIT_MERKLE.proof(idx)
+        if p is None:
+            continue
+        for info, path in list_segments(AUDIT_PATH):
+            if info.seq == seq:
+                p["record"] = read_line_at(path, off).decode("utf-8", errors="replace")
+                break
+        proofs.append(p)
+    return {"jti": jti, "found": bool(proofs), "proofs": proofs}
+
+
+@app.get("/api/rtp/audit/merkle/roots")
+def rtp_audit_merkle_roots(
+    since_block: int = 0, limit: int = 1000, authorization: Optional[str] = Header(default=None)
+) -> Dict[str, Any]:
+    _require_admin(authorization)
+    return {"block_size": _AUDIT_MERKLE.block, "roots": _AUDIT_MERKLE.roots(since_block, max(1, min(limit, 10000)))}
+
+
 @app.get("/api/rtp/audit")
 def rtp_audit(limit: int = 200, authorization: Optional[str] = Header(default=None)) -> Dict[str, Any]:
     try:
         if not AUDIT_PATH.exists():
             return {"events": []}
-        lines = AUDIT_PATH.read_text(encoding="utf-8", errors="replace").splitlines()
+        lines = read_tail_lines(AUDIT_PATH, max(1, min(limit, 2000)))
         out = []
-        for ln in lines[-max(1, min(limit, 2000)):]:
+        for ln in lines:
             try:
                 out.append(json.loads(ln))
             except Exception:
@@ -1,7 +1,9 @@
 import json
 import time
 from pathlib import Path
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from .audit_sink import get_sink
 
 # Always write inside the container-mapped directory.
 # In Docker, /app is WORKDIR; ".kasbah" resolves to /app/.kasbah
@@ -34,13 +36,19 @@ def _normalize_record(
 
 
 def append_audit(record_or_event: Union[Dict[str, Any], str], agent_id: Optional[str] = None, jti: Optional[str] = None) -> None:
-    AUDIT_DIR.mkdir(exist_ok=True)
-    rec = _normalize_record(record_or_event, agent_id=agent_id, jti=jti)
-    with AUDIT_PATH.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(rec, separators=(",", ":"), ensure_ascii=False) + "\n")
+    # buffered: the sink's flusher thread appends to AUDIT_PATH (see audit_sink.py)
+    get_sink(AUDIT_PATH).emit(_normalize_record(record_or_event, agent_id=agent_id, jti=jti))
+
+
+def append_audit_many(records: Iterable[Union[Dict[str, Any], str]]) -> None:
+    """Several records from one operation, written together in a single flush."""
+    recs: List[Dict[str, Any]] = [_normalize_record(r) for r in records]
+    if recs:
+        get_sink(AUDIT_PATH).emit_many(recs)
 
 
 def read_audit(limit: int = 50):
+    get_sink(AUDIT_PATH).flush()  # read our own buffered writes
     if not AUDIT_PATH.exists():
         return []
     # tail-ish read without loading huge files: still OK for demo sizes
@@ -0,0 +1,418 @@
+"""
+Kasbah RTP - compact binary audit record encoding.
+
+A segment whose header says "format": "bin" stores records as frames
+
+    u32 length | payload | u32 length        (big-endian; trailer for reverse seek)
+
+instead of JSON lines. The header itself stays a JSON line, so read_header()
+and the format flag work the same for both encodings.
+
+Payload:
+
+    flags:u8 | prev_hash:32 | hash:32 | object
+
+The chain hashes sit at fixed positions, so the tip is recovered from the
+final frame without decoding anything else. Field names and the values of
+event / agent_id / tool_name are dictionary-encoded per segment: the first
+use of a string defines it inline with an explicit id (flag DEFS marks such
+frames), later uses are a varint reference. Explicit ids make decoding
+idempotent, so a reader can resume anywhere once it has seen the defining
+frames before that offset.
+
+Hashing is unchanged: records still chain over canonical JSON, and every
+frame decodes back to the exact canonical JSON line, so a segment converts
+between formats losslessly and verifies the same way in either.
+
+    python -m apps.api.rtp.audit_binary convert SRC DST --to bin|jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import struct
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+KASBAH_AUDIT_DICT_MAX = int(os.environ.get("KASBAH_AUDIT_DICT_MAX", "65535"))
+
+FORMAT_BIN = "bin"
+
+# Top-level fields whose values are dictionary-encoded (besides every key).
+DICT_FIELDS = ("event", "agent_id", "tool_name")
+
+FLAG_DEFS = 0x01        # frame defines dictionary entries
+FLAG_RAW = 0x02         # payload after the flags byte is a verbatim JSON line
+FLAG_NO_PREV = 0x04     # prev_hash is "" (first record of the chain)
+
+_T_NULL, _T_FALSE, _T_TRUE = 0x00, 0x01, 0x02
+_T_INT, _T_FLOAT, _T_STR = 0x03, 0x04, 0x05
+_T_REF, _T_DEF = 0x06, 0x07
+_T_LIST, _T_OBJ, _T_HEX32 = 0x08, 0x09, 0x0A
+
+_LEN = struct.Struct(">I")
+_F64 = struct.Struct(">d")
+_HEX64 = re.compile(r"[0-9a-f]{64}\Z")
+_HASH_KEYS = ("hash", "prev_hash")
+_ZERO32 = bytes(32)
+
+
+class BinaryFormatError(ValueError):
+    pass
+
+
+def _canonical(obj: Any) -> str:
+    # same as audit_ledger.canonical_json (kept local: this module has no deps)
+    return json.dumps(obj, separators=(",", ":"), sort_keys=True)
+
+
+# ---- dictionary ----
+
+class SegmentDictionary:
+    """Per-segment string table. `scanned_to` is the offset up to which a reader has applied definitions."""
+
+    def __init__(self) -> None:
+        self.strings: List[Optional[str]] = []
+        self.ids: Dict[str, int] = {}
+        self.scanned_to = 0
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def define(self, i: int, s: str) -> None:
+        if i >= len(self.strings):
+            self.strings.extend([None] * (i + 1 - len(self.strings)))
+        self.strings[i] = s
+        self.ids.setdefault(s, i)
+
+    def get(self, i: int) -> str:
+        try:
+            s = self.strings[i]
+        except IndexError:
+            s = None
+        if s is None:
+            raise BinaryFormatError(f"undefined dictionary id {i}")
+        return s
+
+    def truncate(self, n: int) -> None:
+        """Forget ids >= n (rolls back definitions of a batch that was never written)."""
+        for s in self.strings[n:]:
+            if s is not None and self.ids.get(s, -1) >= n:
+                del self.ids[s]
+        del self.strings[n:]
+
+
+# ---- varints / values ----
+
+def _put_uvarint(out: bytearray, n: int) -> None:
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_uvarint(buf: bytes, pos: int) -> Tuple[int, int]:
+    n = 0
+    shift = 0
+    while True:
+        if pos >= len(buf):
+            raise BinaryFormatError("truncated varint")
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return n, pos
+        shift += 7
+
+
+def _put_str(out: bytearray, s: str) -> None:
+    raw = s.encode("utf-8", errors="surrogatepass")
+    _put_uvarint(out, len(raw))
+    out += raw
+
+
+def _get_str(buf: bytes, pos: int) -> Tuple[str, int]:
+    n, pos = _get_uvarint(buf, pos)
+    end = pos + n
+    if end > len(buf):
+        raise BinaryFormatError("truncated string")
+    return buf[pos:end].decode("utf-8", errors="surrogatepass"), end
+
+
+class _Encoder:
+    def __init__(self, d: SegmentDictionary):
+        self.d = d
+        self.defined = False
+
+    def dict_str(self, out: bytearray, s: str) -> None:
+        i = self.d.ids.get(s)
+        if i is not None:
+            out.append(_T_REF)
+            _put_uvarint(out, i)
+            return
+        if len(self.d) >= KASBAH_AUDIT_DICT_MAX:
+            self.value(out, s)
+            return
+        i = len(self.d)
+        self.d.define(i, s)
+        self.defined = True
+        out.append(_T_DEF)
+        _put_uvarint(out, i)
+        _put_str(out, s)
+
+    def value(self, out: bytearray, v: Any) -> None:
+        if v is None:
+            out.append(_T_NULL)
+        elif v is True:
+            out.append(_T_TRUE)
+        elif v is False:
+            out.append(_T_FALSE)
+        elif isinstance(v, int):
+            out.append(_T_INT)
+            _put_uvarint(out, (v << 1) if v >= 0 else ((-v << 1) - 1))
+        elif isinstance(v, float):
+            out.append(_T_FLOAT)
+            out += _F64.pack(v)
+        elif isinstance(v, str):
+            if _HEX64.match(v):
+                out.append(_T_HEX32)
+                out += bytes.fromhex(v)
+            else:
+                out.append(_T_STR)
+                _put_str(out, v)
+        elif isinstance(v, (list, tuple)):
+            out.append(_T_LIST)
+            _put_uvarint(out, len(v))
+            for x in v:
+                self.value(out, x)
+        elif isinstance(v, dict):
+            self.obj(out, v, top=False)
+        else:
+            raise BinaryFormatError(f"unencodable value: {type(v).__name__}")
+
+    def obj(self, out: bytearray, o: Dict[str, Any], top: bool) -> None:
+        keys = sorted(str(k) for k in o if not (top and k in _HASH_KEYS))
+        out.append(_T_OBJ)
+        _put_uvarint(out, len(keys))
+        for k in keys:
+            self.dict_str(out, k)
+            v = o[k]
+            if top and k in DICT_FIELDS and isinstance(v, str):
+                self.dict_str(out, v)
+            else:
+                self.value(out, v)
+
+
+def _decode_value(buf: bytes, pos: int, d: SegmentDictionary) -> Tuple[Any, int]:
+    if pos >= len(buf):
+        raise BinaryFormatError("truncated value")
+    t = buf[pos]
+    pos += 1
+    if t == _T_NULL:
+        return None, pos
+    if t == _T_TRUE:
+        return True, pos
+    if t == _T_FALSE:
+        return False, pos
+    if t == _T_INT:
+        z, pos = _get_uvarint(buf, pos)
+        return (z >> 1) if not z & 1 else -((z + 1) >> 1), pos
+    if t == _T_FLOAT:
+        return _F64.unpack_from(buf, pos)[0], pos + 8
+    if t == _T_STR:
+        return _get_str(buf, pos)
+    if t == _T_HEX32:
+        return bytes(buf[pos:pos + 32]).hex(), pos + 32
+    if t == _T_REF:
+        i, pos = _get_uvarint(buf, pos)
+        return d.get(i), pos
+    if t == _T_DEF:
+        i, pos = _get_uvarint(buf, pos)
+        s, pos = _get_str(buf, pos)
+        d.define(i, s)
+        return s, pos
+    if t == _T_LIST:
+        n, pos = _get_uvarint(buf, pos)
+        out = []
+        for _ in range(n):
+            v, pos = _decode_value(buf, pos, d)
+            out.append(v)
+        return out, pos
+    if t == _T_OBJ:
+        n, pos = _get_uvarint(buf, pos)
+        o: Dict[str, Any] = {}
+        for _ in range(n):
+            k, pos = _decode_value(buf, pos, d)
+            o[str(k)], pos = _decode_value(buf, pos, d)
+        return o, pos
+    raise BinaryFormatError(f"unknown tag 0x{t:02x}")
+
+
+# ---- frames ----
+
+def frame_bytes(payload: bytes) -> bytes:
+    n = _LEN.pack(len(payload))
+    return n + payload + n
+
+
+def encode_frame(rec: Dict[str, Any], d: SegmentDictionary, line: Optional[str] = None) -> bytes:
+    """
+    Binary frame for a full record (including prev_hash/hash). `line` is its
+    canonical JSON line when the caller already has it; records that would
+    not decode back to exactly that line are stored verbatim (FLAG_RAW).
+    """
+    prev = rec.get("prev_hash")
+    h = rec.get("hash")
+    if line is None:
+        line = _canonical(rec)
+    if (
+        isinstance(h, str) and _HEX64.match(h)
+        and isinstance(prev, str) and (prev == "" or _HEX64.match(prev))
+    ):
+        mark = len(d)
+        enc = _Encoder(d)
+        out = bytearray(b"\x00")
+        out += bytes.fromhex(prev) if prev else _ZERO32
+        out += bytes.fromhex(h)
+        try:
+            enc.obj(out, rec, top=True)
+        except Exception:
+            d.truncate(mark)
+        else:
+            out[0] = (FLAG_DEFS if enc.defined else 0) | (0 if prev else FLAG_NO_PREV)
+            return frame_bytes(bytes(out))
+    return raw_frame(line)
+
+
+def raw_frame(line: str) -> bytes:
+    """Frame holding a JSON line verbatim (non-canonical legacy lines)."""
+    return frame_bytes(bytes([FLAG_RAW]) + line.encode("utf-8"))
+
+
+def decode_payload(payload: bytes, d: SegmentDictionary) -> bytes:
+    """Canonical JSON line (no newline) for one frame payload."""
+    if not payload:
+        raise BinaryFormatError("empty frame")
+    flags = payload[0]
+    if flags & FLAG_RAW:
+        return bytes(payload[1:])
+    if len(payload) < 65:
+        raise BinaryFormatError("truncated frame")
+    rec, _ = _decode_value(payload, 65, d)
+    if not isinstance(rec, dict):
+        raise BinaryFormatError("frame body is not an object")
+    rec["prev_hash"] = "" if flags & FLAG_NO_PREV else bytes(payload[1:33]).hex()
+    rec["hash"] = bytes(payload[33:65]).hex()
+    return _canonical(rec).encode("utf-8")
+
+
+def apply_definitions(payload: bytes, d: SegmentDictionary) -> None:
+    """Learn the dictionary entries a frame defines without rendering it."""
+    if payload and payload[0] & FLAG_DEFS and not payload[0] & FLAG_RAW:
+        _decode_value(payload, 65, d)
+
+
+def payload_hash(payload: bytes) -> Optional[str]:
+    """Chain hash of a frame in O(1) (None for a raw frame; parse its JSON instead)."""
+    if len(payload) < 65 or payload[0] & FLAG_RAW:
+        return None
+    return bytes(payload[33:65]).hex()
+
+
+def iter_frames(buf: bytes, base: int = 0) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    (offset, end, payload) for every complete frame in buf; base is buf's
+    offset in the segment. Stops at a partial frame (torn tail or chunk edge).
+    """
+    pos = 0
+    size = len(buf)
+    while pos + 4 <= size:
+        n = _LEN.unpack_from(buf, pos)[0]
+        end = pos + 8 + n
+        if end > size:
+            return
+        if _LEN.unpack_from(buf, end - 4)[0] != n:
+            raise BinaryFormatError(f"frame length mismatch at {base + pos}")
+        yield base + pos, base + end, buf[pos + 4:end - 4]
+        pos = end
+
+
+def read_last_frame(f: Any, end: int, start: int) -> Optional[Tuple[int, bytes]]:
+    """(offset, payload) of the frame ending at `end` in open file f (None if none after `start`)."""
+    if end - start < 8:
+        return None
+    f.seek(end - 4)
+    n = _LEN.unpack(f.read(4))[0]
+    off = end - 8 - n
+    if off < start:
+        return None
+    f.seek(off)
+    raw = f.read(n + 8)
+    if len(raw) != n + 8 or _LEN.unpack_from(raw, 0)[0] != n:
+        return None
+    return off, raw[4:-4]
+
+
+# ---- conversion ----
+
+def convert_segment(src: Path, dst: Path, to: str) -> int:
+    """
+    Rewrite one segment (plain or compressed) as `to` ("bin" or "jsonl").
+    Record bytes change, record content and hashes do not: the header keeps
+    seq/first_index/prev_hash and only its format flag changes. Returns the
+    number of records written.
+    """
+    from .audit_segments import FORMAT_JSONL, iter_lines, read_header, segment_header
+
+    if to not in (FORMAT_BIN, FORMAT_JSONL):
+        raise ValueError(f"unknown format: {to}")
+    hdr = read_header(src)
+    d = SegmentDictionary()
+    n = 0
+    tmp = str(dst) + ".tmp"
+    with open(tmp, "wb") as out:
+        if hdr is not None:
+            out.write(segment_header(
+                int(hdr.get("seq", 1)), str(hdr.get("prev_hash", "")),
+                int(hdr.get("first_index", 0)), int(hdr.get("created_ns", 0)), to,
+            ))
+        elif to == FORMAT_BIN:
+            raise BinaryFormatError("a binary segment needs a header; seal the legacy log first")
+        for _, line in iter_lines(src):
+            if to == FORMAT_BIN:
+                text = line.decode("utf-8")
+                try:
+                    rec = json.loads(text)
+                except Exception:
+                    rec = None
+                if isinstance(rec, dict) and _canonical(rec) == text:
+                    out.write(encode_frame(rec, d, text))
+                else:
+                    out.write(raw_frame(text))
+            else:
+                out.write(line + b"\n")
+            n += 1
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, dst)
+    return n
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Convert Kasbah audit segments between JSONL and binary")
+    ap.add_argument("command", choices=["convert"])
+    ap.add_argument("src")
+    ap.add_argument("dst")
+    ap.add_argument("--to", choices=[FORMAT_BIN, "jsonl"], required=True)
+    args = ap.parse_args(argv)
+    n = convert_segment(Path(args.src), Path(args.dst), args.to)
+    print(json.dumps({"records": n, "format": args.to, "dst": args.dst}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
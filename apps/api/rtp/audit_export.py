@@ -0,0 +1,111 @@
+"""
+Kasbah RTP - streaming, cursor-paginated audit export.
+
+Output is NDJSON: one stored audit line per record, then one trailing
+metadata line
+
+    {"meta": {"next_cursor": "<idx>.<seq>.<offset>", "last_hash": ..., ...}}
+
+A cursor is either a plain record sequence number ("1200": records with
+index >= 1200) or the opaque "<idx>.<seq>.<offset>" token returned as
+next_cursor, which resumes with a single seek. Incremental pulls therefore
+cost proportional to the new records only.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .audit_index import AuditIndex
+from .audit_segments import iter_entries_at, iter_entries_from
+
+
+class CursorError(ValueError):
+    pass
+
+
+def format_cursor(index: int, seq: int, offset: int) -> str:
+    return f"{int(index)}.{int(seq)}.{int(offset)}"
+
+
+def parse_cursor(cursor: Optional[str]) -> Tuple[int, Optional[Tuple[int, int]]]:
+    """
+    Returns (index, (seq, offset) or None). Empty cursor means "from the
+    oldest retained record".
+    """
+    c = (cursor or "").strip()
+    if not c:
+        return 0, None
+    parts = c.split(".")
+    try:
+        if len(parts) == 1:
+            return max(0, int(parts[0])), None
+        if len(parts) == 3:
+            idx, seq, off = (int(p) for p in parts)
+            if idx < 0 or seq < 1 or off < 0:
+                raise CursorError(f"bad cursor: {cursor}")
+            return idx, (seq, off)
+    except ValueError:
+        pass
+    raise CursorError(f"bad cursor: {cursor}")
+
+
+def iter_from_cursor(
+    active_path: Path, cursor: Optional[str], index: Optional[AuditIndex] = None, seg_dir: Optional[Path] = None
+) -> Iterator[Tuple[int, int, int, int, bytes]]:
+    """(index, seq, offset, end, line) for every record after `cursor`."""
+    start, pos = parse_cursor(cursor)
+    if pos is None and index is not None and start > 0:
+        try:
+            near = index.position(start)
+        except Exception:
+            near = None
+        if near is not None:
+            for rec in iter_entries_at(active_path, near[0], near[1], near[2], seg_dir):
+                if rec[0] >= start:
+                    yield rec
+            return
+    if pos is not None:
+        yield from iter_entries_at(active_path, start, pos[0], pos[1], seg_dir)
+        return
+    yield from iter_entries_from(active_path, start, seg_dir)
+
+
+def export_ndjson(
+    active_path: Path,
+    cursor: Optional[str] = None,
+    limit: int = 10000,
+    end_index: Optional[int] = None,
+    index: Optional[AuditIndex] = None,
+    seg_dir: Optional[Path] = None,
+    meta: Optional[Dict[str, Any]] = None,
+) -> Iterator[bytes]:
+    """
+    Yield NDJSON chunks for records after `cursor`, at most `limit` of them
+    (0 = no limit) and none at or beyond `end_index` (the tip when the export
+    started, so a page never chases concurrent writes).
+    """
+    n = 0
+    last_line = b""
+    next_cursor = (cursor or "").strip() or "0"
+    for idx, seq, _off, end, line in iter_from_cursor(active_path, cursor, index, seg_dir):
+        if end_index is not None and idx >= end_index:
+            break
+        if limit and n >= limit:
+            break
+        yield line + b"\n"
+        n += 1
+        last_line = line
+        next_cursor = format_cursor(idx + 1, seq, end)
+
+    last_hash = ""
+    if last_line:
+        try:
+            last_hash = str(json.loads(last_line).get("hash", ""))
+        except Exception:
+            last_hash = ""
+    out = dict(meta or {})
+    out.update({"records": n, "next_cursor": next_cursor, "last_hash": last_hash})
+    yield (json.dumps({"meta": out}, separators=(",", ":"), sort_keys=True) + "\n").encode("utf-8")
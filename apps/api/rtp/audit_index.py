@@ -0,0 +1,396 @@
+"""
+Kasbah RTP - on-disk jti index for the hash-chained audit log.
+
+Maps jti -> (segment seq, byte offset) for every committed record, so
+/api/rtp/explain/{jti} is a B-tree lookup plus one seek per record instead
+of a scan of the log. A sparse positions table (record index -> seq, offset;
+one row per committed batch) lets cursors given as plain sequence numbers
+seek close to their record.
+
+Secondary indexes for audit queries (see audit_query.py) are keyed by
+(field, value, time bucket, record index) for the fields in INDEXED_FIELDS
+(top-level or under "extra"), so "AUTHZ_DENY for agent X in the last 6 hours"
+touches only the matching rows of the buckets in that window. A times table
+keeps the first record of every bucket for queries with no field filter.
+Buckets are KASBAH_AUDIT_INDEX_BUCKET_SEC wide (changing it re-indexes).
+
+The index is fed by the ledger's commit listener and
+can be rebuilt offline from existing segments / audit.jsonl:
+
+    python -m apps.api.rtp.audit_index rebuild --data-dir .kasbah
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .audit_ledger import CommittedRecord
+from .audit_segments import (
+    SegmentManifest,
+    default_segment_dir,
+    iter_records_from,
+    list_segments,
+    read_line_at,
+)
+
+
+KASBAH_AUDIT_INDEX_BUCKET_SEC = int(os.environ.get("KASBAH_AUDIT_INDEX_BUCKET_SEC", "60"))
+
+INDEXED_FIELDS = ("event", "agent_id", "tool_name", "principal")
+
+# bumped when tables are added: the next catch-up re-scans the log once
+SCHEMA_VERSION = 2
+
+
+def default_index_path(active_path: Path) -> Path:
+    return Path(active_path).with_suffix(".index.sqlite")
+
+
+def record_ts_ns(rec: Dict[str, Any]) -> Optional[int]:
+    """Record time in ns: ts_ns (ledger records) or ts in seconds (legacy)."""
+    try:
+        if rec.get("ts_ns") is not None:
+            return int(rec["ts_ns"])
+        if rec.get("ts") is not None:
+            return int(float(rec["ts"]) * 1_000_000_000)
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def field_value(rec: Dict[str, Any], field: str) -> Optional[str]:
+    v = rec.get(field)
+    if v is None and isinstance(rec.get("extra"), dict):
+        v = rec["extra"].get(field)
+    if v is None and field == "tool_name":
+        v = rec.get("tool")  # kernel gate records
+    if v is None or v == "":
+        return None
+    return str(v)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jti_index (
+    jti TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (jti, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS positions (
+    idx INTEGER PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attr_index (
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (field, value, bucket, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS times (
+    bucket INTEGER PRIMARY KEY,
+    idx INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('indexed_through', 0);
+"""
+
+# (field, value, bucket, idx, seq, offset)
+AttrRow = Tuple[str, str, int, int, int, int]
+# (bucket, idx, seq, offset)
+TimeRow = Tuple[int, int, int, int]
+
+
+class AuditIndex:
+    """
+    SQLite (WAL) index beside the audit log. One connection per thread;
+    writes come from the ledger writer thread, reads from request threads
+    and other processes.
+    """
+
+    def __init__(self, db_path: Path, bucket_sec: int = KASBAH_AUDIT_INDEX_BUCKET_SEC):
+        self.db_path = Path(db_path)
+        self.bucket_ns = max(1, int(bucket_sec)) * 1_000_000_000
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            c = sqlite3.connect(str(self.db_path), timeout=10.0)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            with self._init_lock:
+                if not self._ready:
+                    c.executescript(_SCHEMA)
+                    self._migrate(c)
+                    c.commit()
+                    self._ready = True
+            self._local.conn = c
+        return c
+
+    def _migrate(self, c: sqlite3.Connection) -> None:
+        meta = dict(c.execute("SELECT key, value FROM meta").fetchall())
+        if meta.get("schema") == SCHEMA_VERSION and meta.get("bucket_ns") == self.bucket_ns:
+            return
+        # Older index or another bucket width: rebuild the query tables on the
+        # next catch-up (jti / positions rows are re-inserted idempotently).
+        c.execute("DELETE FROM attr_index")
+        c.execute("DELETE FROM times")
+        c.execute("UPDATE meta SET value = 0 WHERE key = 'indexed_through'")
+        c.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [("schema", SCHEMA_VERSION), ("bucket_ns", self.bucket_ns)],
+        )
+
+    def close(self) -> None:
+        c = getattr(self._local, "conn", None)
+        if c is not None:
+            c.close()
+            self._local.conn = None
+
+    # ---- writes ----
+
+    def _rows(self, committed: Iterable[Tuple[int, int, int, Dict[str, Any]]]) -> List[Tuple[str, int, int, int]]:
+        rows = []
+        for idx, seq, off, rec in committed:
+            jti = rec.get("jti")
+            if jti:
+                rows.append((str(jti), idx, seq, off))
+        return rows
+
+    def _attr_rows(self, committed: Iterable[Tuple[int, int, int, Dict[str, Any]]]) -> Tuple[List[AttrRow], List[TimeRow]]:
+        attrs: List[AttrRow] = []
+        times: Dict[int, TimeRow] = {}
+        ts = None
+        for idx, seq, off, rec in committed:
+            # records without a timestamp share their predecessor's bucket
+            t = record_ts_ns(rec)
+            ts = t if t is not None else (ts if ts is not None else time.time_ns())
+            bucket = ts // self.bucket_ns
+            if bucket not in times:
+                times[bucket] = (bucket, idx, seq, off)
+            for field in INDEXED_FIELDS:
+                v = field_value(rec, field)
+                if v is not None:
+                    attrs.append((field, v, bucket, idx, seq, off))
+        return attrs, list(times.values())
+
+    def _store(
+        self,
+        rows: List[Tuple[str, int, int, int]],
+        first: int,
+        end: int,
+        pos: Optional[Tuple[int, int, int]] = None,
+        attrs: Optional[Tuple[List[AttrRow], List[TimeRow]]] = None,
+    ) -> None:
+        c = self._conn()
+        with c:
+            if rows:
+                c.executemany("INSERT OR IGNORE INTO jti_index (jti, idx, seq, offset) VALUES (?, ?, ?, ?)", rows)
+            if attrs is not None:
+                c.executemany(
+                    "INSERT OR IGNORE INTO attr_index (field, value, bucket, idx, seq, offset) VALUES (?, ?, ?, ?, ?, ?)",
+                    attrs[0],
+                )
+                # keep the earliest record of each bucket
+                c.executemany(
+                    "INSERT INTO times (bucket, idx, seq, offset) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (bucket) DO UPDATE SET idx = excluded.idx, seq = excluded.seq, offset = excluded.offset "
+                    "WHERE excluded.idx < times.idx",
+                    attrs[1],
+                )
+            if pos is not None:
+                c.execute("INSERT OR IGNORE INTO positions (idx, seq, offset) VALUES (?, ?, ?)", pos)
+            # only advance the watermark over a contiguous range
+            c.execute(
+                "UPDATE meta SET value = ? WHERE key = 'indexed_through' AND value >= ? AND value < ?",
+                (end, first, end),
+            )
+
+    def on_commit(self, committed: List[CommittedRecord]) -> None:
+        """Ledger commit listener."""
+        if not committed:
+            return
+        quads = [(r.index, r.seq, r.offset, r.record) for r in committed]
+        head = committed[0]
+        self._store(self._rows(quads), head.index, committed[-1].index + 1, (head.index, head.seq, head.offset), self._attr_rows(quads))
+
+    def indexed_through(self) -> int:
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'indexed_through'").fetchone()
+        return int(row[0]) if row else 0
+
+    def catch_up(self, active_path: Path, seg_dir: Optional[Path] = None, batch: int = 5000) -> int:
+        """
+        Index every record after the watermark (records committed while the
+        index was unavailable, or a pre-existing log). Returns records scanned.
+        """
+        seg_dir = Path(seg_dir) if seg_dir is not None else default_segment_dir(active_path)
+        c = self._conn()
+        pruned = SegmentManifest.load(seg_dir).pruned_through_seq
+        if pruned:
+            with c:
+                c.execute("DELETE FROM jti_index WHERE seq <= ?", (pruned,))
+                c.execute("DELETE FROM positions WHERE seq <= ?", (pruned,))
+                c.execute("DELETE FROM attr_index WHERE seq <= ?", (pruned,))
+                c.execute("DELETE FROM times WHERE seq <= ?", (pruned,))
+
+        start = self.indexed_through()
+        scanned = 0
+        pending: List[Tuple[int, int, int, Dict[str, Any]]] = []
+        first = start
+        for idx, seq, off, line in iter_records_from(active_path, start, seg_dir):
+            try:
+                rec = json.loads(line)
+            except Exception:
+                rec = {}
+            pending.append((idx, seq, off, rec))
+            scanned += 1
+            if len(pending) >= batch:
+                self._store(self._rows(pending), first, idx + 1, pending[0][:3], self._attr_rows(pending))
+                first = idx + 1
+                pending = []
+        if pending:
+            self._store(self._rows(pending), first, pending[-1][0] + 1, pending[0][:3], self._attr_rows(pending))
+        return scanned
+
+    # ---- reads ----
+
+    def lookup(self, jti: str, limit: int = 2000) -> List[Tuple[int, int, int]]:
+        """(index, seq, offset) of records for jti, oldest first."""
+        cur = self._conn().execute(
+            "SELECT idx, seq, offset FROM jti_index WHERE jti = ? ORDER BY idx LIMIT ?",
+            (str(jti), max(1, int(limit))),
+        )
+        return [(int(a), int(b), int(o)) for a, b, o in cur.fetchall()]
+
+    def position(self, index: int) -> Optional[Tuple[int, int, int]]:
+        """Closest known (index, seq, offset) at or before record `index`."""
+        row = self._conn().execute(
+            "SELECT idx, seq, offset FROM positions WHERE idx <= ? ORDER BY idx DESC LIMIT 1",
+            (int(index),),
+        ).fetchone()
+        return (int(row[0]), int(row[1]), int(row[2])) if row else None
+
+
+    def bucket_range(self, since_ns: Optional[int], until_ns: Optional[int]) -> Tuple[int, int]:
+        lo = int(since_ns) // self.bucket_ns if since_ns is not None else -(1 << 62)
+        hi = int(until_ns) // self.bucket_ns if until_ns is not None else 1 << 62
+        return lo, hi
+
+    def query(
+        self,
+        filters: Dict[str, Sequence[str]],
+        since_ns: Optional[int] = None,
+        until_ns: Optional[int] = None,
+        after: int = -1,
+        limit: int = 500,
+    ) -> List[Tuple[int, int, int]]:
+        """
+        (index, seq, offset) of records after index `after` matching every
+        field in `filters` (any of its values), oldest first. The time window
+        is bucket-granular: callers re-check the record's own timestamp.
+        """
+        lo, hi = self.bucket_range(since_ns, until_ns)
+        parts = []
+        params: List[Any] = []
+        for field, values in filters.items():
+            values = [str(v) for v in values]
+            if field not in INDEXED_FIELDS or not values:
+                raise ValueError(f"not an indexed field: {field}")
+            parts.append(
+                "SELECT idx, seq, offset FROM attr_index WHERE field = ? AND value IN (%s) "
+                "AND bucket BETWEEN ? AND ? AND idx > ?" % ",".join("?" * len(values))
+            )
+            params += [field, *values, lo, hi, int(after)]
+        if not parts:
+            raise ValueError("query needs at least one field filter")
+        sql = " INTERSECT ".join(parts) + " ORDER BY idx LIMIT ?"
+        cur = self._conn().execute(sql, (*params, max(1, int(limit))))
+        return [(int(a), int(b), int(o)) for a, b, o in cur.fetchall()]
+
+    def first_in_window(self, since_ns: Optional[int]) -> Optional[Tuple[int, int, int]]:
+        """(index, seq, offset) of the earliest record in any bucket from since_ns on."""
+        lo, _ = self.bucket_range(since_ns, None)
+        row = self._conn().execute(
+            "SELECT idx, seq, offset FROM times WHERE bucket >= ? ORDER BY idx LIMIT 1", (lo,)
+        ).fetchone()
+        return (int(row[0]), int(row[1]), int(row[2])) if row else None
+
+
+def explain(index: AuditIndex, active_path: Path, jti: str, limit: int = 200, seg_dir: Optional[Path] = None) -> List[Dict[str, Any]]:
+    """Full trace for jti: one index lookup, then one seek per record."""
+    hits = index.lookup(jti, limit)
+    if not hits:
+        return []
+    paths = {info.seq: p for info, p in list_segments(active_path, seg_dir)}
+    trace = []
+    for _, seq, off in hits:
+        p = paths.get(seq)
+        if p is None:
+            continue  # segment removed by retention
+        line = read_line_at(p, off)
+        try:
+            rec = json.loads(line)
+        except Exception:
+            continue
+        if str(rec.get("jti") or "") == str(jti):
+            trace.append(rec)
+    return trace
+
+
+def rebuild(active_path: Path, db_path: Optional[Path] = None, seg_dir: Optional[Path] = None) -> int:
+    """Drop and rebuild the index from the segments on disk."""
+    db_path = Path(db_path) if db_path is not None else default_index_path(active_path)
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            Path(str(db_path) + suffix).unlink()
+        except FileNotFoundError:
+            pass
+    idx = AuditIndex(db_path)
+    try:
+        return idx.catch_up(active_path, seg_dir)
+    finally:
+        idx.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Kasbah audit jti index")
+    ap.add_argument("command", choices=["rebuild", "catch-up", "lookup"])
+    ap.add_argument("jti", nargs="?")
+    ap.add_argument("--data-dir", default=".kasbah")
+    args = ap.parse_args(argv)
+
+    active = Path(args.data_dir) / "audit.jsonl"
+    if args.command == "rebuild":
+        print(json.dumps({"indexed": rebuild(active)}))
+    elif args.command == "catch-up":
+        print(json.dumps({"indexed": AuditIndex(default_index_path(active)).catch_up(active)}))
+    else:
+        if not args.jti:
+            ap.error("lookup needs a jti")
+        trace = explain(AuditIndex(default_index_path(active)), active, args.jti)
+        print(json.dumps({"jti": args.jti, "found": bool(trace), "trace": trace}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,1021 @@
+"""
+Kasbah RTP - hash-chained audit ledger (group commit).
+
+One writer thread per process owns the chain tip. Request threads hand
+records over through a queue and the writer commits them in batches:
+one write + one fsync per batch, under the cross-process flock.
+
+Chaining is unchanged from the original append_audit:
+    hash = sha256(prev_hash + "\n" + canonical_json(record_without_hashes))
+
+The chain tip (last hash, record count, byte offset) is checkpointed in a
+small sidecar file after every commit, so startup and cross-process handoff
+never read the log itself beyond its final line.
+
+The log is segmented (see audit_segments.py): when the active segment
+reaches its size/age limit the writer seals it under the same flock, so
+rotation can neither race an append nor break the prev_hash chain.
+Sealed segments are then compressed into seekable frames in the
+background (KASBAH_AUDIT_COMPRESS); only the manifest swap takes the flock.
+New segments are written as JSON lines or compact binary frames per
+KASBAH_AUDIT_FORMAT; the hash chain is the same in both.
+
+Durability (KASBAH_AUDIT_DURABILITY):
+    strict    append() returns once its batch is fsynced (default)
+    interval  append() returns once its batch is written; the writer fsyncs
+              at most KASBAH_AUDIT_FSYNC_INTERVAL_MS later (bounded loss window)
+    relaxed   append() returns once queued; fsync only on flush/seal/close
+The queue is bounded (KASBAH_AUDIT_QUEUE_MAX): producers block for up to
+the commit timeout when it is full, then the record is counted as dropped.
+"""
+
+from __future__ import annotations
+
+import atexit
+import fcntl
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .audit_binary import FORMAT_BIN, SegmentDictionary, encode_frame
+from .audit_segments import (
+    FORMAT_JSONL,
+    FORMATS,
+    KASBAH_AUDIT_CODEC,
+    KASBAH_AUDIT_COMPRESS,
+    KASBAH_AUDIT_FORMAT,
+    KASBAH_AUDIT_FRAME_RECORDS,
+    KASBAH_AUDIT_RETAIN_DAYS,
+    KASBAH_AUDIT_RETAIN_SEGMENTS,
+    KASBAH_AUDIT_SEGMENT_MAX_AGE_SEC,
+    KASBAH_AUDIT_SEGMENT_MAX_BYTES,
+    FRAME_INDEX_SUFFIX,
+    FrameIndex,
+    SegmentInfo,
+    SegmentManifest,
+    compress_segment,
+    default_segment_dir,
+    first_record_offset,
+    frame_hash_before,
+    iter_entries,
+    list_segments,
+    parse_header,
+    prune,
+    read_header,
+    read_tail_records,
+    scan_dictionary,
+    scan_frames,
+    segment_format,
+    segment_header,
+    segment_name,
+    should_rotate,
+)
+
+
+KASBAH_AUDIT_BATCH_MAX = int(os.environ.get("KASBAH_AUDIT_BATCH_MAX", "256"))
+KASBAH_AUDIT_LINGER_MS = float(os.environ.get("KASBAH_AUDIT_LINGER_MS", "2"))
+KASBAH_AUDIT_COMMIT_TIMEOUT_SEC = float(os.environ.get("KASBAH_AUDIT_COMMIT_TIMEOUT_SEC", "5"))
+KASBAH_AUDIT_DURABILITY = os.environ.get("KASBAH_AUDIT_DURABILITY", "strict").strip().lower()
+KASBAH_AUDIT_FSYNC_INTERVAL_MS = float(os.environ.get("KASBAH_AUDIT_FSYNC_INTERVAL_MS", "100"))
+KASBAH_AUDIT_QUEUE_MAX = int(os.environ.get("KASBAH_AUDIT_QUEUE_MAX", "10000"))
+
+DURABILITY_STRICT = "strict"
+DURABILITY_INTERVAL = "interval"
+DURABILITY_RELAXED = "relaxed"
+DURABILITY_MODES = (DURABILITY_STRICT, DURABILITY_INTERVAL, DURABILITY_RELAXED)
+
+_HASH_KEYS = ("hash", "prev_hash")
+
+
+def audit_hash_line(prev_hex: str, line: str) -> str:
+    h = hashlib.sha256()
+    h.update((prev_hex or "").encode("utf-8"))
+    h.update(b"\n")
+    h.update(line.encode("utf-8"))
+    return h.hexdigest()
+
+
+def canonical_json(obj: Any) -> str:
+    return json.dumps(obj, separators=(",", ":"), sort_keys=True)
+
+
+def encode_record(rec: Dict[str, Any], prev_hash: str) -> Tuple[str, str]:
+    """
+    Returns (hash, out_line) for rec chained onto prev_hash.
+
+    Each top-level value is serialized exactly once; the hashed body and the
+    stored line are assembled from the same fragments, so out_line is
+    byte-identical to canonical_json(rec | {"prev_hash", "hash"}).
+    """
+    parts = {str(k): canonical_json(v) for k, v in rec.items() if k not in _HASH_KEYS}
+    body = "{" + ",".join(json.dumps(k) + ":" + parts[k] for k in sorted(parts)) + "}"
+    h = audit_hash_line(prev_hash, body)
+    parts["prev_hash"] = json.dumps(prev_hash)
+    parts["hash"] = json.dumps(h)
+    out_line = "{" + ",".join(json.dumps(k) + ":" + parts[k] for k in sorted(parts)) + "}"
+    return h, out_line
+
+
+def _hash_of_line(line: bytes) -> Optional[str]:
+    try:
+        last = json.loads(line.decode("utf-8", errors="replace"))
+        if isinstance(last, str):
+            last = json.loads(last)
+        return str(last.get("hash", ""))[:64]
+    except Exception:
+        return None
+
+
+def read_last_line(path: Path, end: Optional[int] = None, block: int = 4096) -> Tuple[bytes, int]:
+    """
+    Reverse-seek from `end` (default: EOF) and return (last_line, start_offset)
+    of the last non-empty line before it. Cost is proportional to the line
+    length, not the file size.
+    """
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell() if end is None else min(int(end), f.tell())
+            # skip trailing newline(s)
+            buf = b""
+            while pos > 0:
+                step = min(block, pos)
+                pos -= step
+                f.seek(pos)
+                buf = f.read(step) + buf
+                stripped = buf.rstrip(b"\r\n")
+                if not stripped:
+                    continue
+                nl = stripped.rfind(b"\n")
+                if nl >= 0:
+                    return stripped[nl + 1:], pos + nl + 1
+            stripped = buf.rstrip(b"\r\n")
+            return stripped, 0
+    except FileNotFoundError:
+        return b"", 0
+
+
+def _count_lines(path: Path, start: int = 0, block: int = 1 << 20) -> int:
+    n = 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        while True:
+            chunk = f.read(block)
+            if not chunk:
+                return n
+            n += chunk.count(b"\n")
+
+
+@dataclass
+class ChainTip:
+    last_hash: str = ""
+    count: int = 0
+    offset: int = 0
+
+
+def default_tip_path(path: Path) -> Path:
+    return Path(path).with_suffix(".tip.json")
+
+
+def _read_checkpoint(tip_path: Path) -> Optional[ChainTip]:
+    try:
+        with open(tip_path, "r", encoding="utf-8") as f:
+            obj = json.load(f) or {}
+        return ChainTip(
+            last_hash=str(obj.get("last_hash", "")),
+            count=int(obj.get("count", 0)),
+            offset=int(obj.get("offset", 0)),
+        )
+    except Exception:
+        return None
+
+
+def save_checkpoint(tip_path: Path, tip: ChainTip) -> None:
+    # Atomic replace; no fsync needed because load_tip() validates the
+    # checkpoint against the log and repairs a stale one from the tail.
+    tmp = str(tip_path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(asdict(tip), f, separators=(",", ":"))
+    os.replace(tmp, tip_path)
+
+
+def load_tip(path: Path, tip_path: Optional[Path] = None) -> ChainTip:
+    """
+    Recover the chain tip in O(1):
+      1. checkpoint matches file size and the line ending at its offset
+         carries its hash -> trust it;
+      2. checkpoint is behind the file (crash between fsync and checkpoint,
+         or a writer without checkpoints) -> count only the lines after it;
+      3. no usable checkpoint -> reverse-seek the final line for the hash
+         (the record count needs one newline scan; a one-off migration cost).
+    """
+    path = Path(path)
+    tip_path = tip_path or default_tip_path(path)
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        return ChainTip()
+    if size == 0:
+        return ChainTip()
+
+    cp = _read_checkpoint(tip_path)
+    hdr = read_header(path)
+    if segment_format(hdr) == FORMAT_BIN:
+        return _load_tip_bin(path, hdr or {}, cp, size)
+    if cp is not None and 0 < cp.offset <= size:
+        line, _ = read_last_line(path, end=cp.offset)
+        if _hash_of_line(line) == cp.last_hash:
+            if cp.offset == size:
+                return cp
+            line, _ = read_last_line(path)
+            return ChainTip(
+                last_hash=_hash_of_line(line) or "",
+                count=cp.count + _count_lines(path, cp.offset),
+                offset=size,
+            )
+
+    base = int((hdr or {}).get("first_index", 0))
+    line, _ = read_last_line(path)
+    seg = parse_header(line)
+    if seg is not None:
+        # header-only segment: the tip is the previous segment's final hash
+        return ChainTip(last_hash=str(seg.get("prev_hash", "")), count=base, offset=size)
+    n = _count_lines(path) - (1 if hdr is not None else 0)
+    return ChainTip(last_hash=_hash_of_line(line) or "", count=base + n, offset=size)
+
+
+def _load_tip_bin(path: Path, hdr: Dict[str, Any], cp: Optional[ChainTip], size: int) -> ChainTip:
+    """
+    load_tip for a binary segment. The checkpoint is checked through the
+    length trailer of the frame ending at its offset; otherwise frames are
+    walked by their length prefixes (no decoding). The offset returned is the
+    end of the last complete frame, so a torn tail shows up as offset < size.
+    """
+    hend = first_record_offset(path)
+    if cp is not None and hend < cp.offset <= size and frame_hash_before(path, cp.offset, hend) == cp.last_hash:
+        if cp.offset == size:
+            return cp
+        n, end, h = scan_frames(path, cp.offset)
+        return ChainTip(last_hash=h or cp.last_hash, count=cp.count + n, offset=end)
+    n, end, h = scan_frames(path, hend)
+    base = int(hdr.get("first_index", 0))
+    return ChainTip(last_hash=h or str(hdr.get("prev_hash", "")), count=base + n, offset=max(end, hend))
+
+
+def _segment_tail_lines(path: Path, limit: int, block: int) -> List[str]:
+    """The last `limit` (> 0) record lines of one segment, read from its end."""
+    if segment_format(read_header(path)) == FORMAT_BIN:
+        return [ln.decode("utf-8", errors="replace") for ln in read_tail_records(path, limit)]
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            buf = b""
+            while pos > 0 and buf.count(b"\n") <= limit:
+                step = min(block, pos)
+                pos -= step
+                f.seek(pos)
+                buf = f.read(step) + buf
+    except FileNotFoundError:
+        return []
+    lines = buf.decode("utf-8", errors="replace").splitlines()
+    if pos > 0:
+        lines = lines[1:]  # first line may be partial
+    return [ln for ln in lines if ln.strip() and parse_header(ln) is None][-limit:]
+
+
+def read_tail_lines(path: Path, limit: int, block: int = 65536, seg_dir: Optional[Path] = None) -> List[str]:
+    """
+    Return the last `limit` record lines of the log whose active segment is
+    `path`, walking back through the sealed segments as far as needed (all
+    retained lines when limit <= 0). The active segment is read from its
+    end, not whole.
+    """
+    limit = int(limit)
+    chunks: List[List[str]] = []
+    need = limit
+    for i, (_info, seg) in enumerate(reversed(list_segments(path, seg_dir))):
+        if i == 0 and limit > 0:
+            lines = _segment_tail_lines(seg, need, block)
+        else:
+            tail: "deque[bytes]" = deque(maxlen=need if limit > 0 else None)
+            try:
+                tail.extend(line for _off, _end, line in iter_entries(seg))
+            except FileNotFoundError:
+                if i > 0:
+                    break  # pruned meanwhile: nothing older is left
+            lines = [ln.decode("utf-8", errors="replace") for ln in tail]
+        chunks.append(lines)
+        need -= len(lines)
+        if limit > 0 and need <= 0:
+            break
+    return [ln for chunk in reversed(chunks) for ln in chunk]
+
+
+@dataclass
+class CommittedRecord:
+    """A record as committed: global index, segment seq and byte offset in that segment."""
+    index: int
+    seq: int
+    offset: int
+    record: Dict[str, Any]
+    line: str
+    end: int = 0  # offset of the next record (export cursor position)
+
+
+CommitListener = Callable[[List[CommittedRecord]], None]
+
+
+class _Pending:
+    # recs: records committed together (always in the same batch); [] marks a flush
+    __slots__ = ("recs", "done", "ok", "t0", "callback")
+
+    def __init__(self, recs: List[Dict[str, Any]], callback: Optional[Callable[["_Pending"], None]] = None):
+        self.recs = recs
+        self.done = threading.Event()
+        self.ok = False
+        self.t0 = time.perf_counter()
+        self.callback = callback
+
+
+class AuditLedger:
+    """
+    Single-writer, group-commit audit log.
+
+    append() may be called from any thread. The writer thread drains the
+    queue into batches of at most batch_max records, waiting at most
+    linger_ms after the first record for more to arrive, then commits the
+    whole batch with one write() and (in strict mode) one fsync().
+
+    Before a batch is written the active segment is sealed into seg_dir if
+    it has reached segment_max_bytes / segment_max_age_sec; retention then
+    keeps at most retain_segments sealed segments / retain_days of them
+    (0 disables either limit).
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        lock_path: Path,
+        batch_max: int = KASBAH_AUDIT_BATCH_MAX,
+        linger_ms: float = KASBAH_AUDIT_LINGER_MS,
+        tip_path: Optional[Path] = None,
+        seg_dir: Optional[Path] = None,
+        segment_max_bytes: int = KASBAH_AUDIT_SEGMENT_MAX_BYTES,
+        segment_max_age_sec: int = KASBAH_AUDIT_SEGMENT_MAX_AGE_SEC,
+        retain_segments: int = KASBAH_AUDIT_RETAIN_SEGMENTS,
+        retain_days: float = KASBAH_AUDIT_RETAIN_DAYS,
+        compress: bool = KASBAH_AUDIT_COMPRESS,
+        codec: str = KASBAH_AUDIT_CODEC,
+        frame_records: int = KASBAH_AUDIT_FRAME_RECORDS,
+        format: str = KASBAH_AUDIT_FORMAT,
+        durability: str = KASBAH_AUDIT_DURABILITY,
+        fsync_interval_ms: float = KASBAH_AUDIT_FSYNC_INTERVAL_MS,
+        queue_max: int = KASBAH_AUDIT_QUEUE_MAX,
+    ):
+        self.path = Path(path)
+        self.lock_path = Path(lock_path)
+        self.tip_path = Path(tip_path) if tip_path is not None else default_tip_path(self.path)
+        self.seg_dir = Path(seg_dir) if seg_dir is not None else default_segment_dir(self.path)
+        self.segment_max_bytes = int(segment_max_bytes)
+        self.segment_max_age_sec = int(segment_max_age_sec)
+        self.retain_segments = int(retain_segments)
+        self.retain_days = float(retain_days)
+        self.compress = bool(compress)
+        self.codec = str(codec)
+        self.frame_records = max(1, int(frame_records))
+        self.format = format if format in FORMATS else FORMAT_JSONL
+        self.durability = durability if durability in DURABILITY_MODES else DURABILITY_STRICT
+        self.fsync_interval_sec = max(0.0, float(fsync_interval_ms)) / 1000.0
+        self.queue_max = max(0, int(queue_max))
+        self.batch_max = max(1, int(batch_max))
+        self.linger_sec = max(0.0, float(linger_ms)) / 1000.0
+
+        self._q: "queue.Queue[Optional[_Pending]]" = queue.Queue(self.queue_max)
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+        # Chain tip as last seen by this process. If the active file's inode
+        # or size differs under the flock, another process appended (or
+        # rotated) and the tip is reloaded from the checkpoint it left behind.
+        self._tip: Optional[ChainTip] = None
+        self._tip_ino = 0
+        self._active_seq = 1
+        self._active_created_ns = 0
+        self._active_format = FORMAT_JSONL
+        # string table of a binary active segment, as written by this process
+        self._dict: Optional[SegmentDictionary] = None
+        self._listeners: List[CommitListener] = []
+        self._compactor: Optional[threading.Thread] = None
+
+        # written but not yet fsynced (interval / relaxed): the last file
+        # written, kept open so a later rename cannot make us sync the wrong one
+        self._unsynced: Optional[Any] = None
+        self._last_sync = time.monotonic()
+
+        # counters bumped by producer threads (the rest belong to the writer)
+        self._lock = threading.Lock()
+        self.batches_committed = 0
+        self.records_committed = 0
+        self.records_dropped = 0
+        self.commit_failures = 0
+        self.fsyncs = 0
+        self._latency_ms: "deque[float]" = deque(maxlen=1024)
+        self._latency_max_ms = 0.0
+
+    def add_listener(self, fn: CommitListener) -> None:
+        """
+        fn(committed) runs on the writer thread after each batch this process
+        commits: once it is written (fsynced only in strict mode; interval and
+        relaxed sync later) and the cross-process flock is released, so a slow
+        listener never holds up other writers. Batches arrive in chain order;
+        other processes' commits are not delivered. Listener errors never fail
+        the commit.
+        """
+        self._listeners.append(fn)
+
+    # ---- producer side ----
+
+    def append(self, rec: Dict[str, Any], wait: Optional[bool] = None, timeout: Optional[float] = None) -> bool:
+        """
+        Queue rec for commit. With wait (default: every mode but relaxed),
+        blocks until its batch is committed - fsynced in strict mode, written
+        in interval mode - and returns whether the commit succeeded. Blocks
+        for at most `timeout` while the queue is full (backpressure).
+        """
+        return self.append_many([rec], wait=wait, timeout=timeout)
+
+    def append_many(
+        self, recs: List[Dict[str, Any]], wait: Optional[bool] = None, timeout: Optional[float] = None
+    ) -> bool:
+        """
+        Like append(), for records that belong together (e.g. everything one
+        consume logs): they are queued as one unit and committed adjacent,
+        in order, in a single batch write.
+        """
+        recs = list(recs)
+        if not recs:
+            return True
+        if wait is None:
+            wait = self.durability != DURABILITY_RELAXED
+        timeout = KASBAH_AUDIT_COMMIT_TIMEOUT_SEC if timeout is None else timeout
+        p = _Pending(recs)
+        if not self._put(p, timeout):
+            return False
+        if not wait:
+            return True
+        if not p.done.wait(timeout):
+            return False
+        return p.ok
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def submit(self, rec: Optional[Dict[str, Any]], callback: Callable[["_Pending"], None]) -> bool:
+        """
+        Non-blocking enqueue; callback(pending) runs on the writer thread once
+        rec is committed (rec=None: once everything before it is fsynced).
+        Returns False when the queue is full or the ledger closed.
+        """
+        return self._put(_Pending([] if rec is None else [rec], callback), None)
+
+    def _put(self, p: _Pending, timeout: Optional[float]) -> bool:
+        if self._closed:
+            return False
+        self._ensure_started()
+        try:
+            if timeout is None:
+                self._q.put_nowait(p)
+            else:
+                self._q.put(p, timeout=timeout)
+        except queue.Full:
+            if p.recs and timeout is not None:
+                self.note_dropped(len(p.recs))
+            return False
+        return True
+
+    def note_dropped(self, n: int) -> None:
+        """Count n records a producer gave up on (queue full or ledger closed)."""
+        with self._lock:
+            self.records_dropped += n
+
+    def flush(self, timeout: float = KASBAH_AUDIT_COMMIT_TIMEOUT_SEC) -> bool:
+        """Block until every record queued before this call is committed and fsynced."""
+        if self._thread is None:
+            return True
+        p = _Pending([])
+        try:
+            self._q.put(p, timeout=timeout)
+        except queue.Full:
+            return False
+        return p.done.wait(timeout) and p.ok
+
+    def metrics(self) -> Dict[str, Any]:
+        lat = sorted(self._latency_ms)
+
+        def _pct(q: float) -> float:
+            return round(lat[min(len(lat) - 1, int(q * len(lat)))], 3) if lat else 0.0
+
+        return {
+            "durability": self.durability,
+            "format": self.format,
+            "queue_depth": self._q.qsize(),
+            "queue_max": self.queue_max,
+            "batches_committed": self.batches_committed,
+            "records_committed": self.records_committed,
+            "records_dropped": self.records_dropped,
+            "commit_failures": self.commit_failures,
+            "fsyncs": self.fsyncs,
+            "unsynced": self._unsynced is not None,
+            "commit_latency_ms": {
+                "p50": _pct(0.50),
+                "p99": _pct(0.99),
+                "max": round(self._latency_max_ms, 3),
+                "samples": len(lat),
+            },
+        }
+
+    def close(self, timeout: float = KASBAH_AUDIT_COMMIT_TIMEOUT_SEC) -> None:
+        with self._start_lock:
+            if self._closed:
+                return
+            self._closed = True
+            t = self._thread
+        if t is None:
+            return
+        self._q.put(None)
+        t.join(timeout)
+        c = self._compactor
+        if c is not None:
+            c.join(timeout)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            t = threading.Thread(target=self._run, name="kasbah-audit-writer", daemon=True)
+            t.start()
+            self._thread = t
+
+    # ---- writer side ----
+
+    def _hold_unsynced(self, f: Any) -> None:
+        prev = self._unsynced
+        if prev is not None:
+            try:
+                same = os.fstat(prev.fileno()).st_ino == os.fstat(f.fileno()).st_ino
+            except Exception:
+                same = False
+            if same:
+                prev.close()  # fsync through the new handle covers the same inode
+            else:
+                self._unsynced = prev
+                self._sync_pending()
+        self._unsynced = f
+
+    def _sync_due_in(self) -> Optional[float]:
+        """Seconds until unsynced data must be fsynced (None: nothing scheduled)."""
+        if self._unsynced is None or self.durability != DURABILITY_INTERVAL:
+            return None
+        return max(0.0, self._last_sync + self.fsync_interval_sec - time.monotonic())
+
+    def _sync_pending(self) -> bool:
+        f = self._unsynced
+        self._unsynced = None
+        if f is None:
+            return True
+        try:
+            os.fsync(f.fileno())
+            self.fsyncs += 1
+            return True
+        except Exception:
+            return False
+        finally:
+            self._last_sync = time.monotonic()
+            try:
+                f.close()
+            except Exception:
+                pass
+
+    def _next_batch(self) -> Tuple[List[_Pending], bool]:
+        while True:
+            wait = self._sync_due_in()
+            try:
+                first = self._q.get() if wait is None else self._q.get(timeout=wait)
+                break
+            except queue.Empty:
+                self._sync_pending()
+        if first is None:
+            return [], True
+        batch = [first]
+        n = len(first.recs)
+        stop = False
+        deadline = time.monotonic() + self.linger_sec
+        while n < self.batch_max:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._q.get_nowait() if remaining <= 0 else self._q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+            n += len(item.recs)
+        return batch, stop
+
+    def _complete(self, batch: List[_Pending]) -> None:
+        recs = [r for p in batch for r in p.recs]
+        ok = False
+        try:
+            ok = self._commit(recs)
+        except Exception:
+            ok = False
+        if not ok:
+            self.commit_failures += 1
+        if any(not p.recs for p in batch):
+            # flush markers also make everything before them durable
+            ok = self._sync_pending() and ok
+        if recs:
+            ms = (time.perf_counter() - batch[0].t0) * 1000.0
+            self._latency_ms.append(ms)
+            self._latency_max_ms = max(self._latency_max_ms, ms)
+        for p in batch:
+            p.ok = ok
+            p.done.set()
+            if p.callback is not None:
+                try:
+                    p.callback(p)
+                except Exception:
+                    pass
+        if self._sync_due_in() == 0:
+            self._sync_pending()
+
+    def _run(self) -> None:
+        while True:
+            batch, stop = self._next_batch()
+            if batch:
+                self._complete(batch)
+            if stop:
+                # drain anything that raced with close()
+                rest: List[_Pending] = []
+                while True:
+                    try:
+                        item = self._q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        rest.append(item)
+                if rest:
+                    self._complete(rest)
+                self._sync_pending()
+                return
+
+    def _stat(self) -> Tuple[int, int]:
+        try:
+            st = os.stat(self.path)
+            return st.st_ino, st.st_size
+        except FileNotFoundError:
+            return 0, 0
+
+    def _file_size(self) -> int:
+        return self._stat()[1]
+
+    def tip(self) -> ChainTip:
+        """Current chain tip (O(1); reads the checkpoint if not yet loaded)."""
+        t = self._tip
+        if t is not None and (self._tip_ino, t.offset) == self._stat():
+            return ChainTip(t.last_hash, t.count, t.offset)
+        t = load_tip(self.path, self.tip_path)
+        if t.offset == 0:
+            m = SegmentManifest.load(self.seg_dir)
+            t = ChainTip(m.active_prev_hash, m.active_first_index, 0)
+        return t
+
+    def segments(self) -> List[SegmentInfo]:
+        return SegmentManifest.load(self.seg_dir).sealed
+
+    def _reconcile(self, m: SegmentManifest) -> bool:
+        """
+        Finish a rotation interrupted between the rename and the manifest
+        save: the active segment already sits in seg_dir but is not listed.
+        """
+        if any(s.seq == m.active_seq for s in m.sealed):
+            return False
+        for fmt in FORMATS:
+            sealed_path = self.seg_dir / segment_name(m.active_seq, fmt)
+            if sealed_path.exists():
+                break
+        else:
+            return False
+        t = load_tip(sealed_path)
+        m.sealed.append(SegmentInfo(
+            seq=m.active_seq,
+            name=sealed_path.name,
+            first_index=m.active_first_index,
+            count=t.count - m.active_first_index,
+            prev_hash=m.active_prev_hash,
+            last_hash=t.last_hash,
+            bytes=t.offset,
+            created_ns=m.active_created_ns,
+            sealed_ns=time.time_ns(),
+            format=fmt,
+        ))
+        m.active_seq += 1
+        m.active_first_index = t.count
+        m.active_prev_hash = t.last_hash
+        m.active_created_ns = 0
+        return True
+
+    def _seal_active(self, tip: ChainTip) -> SegmentManifest:
+        m = SegmentManifest.load(self.seg_dir)
+        self._reconcile(m)
+        hdr = read_header(self.path) or {}
+        seq = int(hdr.get("seq", m.active_seq))
+        first_index = int(hdr.get("first_index", m.active_first_index))
+        fmt = segment_format(hdr)
+        info = SegmentInfo(
+            seq=seq,
+            name=segment_name(seq, fmt),
+            first_index=first_index,
+            count=tip.count - first_index,
+            prev_hash=str(hdr.get("prev_hash", m.active_prev_hash)),
+            last_hash=tip.last_hash,
+            bytes=tip.offset,
+            created_ns=int(hdr.get("created_ns", m.active_created_ns)),
+            sealed_ns=time.time_ns(),
+            format=fmt,
+        )
+        self.seg_dir.mkdir(parents=True, exist_ok=True)
+        os.replace(self.path, self.seg_dir / info.name)
+        m.sealed.append(info)
+        m.active_seq = seq + 1
+        m.active_first_index = tip.count
+        m.active_prev_hash = tip.last_hash
+        m.active_created_ns = 0
+        prune(m, self.seg_dir, self.retain_segments, self.retain_days)
+        return m
+
+    def _locked(self, fn: Callable[[], Any]) -> Any:
+        with open(self.lock_path, "a+", encoding="utf-8") as lockf:
+            try:
+                fcntl.flock(lockf.fileno(), fcntl.LOCK_EX)
+            except Exception:
+                pass
+            try:
+                return fn()
+            finally:
+                try:
+                    fcntl.flock(lockf.fileno(), fcntl.LOCK_UN)
+                except Exception:
+                    pass
+
+    def compact(self) -> int:
+        """
+        Compress every sealed, still-plain segment into seekable frames.
+        Compression runs without the flock; the manifest swap (and only it)
+        is done under it. Returns the number of segments compressed.
+        """
+        done = 0
+        for s in SegmentManifest.load(self.seg_dir).sealed:
+            if s.codec:
+                continue
+            plain = self.seg_dir / s.name
+            if not plain.exists():
+                continue
+            zpath = compress_segment(plain, self.codec, self.frame_records)
+            codec = FrameIndex.load(zpath).codec
+
+            def _swap() -> bool:
+                m = SegmentManifest.load(self.seg_dir)
+                for t in m.sealed:
+                    if t.seq == s.seq and not t.codec:
+                        t.name, t.codec = zpath.name, codec
+                        m.save(self.seg_dir)
+                        return True
+                return False
+
+            if self._locked(_swap):
+                try:
+                    os.remove(plain)
+                except FileNotFoundError:
+                    pass
+                done += 1
+            elif not any(t.name == zpath.name for t in SegmentManifest.load(self.seg_dir).sealed):
+                # pruned meanwhile: drop the orphaned output
+                for p in (zpath, Path(str(zpath) + FRAME_INDEX_SUFFIX)):
+                    try:
+                        os.remove(p)
+                    except FileNotFoundError:
+                        pass
+        return done
+
+    def _start_compaction(self) -> None:
+        t = self._compactor
+        if not self.compress or (t is not None and t.is_alive()):
+            return
+
+        def _run() -> None:
+            try:
+                self.compact()
+            except Exception:
+                pass
+
+        t = threading.Thread(target=_run, name="kasbah-audit-compact", daemon=True)
+        t.start()
+        self._compactor = t
+
+    def _open_segment(self, tip: ChainTip, m: Optional[SegmentManifest]) -> bytes:
+        """Header for a fresh active segment; records it in the manifest."""
+        if m is None:
+            m = SegmentManifest.load(self.seg_dir)
+            self._reconcile(m)
+        now = time.time_ns()
+        m.active_first_index = tip.count
+        m.active_prev_hash = tip.last_hash
+        m.active_created_ns = now
+        m.save(self.seg_dir)
+        self._active_seq = m.active_seq
+        self._active_created_ns = now
+        self._active_format = self.format
+        self._dict = SegmentDictionary() if self.format == FORMAT_BIN else None
+        return segment_header(m.active_seq, tip.last_hash, tip.count, now, self.format)
+
+    def _load_tip(self) -> ChainTip:
+        tip = load_tip(self.path, self.tip_path)
+        self._dict = None  # another writer may have extended the string table
+        if tip.offset == 0:
+            m = SegmentManifest.load(self.seg_dir)
+            if self._reconcile(m):
+                m.save(self.seg_dir)
+            tip = ChainTip(m.active_prev_hash, m.active_first_index, 0)
+            self._active_seq = m.active_seq
+            self._active_created_ns = 0
+        else:
+            hdr = read_header(self.path) or {}
+            self._active_format = segment_format(hdr)
+            self._active_seq = int(hdr.get("seq", 0)) or SegmentManifest.load(self.seg_dir).active_seq
+            # pre-segmentation file without header: age counts from now
+            self._active_created_ns = int(hdr.get("created_ns", 0)) or time.time_ns()
+        return tip
+
+    def _committed(
+        self, fulls: List[Dict[str, Any]], lines: List[str], sizes: List[int], first_index: int, offset: int
+    ) -> List[CommittedRecord]:
+        # caller holds the flock (self._active_seq is this batch's segment)
+        committed: List[CommittedRecord] = []
+        for i, (full, line) in enumerate(zip(fulls, lines)):
+            committed.append(CommittedRecord(first_index + i, self._active_seq, offset, full, line, offset + sizes[i]))
+            offset += sizes[i]
+        return committed
+
+    def _notify(self, committed: List[CommittedRecord]) -> None:
+        for fn in list(self._listeners):
+            try:
+                fn(committed)
+            except Exception:
+                pass
+
+    def _commit(self, recs: List[Dict[str, Any]]) -> bool:
+        if not recs:
+            return True
+        committed = self._commit_locked(recs)
+        if committed:
+            self._notify(committed)
+        return True
+
+    def _commit_locked(self, recs: List[Dict[str, Any]]) -> List[CommittedRecord]:
+        """Write one batch under the flock; returns it for the listeners (empty without any)."""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        except Exception:
+            pass
+
+        with open(self.lock_path, "a+", encoding="utf-8") as lockf:
+            try:
+                fcntl.flock(lockf.fileno(), fcntl.LOCK_EX)
+            except Exception:
+                # If lock fails, fail-open (still write, but chain might break)
+                pass
+            try:
+                ino, size = self._stat()
+                tip = self._tip
+                if tip is None or ino != self._tip_ino or size != tip.offset:
+                    tip = self._load_tip()
+                    if self._active_format == FORMAT_BIN and 0 < tip.offset < size:
+                        # torn frame from a crashed write (never acknowledged)
+                        os.truncate(self.path, tip.offset)
+
+                m: Optional[SegmentManifest] = None
+                if tip.offset > 0 and should_rotate(
+                    tip.offset, self._active_created_ns, self.segment_max_bytes, self.segment_max_age_sec
+                ):
+                    self._sync_pending()  # a sealed segment is always durable
+                    m = self._seal_active(tip)
+                    tip = ChainTip(tip.last_hash, tip.count, 0)
+                    self._start_compaction()
+
+                prefix = b""
+                if tip.offset == 0:
+                    prefix = self._open_segment(tip, m)
+
+                binary = self._active_format == FORMAT_BIN
+                prev = tip.last_hash
+                out: List[str] = []
+                fulls: List[Dict[str, Any]] = []
+                chunks: List[bytes] = []
+                try:
+                    if binary and self._dict is None:
+                        self._dict = scan_dictionary(self.path)
+                    for rec in recs:
+                        h, line = encode_record(rec, prev)
+                        full = dict(rec)
+                        full["prev_hash"], full["hash"] = prev, h
+                        fulls.append(full)
+                        out.append(line)
+                        chunks.append(encode_frame(full, self._dict, line) if binary else (line + "\n").encode("utf-8"))
+                        prev = h
+                    data = prefix + b"".join(chunks)
+
+                    f = open(self.path, "ab")
+                    try:
+                        f.write(data)
+                        f.flush()
+                        self._tip_ino = os.fstat(f.fileno()).st_ino
+                        if self.durability == DURABILITY_STRICT:
+                            # a failed fsync fails the batch: its waiters get False
+                            os.fsync(f.fileno())
+                            self.fsyncs += 1
+                            self._last_sync = time.monotonic()
+                        else:
+                            self._hold_unsynced(f)
+                            f = None
+                    finally:
+                        if f is not None:
+                            f.close()
+                except Exception:
+                    # string table ids defined for this batch may not be on
+                    # disk: force a reload (and rescan) before the next batch
+                    self._tip = None
+                    raise
+
+                base = tip.offset + len(prefix)
+                tip = ChainTip(last_hash=prev, count=tip.count + len(recs), offset=tip.offset + len(data))
+                self._tip = tip
+                try:
+                    save_checkpoint(self.tip_path, tip)
+                except Exception:
+                    pass
+                self.batches_committed += 1
+                self.records_committed += len(recs)
+                if not self._listeners:
+                    return []
+                return self._committed(fulls, out, [len(c) for c in chunks], tip.count - len(recs), base)
+            finally:
+                try:
+                    fcntl.flock(lockf.fileno(), fcntl.LOCK_UN)
+                except Exception:
+                    pass
+
+
+_ledgers: Dict[str, AuditLedger] = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_ledger(path: Path, lock_path: Path, tip_path: Optional[Path] = None) -> AuditLedger:
+    """Process-wide ledger per audit path (one writer thread per file)."""
+    key = str(Path(path).resolve())
+    with _ledgers_lock:
+        led = _ledgers.get(key)
+        if led is None:
+            led = AuditLedger(path, lock_path, tip_path=tip_path)
+            _ledgers[key] = led
+        return led
+
+
+@atexit.register
+def _close_all() -> None:
+    for led in list(_ledgers.values()):
+        try:
+            led.close()
+        except Exception:
+            pass
+
+
+def verify(data_dir: Optional[str] = None, full: bool = False, workers: int = 0) -> Dict[str, Any]:
+    """Incremental chain verification of <data_dir>/audit.jsonl (see audit_verify.py)."""
+    from .audit_verify import verify_log  # late import: audit_verify imports this module
+
+    d = Path(data_dir or os.environ.get("KASBAH_DATA_DIR", ".kasbah"))
+    return asdict(verify_log(d / "audit.jsonl", workers=workers, full=full))
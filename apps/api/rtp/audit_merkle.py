@@ -0,0 +1,221 @@
+"""
+Kasbah RTP - Merkle checkpoints over the audit log.
+
+Like CryptoSecureCore.update_merkle_ledger, every committed record becomes a
+leaf hashed from its canonical (sorted-key) JSON. Leaves are grouped into
+fixed blocks of KASBAH_AUDIT_MERKLE_BLOCK records; when a block fills, its
+root is appended to merkle.roots.jsonl next to the segments, bound to the
+hash chain by the last record's chain hash.
+
+An inclusion proof for one record is its leaf plus log2(block) sibling
+hashes, so an auditor holding a published root can check a single DECIDE /
+CONSUME event without the rest of the log. Tree hashing follows RFC 6962
+(0x00 leaf prefix, 0x01 node prefix, left-heavy split).
+
+Files in the segment directory:
+    merkle.leaves      32 bytes per record, at offset index * 32
+    merkle.roots.jsonl one {"block", "first_index", "count", "root", "last_hash"} per sealed block
+
+Proofs outlive retention: pruning segments (KASBAH_AUDIT_RETAIN_SEGMENTS /
+_DAYS) leaves both files alone, so an auditor who archived a record before
+it was pruned can still prove it against the published root. The leaves
+cost 32 bytes per record for the life of the deployment (about 32 MB per
+million records); delete them together with the roots if that matters
+more than proofs for pruned records.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .audit_ledger import CommittedRecord
+from .audit_segments import default_segment_dir, iter_records_from
+
+
+KASBAH_AUDIT_MERKLE_BLOCK = int(os.environ.get("KASBAH_AUDIT_MERKLE_BLOCK", "1024"))
+
+_LEAF_SIZE = 32
+
+
+def leaf_hash(line: Any) -> bytes:
+    if isinstance(line, str):
+        line = line.encode("utf-8")
+    return hashlib.sha256(b"\x00" + bytes(line)).digest()
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def _split(n: int) -> int:
+    k = 1
+    while k * 2 < n:
+        k *= 2
+    return k
+
+
+def merkle_root(leaves: List[bytes]) -> bytes:
+    if not leaves:
+        return hashlib.sha256(b"").digest()
+    if len(leaves) == 1:
+        return leaves[0]
+    k = _split(len(leaves))
+    return node_hash(merkle_root(leaves[:k]), merkle_root(leaves[k:]))
+
+
+def merkle_path(i: int, leaves: List[bytes]) -> List[Tuple[str, bytes]]:
+    """Audit path for leaf i, bottom-up: (side of the sibling, sibling hash)."""
+    if len(leaves) <= 1:
+        return []
+    k = _split(len(leaves))
+    if i < k:
+        return merkle_path(i, leaves[:k]) + [("R", merkle_root(leaves[k:]))]
+    return merkle_path(i - k, leaves[k:]) + [("L", merkle_root(leaves[:k]))]
+
+
+def verify_proof(line: Any, proof: Dict[str, Any]) -> bool:
+    """Auditor side: recompute the block root from one record line and its proof."""
+    h = leaf_hash(line)
+    if h.hex() != proof.get("leaf"):
+        return False
+    for step in proof.get("path", []):
+        sib = bytes.fromhex(step["hash"])
+        h = node_hash(sib, h) if step["side"] == "L" else node_hash(h, sib)
+    return h.hex() == proof.get("root")
+
+
+class MerkleCheckpoints:
+    def __init__(self, seg_dir: Path, block: int = KASBAH_AUDIT_MERKLE_BLOCK):
+        self.seg_dir = Path(seg_dir)
+        self.block = max(2, int(block))
+        self.leaves_path = self.seg_dir / "merkle.leaves"
+        self.roots_path = self.seg_dir / "merkle.roots.jsonl"
+        self._lock = threading.Lock()
+
+    # ---- writes ----
+
+    def _write_leaves(self, first_index: int, leaves: List[bytes]) -> None:
+        self.seg_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(str(self.leaves_path), os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            # positional write: idempotent, so replays after a crash are harmless
+            os.pwrite(fd, b"".join(leaves), first_index * _LEAF_SIZE)
+        finally:
+            os.close(fd)
+
+    def _seal_block(self, b: int, last_hash: str) -> Dict[str, Any]:
+        leaves = self.read_leaves(b * self.block, self.block)
+        entry = {
+            "block": b,
+            "first_index": b * self.block,
+            "count": len(leaves),
+            "root": merkle_root(leaves).hex(),
+            "last_hash": last_hash,
+        }
+        with open(self.roots_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, separators=(",", ":"), sort_keys=True) + "\n")
+        return entry
+
+    def add(self, first_index: int, lines: List[Any], hashes: List[str]) -> None:
+        with self._lock:
+            self._write_leaves(first_index, [leaf_hash(ln) for ln in lines])
+            for i, h in enumerate(hashes):
+                idx = first_index + i
+                if (idx + 1) % self.block == 0:
+                    self._seal_block(idx // self.block, h)
+
+    def on_commit(self, committed: List[CommittedRecord]) -> None:
+        """Ledger commit listener."""
+        if committed:
+            self.add(committed[0].index, [c.line for c in committed], [c.record.get("hash", "") for c in committed])
+
+    def leaf_count(self) -> int:
+        try:
+            return self.leaves_path.stat().st_size // _LEAF_SIZE
+        except FileNotFoundError:
+            return 0
+
+    def catch_up(self, active_path: Path, batch: int = 4096) -> int:
+        """Add leaves for records committed while no listener was attached."""
+        start = self.leaf_count()
+        n = 0
+        idx0 = start
+        lines: List[bytes] = []
+        hashes: List[str] = []
+        for idx, _seq, _off, line in iter_records_from(active_path, start, self.seg_dir):
+            if not lines:
+                idx0 = idx
+            lines.append(line)
+            try:
+                hashes.append(str(json.loads(line).get("hash", "")))
+            except Exception:
+                hashes.append("")
+            n += 1
+            if len(lines) >= batch:
+                self.add(idx0, lines, hashes)
+                lines, hashes = [], []
+        if lines:
+            self.add(idx0, lines, hashes)
+        return n
+
+    # ---- reads ----
+
+    def read_leaves(self, first_index: int, count: int) -> List[bytes]:
+        try:
+            with open(self.leaves_path, "rb") as f:
+                f.seek(first_index * _LEAF_SIZE)
+                raw = f.read(count * _LEAF_SIZE)
+        except FileNotFoundError:
+            return []
+        return [raw[i:i + _LEAF_SIZE] for i in range(0, len(raw) - _LEAF_SIZE + 1, _LEAF_SIZE)]
+
+    def roots(self, since_block: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        out: Dict[int, Dict[str, Any]] = {}
+        try:
+            with open(self.roots_path, "r", encoding="utf-8") as f:
+                for ln in f:
+                    try:
+                        e = json.loads(ln)
+                    except Exception:
+                        continue
+                    b = int(e.get("block", -1))
+                    if b >= since_block:
+                        out[b] = e
+        except FileNotFoundError:
+            return []
+        return [out[b] for b in sorted(out)][: max(1, int(limit))]
+
+    def proof(self, index: int) -> Optional[Dict[str, Any]]:
+        """
+        Inclusion proof for record `index`. For the still-open block the root
+        is provisional (computed over the leaves so far, "sealed": false).
+        """
+        index = int(index)
+        b = index // self.block
+        first = b * self.block
+        leaves = self.read_leaves(first, self.block)
+        i = index - first
+        if i >= len(leaves):
+            return None
+        # Computed from the stored leaves; auditors compare it against the
+        # root they already hold from merkle.roots.jsonl / the roots API.
+        root = merkle_root(leaves).hex()
+        return {
+            "index": index,
+            "block": b,
+            "block_first_index": first,
+            "block_count": len(leaves),
+            "leaf": leaves[i].hex(),
+            "root": root,
+            "sealed": len(leaves) == self.block,
+            "path": [{"side": side, "hash": h.hex()} for side, h in merkle_path(i, leaves)],
+        }
+
+
+def default_merkle(active_path: Path) -> MerkleCheckpoints:
+    return MerkleCheckpoints(default_segment_dir(active_path))
@@ -0,0 +1,184 @@
+"""
+Kasbah RTP - indexed audit queries.
+
+    /api/rtp/audit/query?event=AUTHZ_DENY&agent_id=a1&last_sec=21600
+
+Field filters (comma lists: OR within a field, AND across fields) are
+resolved in the secondary indexes of audit_index.py, restricted to the time
+buckets of the window, and every hit is then one seek into its segment.
+With no field filter the window start comes from the index's times table
+and records are read sequentially from there. Either way a page costs what
+lies in the window, not the size of the log.
+
+Output is NDJSON like the export: the matching stored lines, then
+
+    {"meta": {"records": n, "next_cursor": "<idx>", "done": bool, ...}}
+
+where next_cursor (a record index) resumes after the last record examined.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .audit_export import iter_from_cursor
+from .audit_index import INDEXED_FIELDS, AuditIndex, field_value, record_ts_ns
+from .audit_segments import list_segments, read_line_at
+
+
+KASBAH_AUDIT_QUERY_PAGE = int(os.environ.get("KASBAH_AUDIT_QUERY_PAGE", "500"))
+# records examined per page by a query without field filters
+KASBAH_AUDIT_QUERY_SCAN_MAX = int(os.environ.get("KASBAH_AUDIT_QUERY_SCAN_MAX", "100000"))
+
+
+def parse_filters(**fields: Optional[str]) -> Dict[str, List[str]]:
+    """{"event": "A,B", "agent_id": None} -> {"event": ["A", "B"]}; unknown fields raise ValueError."""
+    out: Dict[str, List[str]] = {}
+    for field, raw in fields.items():
+        if field not in INDEXED_FIELDS:
+            raise ValueError(f"not an indexed field: {field}")
+        values = [v.strip() for v in (raw or "").split(",") if v.strip()]
+        if values:
+            out[field] = values
+    return out
+
+
+def _matches(rec: Dict[str, Any], filters: Dict[str, Sequence[str]]) -> bool:
+    return all(field_value(rec, f) in values for f, values in filters.items())
+
+
+def _in_window(rec: Dict[str, Any], since_ns: Optional[int], until_ns: Optional[int]) -> bool:
+    ts = record_ts_ns(rec)
+    if ts is None:
+        return since_ns is None and until_ns is None
+    return (since_ns is None or ts >= since_ns) and (until_ns is None or ts <= until_ns)
+
+
+def iter_query(
+    index: AuditIndex,
+    active_path: Path,
+    filters: Dict[str, Sequence[str]],
+    since_ns: Optional[int] = None,
+    until_ns: Optional[int] = None,
+    after: int = -1,
+    end_index: Optional[int] = None,
+    seg_dir: Optional[Path] = None,
+    page: int = KASBAH_AUDIT_QUERY_PAGE,
+) -> Iterator[Tuple[int, Optional[bytes]]]:
+    """
+    (index, line) for each record examined after index `after`, oldest first;
+    line is None for records that turned out not to match (stale index row,
+    outside the exact time window). Exhausted means the query is complete.
+    """
+    if filters:
+        yield from _iter_indexed(index, active_path, filters, since_ns, until_ns, after, end_index, seg_dir, page)
+    else:
+        yield from _iter_window(index, active_path, since_ns, until_ns, after, end_index, seg_dir)
+
+
+def _iter_indexed(
+    index: AuditIndex,
+    active_path: Path,
+    filters: Dict[str, Sequence[str]],
+    since_ns: Optional[int],
+    until_ns: Optional[int],
+    after: int,
+    end_index: Optional[int],
+    seg_dir: Optional[Path],
+    page: int,
+) -> Iterator[Tuple[int, Optional[bytes]]]:
+    page = max(1, int(page))
+    while True:
+        hits = index.query(filters, since_ns, until_ns, after=after, limit=page)
+        if not hits:
+            return
+        paths = {info.seq: p for info, p in list_segments(active_path, seg_dir)}
+        for idx, seq, off in hits:
+            if end_index is not None and idx >= end_index:
+                return
+            after = idx
+            p = paths.get(seq)
+            if p is None:
+                yield idx, None  # segment removed by retention
+                continue
+            try:
+                line = read_line_at(p, off)
+                rec = json.loads(line)
+            except Exception:
+                yield idx, None
+                continue
+            ok = isinstance(rec, dict) and _matches(rec, filters) and _in_window(rec, since_ns, until_ns)
+            yield idx, (line if ok else None)
+        if len(hits) < page:
+            return
+
+
+def _iter_window(
+    index: AuditIndex,
+    active_path: Path,
+    since_ns: Optional[int],
+    until_ns: Optional[int],
+    after: int,
+    end_index: Optional[int],
+    seg_dir: Optional[Path],
+) -> Iterator[Tuple[int, Optional[bytes]]]:
+    start = after + 1
+    if since_ns is not None:
+        first = index.first_in_window(since_ns)
+        if first is None:
+            return  # nothing indexed at or after the window start
+        start = max(start, first[0])
+    _, hi = index.bucket_range(None, until_ns)
+    for idx, _seq, _off, _end, line in iter_from_cursor(active_path, str(start), index, seg_dir):
+        if end_index is not None and idx >= end_index:
+            return
+        try:
+            rec = json.loads(line)
+        except Exception:
+            yield idx, None
+            continue
+        ts = record_ts_ns(rec) if isinstance(rec, dict) else None
+        if until_ns is not None and ts is not None and ts // index.bucket_ns > hi + 1:
+            return  # past the window (one bucket of slack for clock skew between writers)
+        yield idx, (line if isinstance(rec, dict) and _in_window(rec, since_ns, until_ns) else None)
+
+
+def query_ndjson(
+    index: AuditIndex,
+    active_path: Path,
+    filters: Dict[str, Sequence[str]],
+    since_ns: Optional[int] = None,
+    until_ns: Optional[int] = None,
+    cursor: Optional[int] = None,
+    limit: int = 1000,
+    end_index: Optional[int] = None,
+    seg_dir: Optional[Path] = None,
+    scan_max: int = KASBAH_AUDIT_QUERY_SCAN_MAX,
+    meta: Optional[Dict[str, Any]] = None,
+) -> Iterator[bytes]:
+    """
+    One page of query results as NDJSON chunks: at most `limit` matches
+    (and, without field filters, at most `scan_max` records examined),
+    records from index `cursor` on, none at or beyond `end_index`.
+    """
+    start = max(0, int(cursor or 0))
+    n = 0
+    examined = 0
+    next_cursor = start
+    done = True
+    for idx, line in iter_query(index, active_path, filters, since_ns, until_ns, start - 1, end_index, seg_dir):
+        if (limit and n >= limit) or (not filters and scan_max and examined >= scan_max):
+            done = False
+            break
+        examined += 1
+        next_cursor = idx + 1
+        if line is not None:
+            yield line + b"\n"
+            n += 1
+
+    out = dict(meta or {})
+    out.update({"records": n, "next_cursor": str(next_cursor), "done": done})
+    yield (json.dumps({"meta": out}, separators=(",", ":"), sort_keys=True) + "\n").encode("utf-8")
@@ -0,0 +1,368 @@
+"""
+Kasbah RTP - per-minute audit rollups.
+
+A ledger commit listener counts every committed record into one-minute
+buckets keyed by (event, agent_id, tool_name) in memory. Every
+KASBAH_AUDIT_ROLLUP_FLUSH_SEC the counts gathered since the previous flush
+are appended as one delta line to audit.rollups.jsonl:
+
+    {"through": <record index after the last counted record>,
+     "ranges": [[from, to], ...],      record indices counted, to exclusive
+     "rows": [[minute, event, agent_id, tool_name, count], ...]}
+
+Deltas are additive, so several API processes can append to the same file
+and readers simply sum. Once the file holds KASBAH_AUDIT_ROLLUP_COMPACT_LINES
+deltas it is rewritten with one line per minute (atomically), dropping
+minutes older than KASBAH_AUDIT_ROLLUP_RETAIN_DAYS; the union of the ranges
+is kept.
+
+Every write happens under a sidecar flock and only counts indices no range
+covers yet, so each record is counted once however many processes flush or
+catch up: catch_up() recounts the records nobody counted (committed while no
+listener ran, or lost with a crashed process's unflushed counts) and holds
+the flock for the whole scan; a process whose pending counts were meanwhile
+covered by another's catch_up drops them at its next flush.
+
+Aggregates over any window merge the minute buckets inside it (windows are
+minute-aligned), so dashboards never rescan the log.
+"""
+
+from __future__ import annotations
+
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .audit_index import field_value, record_ts_ns
+from .audit_ledger import CommittedRecord
+from .audit_segments import iter_records_from
+
+
+KASBAH_AUDIT_ROLLUP_FLUSH_SEC = float(os.environ.get("KASBAH_AUDIT_ROLLUP_FLUSH_SEC", "5"))
+KASBAH_AUDIT_ROLLUP_COMPACT_LINES = int(os.environ.get("KASBAH_AUDIT_ROLLUP_COMPACT_LINES", "1000"))
+KASBAH_AUDIT_ROLLUP_RETAIN_DAYS = float(os.environ.get("KASBAH_AUDIT_ROLLUP_RETAIN_DAYS", "30"))
+
+KEY_FIELDS = ("event", "agent_id", "tool_name")
+BUCKET_NS = 60 * 1_000_000_000
+
+# (event, agent_id, tool_name)
+Key = Tuple[str, str, str]
+Buckets = Dict[int, Dict[Key, int]]
+# sorted, disjoint [from, to) record index ranges
+Ranges = List[List[int]]
+
+
+def default_rollup_path(active_path: Path) -> Path:
+    return Path(active_path).with_suffix(".rollups.jsonl")
+
+
+def rollup_key(rec: Dict[str, Any]) -> Key:
+    return tuple(field_value(rec, f) or "" for f in KEY_FIELDS)  # type: ignore[return-value]
+
+
+def _add(into: Buckets, minute: int, key: Key, n: int) -> bool:
+    """Returns True when `minute` is new in `into`."""
+    b = into.get(minute)
+    new = b is None
+    if new:
+        b = into[minute] = {}
+    b[key] = b.get(key, 0) + n
+    return new
+
+
+def _cover(ranges: Ranges, lo: int, hi: int) -> None:
+    """Add [lo, hi) to `ranges`, merging neighbours."""
+    if hi <= lo:
+        return
+    i = bisect.bisect_left(ranges, [lo, lo])
+    if i > 0 and ranges[i - 1][1] >= lo:
+        i -= 1
+    j = i
+    while j < len(ranges) and ranges[j][0] <= hi:
+        lo, hi = min(lo, ranges[j][0]), max(hi, ranges[j][1])
+        j += 1
+    ranges[i:j] = [[lo, hi]]
+
+
+def _covered(ranges: Ranges, idx: int) -> bool:
+    i = bisect.bisect_right(ranges, [idx, float("inf")]) - 1
+    return i >= 0 and ranges[i][0] <= idx < ranges[i][1]
+
+
+def _runs(indices: Sequence[int]) -> Ranges:
+    """Sorted indices as [from, to) runs."""
+    out: Ranges = []
+    for idx in indices:
+        if out and out[-1][1] == idx:
+            out[-1][1] = idx + 1
+        else:
+            out.append([idx, idx + 1])
+    return out
+
+
+class AuditRollups:
+    def __init__(
+        self,
+        path: Path,
+        flush_sec: float = KASBAH_AUDIT_ROLLUP_FLUSH_SEC,
+        compact_lines: int = KASBAH_AUDIT_ROLLUP_COMPACT_LINES,
+        retain_days: float = KASBAH_AUDIT_ROLLUP_RETAIN_DAYS,
+    ):
+        self.path = Path(path)
+        self.lock_path = Path(str(self.path) + ".lock")
+        self.flush_sec = max(0.0, float(flush_sec))
+        self.compact_lines = max(1, int(compact_lines))
+        self.retain_days = float(retain_days)
+        self._lock = threading.Lock()
+
+        # counted here, not yet in the file: (index, minute, key)
+        self._pending: List[Tuple[int, int, Key]] = []
+        self._last_flush = time.monotonic()
+        # first record index delivered by the ledger (catch_up stops there)
+        self._live_from: Optional[int] = None
+        self._last_ts: Optional[int] = None
+
+        # file contents, summed; read incrementally
+        self._merged: Buckets = {}
+        self._minutes: List[int] = []
+        self._ranges: Ranges = []
+        self._through = 0
+        self._lines = 0
+        self._pos = 0
+        self._ino = 0
+
+    # ---- writes ----
+
+    def _count(self, idx: int, rec: Dict[str, Any]) -> None:
+        ts = record_ts_ns(rec)
+        if ts is None:
+            ts = self._last_ts if self._last_ts is not None else time.time_ns()
+        self._last_ts = ts
+        self._pending.append((idx, ts // BUCKET_NS, rollup_key(rec)))
+
+    def on_commit(self, committed: List[CommittedRecord]) -> None:
+        """Ledger commit listener."""
+        if not committed:
+            return
+        with self._lock:
+            if self._live_from is None:
+                self._live_from = committed[0].index
+            for c in committed:
+                self._count(c.index, c.record)
+            due = time.monotonic() - self._last_flush >= self.flush_sec
+        if due:
+            self.flush()
+
+    def _locked(self) -> Any:
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        lockf = open(self.lock_path, "a+")
+        fcntl.flock(lockf.fileno(), fcntl.LOCK_EX)
+        return lockf
+
+    def _append(self, ranges: Ranges, buckets: Buckets) -> None:
+        # caller holds the flock and self._lock; self._ranges is current
+        rows = [[m, *key, n] for m in sorted(buckets) for key, n in buckets[m].items()]
+        d = {"through": ranges[-1][1], "ranges": ranges, "rows": rows}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(d, separators=(",", ":")) + "\n")
+        self._refresh()
+        if self._lines >= self.compact_lines:
+            self._compact()
+
+    def flush(self) -> bool:
+        """Append the pending deltas as one line; compacts when the file got long."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending:
+                return True
+        try:
+            lockf = self._locked()
+        except Exception:
+            return False
+        try:
+            with self._lock:
+                self._refresh()
+                # drop what another process's catch_up counted meanwhile
+                todo = sorted(p for p in self._pending if not _covered(self._ranges, p[0]))
+                self._pending = []
+                buckets: Buckets = {}
+                for _idx, m, key in todo:
+                    _add(buckets, m, key, 1)
+                if todo:
+                    self._append(_runs([p[0] for p in todo]), buckets)
+            return True
+        except Exception:
+            return False
+        finally:
+            lockf.close()
+
+    def _compact(self) -> None:
+        # caller holds self._lock and the flock; self._merged is current
+        if self.retain_days > 0:
+            oldest = (time.time_ns() - int(self.retain_days * 86400 * 1e9)) // BUCKET_NS
+            for m in [m for m in self._minutes if m < oldest]:
+                del self._merged[m]
+            self._minutes = [m for m in self._minutes if m >= oldest]
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            # the first line carries every range, the others none
+            ranges = self._ranges
+            for m in self._minutes or [None]:
+                rows = [[m, *key, n] for key, n in self._merged[m].items()] if m is not None else []
+                d = {"through": self._through, "ranges": ranges, "rows": rows}
+                f.write(json.dumps(d, separators=(",", ":")) + "\n")
+                ranges = []
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._pos = self.path.stat().st_size
+        self._ino = self.path.stat().st_ino
+        self._lines = max(1, len(self._minutes))
+
+    def catch_up(self, active_path: Path, seg_dir: Optional[Path] = None) -> int:
+        """Count the records no process has counted, under the flock for the whole scan."""
+        lockf = self._locked()
+        try:
+            with self._lock:
+                self._refresh()
+                ranges = [list(r) for r in self._ranges]
+                stop = self._live_from
+            start = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+            buckets: Buckets = {}
+            counted: List[int] = []
+            last_ts = self._last_ts
+            for idx, _seq, _off, line in iter_records_from(active_path, start, seg_dir):
+                if stop is None:
+                    stop = self._live_from
+                if stop is not None and idx >= stop:
+                    break
+                if _covered(ranges, idx):
+                    continue
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    continue
+                ts = record_ts_ns(rec)
+                if ts is None:
+                    ts = last_ts if last_ts is not None else time.time_ns()
+                last_ts = ts
+                _add(buckets, ts // BUCKET_NS, rollup_key(rec), 1)
+                counted.append(idx)
+            if counted:
+                with self._lock:
+                    self._refresh()
+                    self._append(_runs(counted), buckets)
+            return len(counted)
+        finally:
+            lockf.close()
+
+    # ---- reads ----
+
+    def _refresh(self) -> None:
+        # caller holds self._lock
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return
+        if st.st_ino != self._ino or st.st_size < self._pos:
+            # compacted (possibly by another process): re-read from scratch
+            self._merged, self._minutes, self._through, self._lines, self._pos = {}, [], 0, 0, 0
+            self._ranges = []
+            self._ino = st.st_ino
+        if st.st_size == self._pos:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._pos)
+            data = f.read(st.st_size - self._pos)
+        end = data.rfind(b"\n") + 1  # a concurrent append may be mid-line
+        for raw in data[:end].splitlines():
+            try:
+                d = json.loads(raw)
+            except Exception:
+                continue
+            self._lines += 1
+            through = int(d.get("through", 0))
+            self._through = max(self._through, through)
+            # lines written before ranges existed covered everything below "through"
+            for lo, hi in d.get("ranges", [[0, through]]):
+                _cover(self._ranges, int(lo), int(hi))
+            for m, e, a, t, n in d.get("rows", []):
+                if _add(self._merged, int(m), (str(e), str(a), str(t)), int(n)):
+                    bisect.insort(self._minutes, int(m))
+        self._pos += end
+
+    def through(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._through
+
+    def aggregate(
+        self,
+        since_ns: Optional[int] = None,
+        until_ns: Optional[int] = None,
+        filters: Optional[Dict[str, Sequence[str]]] = None,
+        group_by: Sequence[str] = KEY_FIELDS,
+        step_sec: int = 0,
+    ) -> Dict[str, Any]:
+        """
+        Counts in [since_ns, until_ns] (minute-aligned) grouped by `group_by`,
+        optionally also as a series of step_sec buckets (a multiple of 60).
+        """
+        for f in list(group_by) + list(filters or {}):
+            if f not in KEY_FIELDS:
+                raise ValueError(f"not a rollup field: {f}")
+        keep = [KEY_FIELDS.index(f) for f in group_by]
+        want = {KEY_FIELDS.index(f): set(v) for f, v in (filters or {}).items() if v}
+        step = max(1, int(step_sec) // 60) if step_sec else 0
+        lo = int(since_ns) // BUCKET_NS if since_ns is not None else None
+        hi = int(until_ns) // BUCKET_NS if until_ns is not None else None
+
+        with self._lock:
+            self._refresh()
+            minutes = self._minutes
+            i = bisect.bisect_left(minutes, lo) if lo is not None else 0
+            j = bisect.bisect_right(minutes, hi) if hi is not None else len(minutes)
+            sources: List[Tuple[int, Dict[Key, int]]] = [(m, dict(self._merged[m])) for m in minutes[i:j]]
+            pending: Buckets = {}
+            for idx, m, key in self._pending:
+                if (lo is None or m >= lo) and (hi is None or m <= hi) and not _covered(self._ranges, idx):
+                    _add(pending, m, key, 1)
+            sources += list(pending.items())
+
+        totals: Dict[Tuple[str, ...], int] = {}
+        series: Dict[int, Dict[Tuple[str, ...], int]] = {}
+        for m, bucket in sources:
+            for key, n in bucket.items():
+                if any(key[k] not in vals for k, vals in want.items()):
+                    continue
+                g = tuple(key[k] for k in keep)
+                totals[g] = totals.get(g, 0) + n
+                if step:
+                    s = series.setdefault(m - m % step, {})
+                    s[g] = s.get(g, 0) + n
+
+        def _groups(counts: Dict[Tuple[str, ...], int]) -> List[Dict[str, Any]]:
+            out = [dict(zip(group_by, g), count=n) for g, n in counts.items()]
+            out.sort(key=lambda d: (-d["count"], [d[f] for f in group_by]))
+            return out
+
+        res: Dict[str, Any] = {
+            "bucket_sec": BUCKET_NS // 1_000_000_000,
+            "since_ns": lo * BUCKET_NS if lo is not None else None,
+            "until_ns": (hi + 1) * BUCKET_NS - 1 if hi is not None else None,
+            "group_by": list(group_by),
+            "total": sum(totals.values()),
+            "groups": _groups(totals),
+        }
+        if step:
+            res["series"] = [{"t_ns": s * BUCKET_NS, "groups": _groups(series[s])} for s in sorted(series)]
+        return res
+
+
+def default_rollups(active_path: Path) -> AuditRollups:
+    return AuditRollups(default_rollup_path(active_path))
@@ -0,0 +1,659 @@
+"""
+Kasbah RTP - audit log segments.
+
+The hash-chained audit log is a sequence of segments:
+
+    .kasbah/audit.jsonl                       active segment (append target)
+    .kasbah/audit.segments/000000000001.jsonl sealed segments, by sequence number
+    .kasbah/audit.segments/manifest.json      ordered segment list
+
+Every segment opens with a header line carrying the previous segment's final
+hash, so the prev_hash chain runs unbroken across rotations and each sealed
+segment can be verified on its own. Header lines are never hashed or counted
+as records. A pre-segmentation audit.jsonl without a header is read as
+segment 1 starting at record 0.
+
+Sealed segments may be compressed into independently decodable frames of
+KASBAH_AUDIT_FRAME_RECORDS lines ("<name>.z" plus a "<name>.zidx" frame
+index). Decompressed frames are byte-identical to the original segment, so
+every byte offset (jti index, export cursors, verifier checkpoints) keeps
+pointing at the same record and readers only inflate the frames they touch.
+
+The header's "format" flag picks the record encoding of a segment: JSON
+lines ("jsonl") or length-prefixed binary frames ("bin", audit_binary.py).
+Writers take it from KASBAH_AUDIT_FORMAT when they open a segment; readers
+always follow the header, and hand back the canonical JSON line either way.
+The active segment keeps its audit.jsonl name in both formats.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import threading
+import time
+import zlib
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .audit_binary import (
+    FORMAT_BIN,
+    SegmentDictionary,
+    apply_definitions,
+    decode_payload,
+    frame_bytes,
+    iter_frames,
+    payload_hash,
+    read_last_frame,
+)
+
+
+KASBAH_AUDIT_SEGMENT_MAX_BYTES = int(os.environ.get("KASBAH_AUDIT_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+KASBAH_AUDIT_SEGMENT_MAX_AGE_SEC = int(os.environ.get("KASBAH_AUDIT_SEGMENT_MAX_AGE_SEC", "0"))
+KASBAH_AUDIT_RETAIN_SEGMENTS = int(os.environ.get("KASBAH_AUDIT_RETAIN_SEGMENTS", "0"))
+KASBAH_AUDIT_RETAIN_DAYS = float(os.environ.get("KASBAH_AUDIT_RETAIN_DAYS", "0"))
+
+KASBAH_AUDIT_COMPRESS = os.environ.get("KASBAH_AUDIT_COMPRESS", "1").strip().lower() in ("1", "true", "yes", "on")
+KASBAH_AUDIT_CODEC = os.environ.get("KASBAH_AUDIT_CODEC", "zlib").strip().lower()
+KASBAH_AUDIT_FRAME_RECORDS = int(os.environ.get("KASBAH_AUDIT_FRAME_RECORDS", "256"))
+KASBAH_AUDIT_FORMAT = os.environ.get("KASBAH_AUDIT_FORMAT", "jsonl").strip().lower()
+
+FORMAT_JSONL = "jsonl"
+FORMATS = (FORMAT_JSONL, FORMAT_BIN)
+COMPRESSED_SUFFIX = ".z"
+FRAME_INDEX_SUFFIX = ".zidx"
+
+# Optional dependency: zstandard (falls back to zlib)
+try:
+    import zstandard  # type: ignore
+except Exception:
+    zstandard = None
+
+
+def default_segment_dir(active_path: Path) -> Path:
+    return Path(active_path).with_suffix(".segments")
+
+
+def segment_name(seq: int, fmt: str = FORMAT_JSONL) -> str:
+    return f"{int(seq):012d}.{fmt}"
+
+
+# ---- headers ----
+
+def segment_header(seq: int, prev_hash: str, first_index: int, created_ns: int, fmt: str = FORMAT_JSONL) -> bytes:
+    hdr = {
+        "segment": {
+            "seq": int(seq),
+            "prev_hash": prev_hash or "",
+            "first_index": int(first_index),
+            "created_ns": int(created_ns),
+            "format": fmt,
+        }
+    }
+    return (json.dumps(hdr, separators=(",", ":"), sort_keys=True) + "\n").encode("utf-8")
+
+
+def parse_header(line: Any) -> Optional[Dict[str, Any]]:
+    """Return the header dict if line is a segment header line, else None."""
+    if isinstance(line, (bytes, bytearray)):
+        if not line.startswith(b'{"segment":'):
+            return None
+        line = line.decode("utf-8", errors="replace")
+    elif not isinstance(line, str) or not line.startswith('{"segment":'):
+        return None
+    try:
+        obj = json.loads(line)
+    except Exception:
+        return None
+    seg = obj.get("segment") if isinstance(obj, dict) else None
+    if not isinstance(seg, dict) or "hash" in obj:
+        return None
+    return seg
+
+
+def _header_info(path: Path) -> Tuple[Optional[Dict[str, Any]], int]:
+    """(header, offset of the first record)."""
+    path = _resolve(path)
+    first = b""
+    if is_compressed(path):
+        for _off, line in iter_raw_lines(path):
+            first = line + b"\n"
+            break
+    else:
+        try:
+            with open(path, "rb") as f:
+                first = f.readline()
+        except FileNotFoundError:
+            pass
+    hdr = parse_header(first.rstrip(b"\r\n")) if first.endswith(b"\n") else None
+    return hdr, (len(first) if hdr is not None else 0)
+
+
+def read_header(path: Path) -> Optional[Dict[str, Any]]:
+    return _header_info(path)[0]
+
+
+def first_record_offset(path: Path) -> int:
+    return _header_info(path)[1]
+
+
+def segment_format(hdr: Optional[Dict[str, Any]]) -> str:
+    return str((hdr or {}).get("format", FORMAT_JSONL))
+
+
+# ---- manifest ----
+
+@dataclass
+class SegmentInfo:
+    seq: int
+    name: str
+    first_index: int = 0
+    count: int = 0
+    prev_hash: str = ""
+    last_hash: str = ""
+    bytes: int = 0
+    created_ns: int = 0
+    sealed_ns: int = 0
+    format: str = FORMAT_JSONL
+    codec: str = ""
+
+    @property
+    def end_index(self) -> int:
+        return self.first_index + self.count
+
+
+@dataclass
+class SegmentManifest:
+    sealed: List[SegmentInfo] = field(default_factory=list)
+    active_seq: int = 1
+    active_first_index: int = 0
+    active_prev_hash: str = ""
+    active_created_ns: int = 0
+    # Anchor left behind by retention: records before pruned_count are gone,
+    # the first retained segment's prev_hash equals pruned_last_hash.
+    pruned_through_seq: int = 0
+    pruned_count: int = 0
+    pruned_last_hash: str = ""
+
+    @staticmethod
+    def path_for(seg_dir: Path) -> Path:
+        return Path(seg_dir) / "manifest.json"
+
+    @classmethod
+    def load(cls, seg_dir: Path) -> "SegmentManifest":
+        try:
+            with open(cls.path_for(seg_dir), "r", encoding="utf-8") as f:
+                obj = json.load(f) or {}
+        except Exception:
+            return cls()
+        m = cls(
+            sealed=[SegmentInfo(**s) for s in obj.get("sealed", [])],
+            active_seq=int(obj.get("active_seq", 1)),
+            active_first_index=int(obj.get("active_first_index", 0)),
+            active_prev_hash=str(obj.get("active_prev_hash", "")),
+            active_created_ns=int(obj.get("active_created_ns", 0)),
+            pruned_through_seq=int(obj.get("pruned_through_seq", 0)),
+            pruned_count=int(obj.get("pruned_count", 0)),
+            pruned_last_hash=str(obj.get("pruned_last_hash", "")),
+        )
+        return m
+
+    def save(self, seg_dir: Path) -> None:
+        Path(seg_dir).mkdir(parents=True, exist_ok=True)
+        p = self.path_for(seg_dir)
+        tmp = str(p) + ".tmp"
+        obj = asdict(self)
+        obj["version"] = 1
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, p)
+
+
+def should_rotate(size: int, created_ns: int, max_bytes: int, max_age_sec: int, now_ns: Optional[int] = None) -> bool:
+    if max_bytes > 0 and size >= max_bytes:
+        return True
+    if max_age_sec > 0 and created_ns > 0:
+        now_ns = time.time_ns() if now_ns is None else now_ns
+        return (now_ns - created_ns) >= max_age_sec * 1_000_000_000
+    return False
+
+
+def prune(m: SegmentManifest, seg_dir: Path, keep: int, keep_days: float, now_ns: Optional[int] = None) -> List[SegmentInfo]:
+    """
+    Apply retention to sealed segments (oldest first). Returns the dropped
+    segments; the manifest is updated in place and must be saved by the caller.
+    """
+    now_ns = time.time_ns() if now_ns is None else now_ns
+    dropped: List[SegmentInfo] = []
+    while m.sealed:
+        s = m.sealed[0]
+        over_count = keep > 0 and len(m.sealed) > keep
+        too_old = keep_days > 0 and s.sealed_ns > 0 and (now_ns - s.sealed_ns) > keep_days * 86400 * 1_000_000_000
+        if not (over_count or too_old):
+            break
+        m.sealed.pop(0)
+        m.pruned_through_seq = s.seq
+        m.pruned_count = s.end_index
+        m.pruned_last_hash = s.last_hash
+        dropped.append(s)
+    for s in dropped:
+        # plain name too: a compaction may have died before removing it
+        for name in (s.name, s.name + FRAME_INDEX_SUFFIX, segment_name(s.seq, s.format)):
+            try:
+                os.remove(Path(seg_dir) / name)
+            except FileNotFoundError:
+                pass
+    return dropped
+
+
+# ---- frames (compressed sealed segments) ----
+
+def _codec_compress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def _codec_decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("segment compressed with zstd but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def is_compressed(path: Path) -> bool:
+    return str(path).endswith(COMPRESSED_SUFFIX)
+
+
+def _resolve(path: Path) -> Path:
+    # A reader may race the compactor swapping "<name>" for "<name>.z".
+    path = Path(path)
+    if not path.exists() and not is_compressed(path):
+        z = Path(str(path) + COMPRESSED_SUFFIX)
+        if z.exists():
+            return z
+    return path
+
+
+class FrameIndex:
+    """frames: [uncompressed_offset, uncompressed_len, compressed_offset, compressed_len]"""
+
+    def __init__(self, codec: str, frames: List[List[int]]):
+        self.codec = codec
+        self.frames = frames
+        self._starts = [fr[0] for fr in frames]
+
+    @classmethod
+    def load(cls, zpath: Path) -> "FrameIndex":
+        key = str(zpath)
+        with _frame_cache_lock:
+            hit = _frame_cache.get(key)
+        if hit is not None:
+            return hit
+        with open(key + FRAME_INDEX_SUFFIX, "r", encoding="utf-8") as f:
+            obj = json.load(f) or {}
+        fi = cls(str(obj.get("codec", "zlib")), [list(map(int, fr)) for fr in obj.get("frames", [])])
+        with _frame_cache_lock:
+            if len(_frame_cache) > 256:
+                _frame_cache.clear()
+            _frame_cache[key] = fi
+        return fi
+
+    def frame_for(self, offset: int) -> int:
+        return max(0, bisect.bisect_right(self._starts, int(offset)) - 1)
+
+
+_frame_cache: Dict[str, FrameIndex] = {}
+_frame_cache_lock = threading.Lock()
+
+
+def compress_segment(path: Path, codec: str = KASBAH_AUDIT_CODEC, frame_records: int = KASBAH_AUDIT_FRAME_RECORDS) -> Path:
+    """
+    Write "<path>.z" + "<path>.z.zidx" for a sealed plain segment and return
+    the compressed path. The plain file is left for the caller to remove once
+    the manifest points at the compressed one.
+    """
+    path = Path(path)
+    if codec == "zstd" and zstandard is None:
+        codec = "zlib"
+    zpath = Path(str(path) + COMPRESSED_SUFFIX)
+    tmp = str(zpath) + ".tmp"
+    frames: List[List[int]] = []
+    frame_records = max(1, int(frame_records))
+    uoff = 0
+    coff = 0
+    with open(path, "rb") as src, open(tmp, "wb") as dst:
+        buf: List[bytes] = []
+
+        def _flush() -> None:
+            nonlocal uoff, coff, buf
+            if not buf:
+                return
+            raw = b"".join(buf)
+            comp = _codec_compress(codec, raw)
+            dst.write(comp)
+            frames.append([uoff, len(raw), coff, len(comp)])
+            uoff += len(raw)
+            coff += len(comp)
+            buf = []
+
+        for unit in _raw_units(path, src):
+            buf.append(unit)
+            if len(buf) >= frame_records:
+                _flush()
+        _flush()
+        dst.flush()
+        os.fsync(dst.fileno())
+    with open(tmp + FRAME_INDEX_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump({"codec": codec, "frames": frames, "size": uoff}, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp + FRAME_INDEX_SUFFIX, str(zpath) + FRAME_INDEX_SUFFIX)
+    os.replace(tmp, zpath)
+    return zpath
+
+
+def _raw_units(path: Path, src: Any) -> Iterator[bytes]:
+    """Record-aligned byte units of a plain segment (lines, or header + binary frames)."""
+    hdr, hend = _header_info(path)
+    if segment_format(hdr) != FORMAT_BIN:
+        yield from src
+        return
+    yield src.read(hend)
+    for _off, _end, payload in _iter_bin(path, hend):
+        yield frame_bytes(payload)
+
+
+def _iter_frames(zpath: Path, start_offset: int) -> Iterator[Tuple[int, bytes]]:
+    fi = FrameIndex.load(zpath)
+    if not fi.frames:
+        return
+    with open(zpath, "rb") as f:
+        for k in range(fi.frame_for(start_offset), len(fi.frames)):
+            uoff, _ulen, coff, clen = fi.frames[k]
+            f.seek(coff)
+            yield uoff, _codec_decompress(fi.codec, f.read(clen))
+
+
+# ---- reading ----
+
+_CHUNK = 1 << 20
+
+
+def _iter_chunks(path: Path, start_offset: int, chunk: int = _CHUNK) -> Iterator[Tuple[int, bytes]]:
+    """(offset, bytes) runs covering the segment from start_offset, plain or compressed."""
+    path = _resolve(path)
+    start_offset = int(start_offset)
+    if is_compressed(path):
+        try:
+            for uoff, raw in _iter_frames(path, start_offset):
+                if uoff < start_offset:
+                    raw = raw[start_offset - uoff:]
+                    uoff = start_offset
+                yield uoff, raw
+        except FileNotFoundError:
+            return
+        return
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(start_offset)
+        off = start_offset
+        while True:
+            data = f.read(chunk)
+            if not data:
+                return
+            yield off, data
+            off += len(data)
+
+
+def iter_raw_lines(path: Path, start_offset: int = 0) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yield (offset, line) for every complete line from start_offset, header
+    included, for plain and compressed JSONL segments alike.
+    """
+    carry = b""
+    for off, data in _iter_chunks(path, start_offset):
+        base = off - len(carry)
+        buf = carry + data if carry else data
+        pos = 0
+        while True:
+            nl = buf.find(b"\n", pos)
+            if nl < 0:
+                break
+            yield base + pos, buf[pos:nl].rstrip(b"\r")
+            pos = nl + 1
+        carry = buf[pos:]
+    # a trailing partial line is the torn tail of an in-flight write
+
+
+def _iter_bin(path: Path, start_offset: int, chunk: int = _CHUNK) -> Iterator[Tuple[int, int, bytes]]:
+    """(offset, end, payload) for every complete binary frame from start_offset."""
+    carry = b""
+    for off, data in _iter_chunks(path, start_offset, chunk):
+        base = off - len(carry)
+        buf = carry + data if carry else data
+        used = 0
+        for foff, fend, payload in iter_frames(buf, base):
+            yield foff, fend, payload
+            used = fend - base
+        carry = buf[used:]
+
+
+_dict_cache: Dict[Tuple[int, int, int], Tuple[SegmentDictionary, threading.Lock]] = {}
+_dict_cache_lock = threading.Lock()
+
+
+def scan_dictionary(path: Path, upto: Optional[int] = None, d: Optional[SegmentDictionary] = None) -> SegmentDictionary:
+    """Dictionary of a binary segment as defined by the frames before `upto` (default: all)."""
+    if d is None:
+        d = SegmentDictionary()
+        d.scanned_to = _header_info(path)[1]
+    for off, end, payload in _iter_bin(path, d.scanned_to):
+        if upto is not None and off >= upto:
+            break
+        apply_definitions(payload, d)
+        d.scanned_to = end
+    return d
+
+
+def _reader_dictionary(path: Path, hdr: Dict[str, Any], upto: int) -> SegmentDictionary:
+    # Keyed by inode + header: survives the seal rename, not a rewrite.
+    try:
+        ino = os.stat(_resolve(path)).st_ino
+    except FileNotFoundError:
+        ino = 0
+    key = (ino, int(hdr.get("seq", 0)), int(hdr.get("created_ns", 0)))
+    with _dict_cache_lock:
+        hit = _dict_cache.get(key)
+        if hit is None:
+            if len(_dict_cache) > 64:
+                _dict_cache.clear()
+            d = SegmentDictionary()
+            d.scanned_to = _header_info(path)[1]
+            hit = _dict_cache[key] = (d, threading.Lock())
+    d, lock = hit
+    if d.scanned_to < upto:
+        with lock:
+            scan_dictionary(path, upto, d)
+    return d
+
+
+def iter_entries(path: Path, start_offset: int = 0, chunk: int = _CHUNK) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    Yield (offset, end, line) for every record of a segment in either
+    format, skipping the header. `line` is the canonical JSON line and `end`
+    the offset of the next record.
+    """
+    hdr, hend = _header_info(path)
+    if segment_format(hdr) == FORMAT_BIN:
+        start = max(int(start_offset), hend)
+        d = _reader_dictionary(path, hdr or {}, start)
+        for off, end, payload in _iter_bin(path, start, chunk):
+            yield off, end, decode_payload(payload, d)
+        return
+    for off, line in iter_raw_lines(path, start_offset):
+        if line and not (off == 0 and parse_header(line) is not None):
+            yield off, off + len(line) + 1, line
+
+
+def iter_lines(path: Path, start_offset: int = 0) -> Iterator[Tuple[int, bytes]]:
+    """Yield (offset, line) for every record line of a segment, skipping the header."""
+    for off, _end, line in iter_entries(path, start_offset):
+        yield off, line
+
+
+def scan_frames(path: Path, start_offset: int) -> Tuple[int, int, Optional[str]]:
+    """(records, end of the last complete frame, its hash) of a binary segment from start_offset."""
+    n = 0
+    end = int(start_offset)
+    last: Optional[bytes] = None
+    for _off, fend, payload in _iter_bin(path, start_offset):
+        n += 1
+        end = fend
+        last = payload
+    return n, end, (_frame_hash(last) if last is not None else None)
+
+
+def _frame_hash(payload: bytes) -> Optional[str]:
+    h = payload_hash(payload)
+    if h is None:
+        try:
+            h = str(json.loads(payload[1:]).get("hash", ""))
+        except Exception:
+            return None
+    return h
+
+
+def frame_hash_before(path: Path, end: int, start: int) -> Optional[str]:
+    """Hash of the binary frame ending exactly at `end` (plain segment), via its length trailer."""
+    try:
+        with open(path, "rb") as f:
+            got = read_last_frame(f, int(end), int(start))
+    except (FileNotFoundError, ValueError):
+        return None
+    return _frame_hash(got[1]) if got is not None else None
+
+
+def read_tail_records(path: Path, limit: int) -> List[bytes]:
+    """Last `limit` record lines of a plain binary segment: trailers to step back, one decode pass forward."""
+    if int(limit) <= 0:
+        return []
+    _hdr, hend = _header_info(path)
+    try:
+        with open(path, "rb") as f:
+            end = os.fstat(f.fileno()).st_size
+            start = end
+            for _ in range(int(limit)):
+                got = read_last_frame(f, start, hend)
+                if got is None:
+                    break
+                start = got[0]
+    except FileNotFoundError:
+        return []
+    if start == end and end > hend:
+        # torn tail: no trailer at EOF, walk forward instead
+        offs = [off for off, _e, _p in _iter_bin(path, hend)]
+        start = offs[-int(limit)] if len(offs) >= int(limit) else hend
+    return [line for _o, _e, line in iter_entries(path, start)][-int(limit):]
+
+
+def list_segments(active_path: Path, seg_dir: Optional[Path] = None) -> List[Tuple[SegmentInfo, Path]]:
+    """
+    Ordered (info, path) for every retained segment, active last. The active
+    segment's count/last_hash are not tracked in the manifest and are left 0/"".
+    """
+    active_path = Path(active_path)
+    seg_dir = Path(seg_dir) if seg_dir is not None else default_segment_dir(active_path)
+    m = SegmentManifest.load(seg_dir)
+    out = [(s, seg_dir / s.name) for s in m.sealed]
+    hdr = read_header(active_path) or {}
+    active = SegmentInfo(
+        seq=int(hdr.get("seq", m.active_seq)),
+        name=active_path.name,
+        first_index=int(hdr.get("first_index", m.active_first_index)),
+        prev_hash=str(hdr.get("prev_hash", m.active_prev_hash)),
+        created_ns=int(hdr.get("created_ns", m.active_created_ns)),
+        format=str(hdr.get("format", FORMAT_JSONL)),
+    )
+    out.append((active, active_path))
+    return out
+
+
+def segments_from(active_path: Path, start_index: int, seg_dir: Optional[Path] = None) -> List[Tuple[SegmentInfo, Path]]:
+    """Only the segments that can hold records with index >= start_index."""
+    segs = list_segments(active_path, seg_dir)
+    return [(s, p) for s, p in segs if s.sealed_ns == 0 or s.end_index > start_index]
+
+
+def iter_entries_from(
+    active_path: Path, start_index: int = 0, seg_dir: Optional[Path] = None
+) -> Iterator[Tuple[int, int, int, int, bytes]]:
+    """
+    Yield (index, seq, offset, end, line) for every record with index >=
+    start_index, opening only the segments that can contain them.
+    """
+    start_index = max(0, int(start_index))
+    for info, path in segments_from(active_path, start_index, seg_dir):
+        idx = info.first_index
+        for off, end, line in iter_entries(path):
+            if idx >= start_index:
+                yield idx, info.seq, off, end, line
+            idx += 1
+
+
+def iter_entries_at(
+    active_path: Path, index: int, seq: int, offset: int, seg_dir: Optional[Path] = None
+) -> Iterator[Tuple[int, int, int, int, bytes]]:
+    """
+    Like iter_entries_from, but starts at a known position: record `index`
+    lives in segment `seq` at byte `offset`. One seek, no line counting. If
+    that segment was dropped by retention, resumes at the oldest retained one.
+    """
+    for info, path in list_segments(active_path, seg_dir):
+        if info.seq < seq:
+            continue
+        if info.seq == seq:
+            idx, start = int(index), int(offset)
+        else:
+            idx, start = info.first_index, 0
+        for off, end, line in iter_entries(path, start):
+            yield idx, info.seq, off, end, line
+            idx += 1
+
+
+def iter_records_from(
+    active_path: Path, start_index: int = 0, seg_dir: Optional[Path] = None
+) -> Iterator[Tuple[int, int, int, bytes]]:
+    """Yield (index, seq, offset, line); see iter_entries_from."""
+    for idx, seq, off, _end, line in iter_entries_from(active_path, start_index, seg_dir):
+        yield idx, seq, off, line
+
+
+def iter_records_at(
+    active_path: Path, index: int, seq: int, offset: int, seg_dir: Optional[Path] = None
+) -> Iterator[Tuple[int, int, int, bytes]]:
+    """Yield (index, seq, offset, line); see iter_entries_at."""
+    for idx, s, off, _end, line in iter_entries_at(active_path, index, seq, offset, seg_dir):
+        yield idx, s, off, line
+
+
+def read_line_at(path: Path, offset: int) -> bytes:
+    path = _resolve(path)
+    if is_compressed(path) or segment_format(read_header(path)) == FORMAT_BIN:
+        for _off, _end, line in iter_entries(path, offset, chunk=4096):
+            return line
+        return b""
+    try:
+        with open(path, "rb") as f:
+            f.seek(int(offset))
+            return f.readline().rstrip(b"\r\n")
+    except FileNotFoundError:
+        return b""
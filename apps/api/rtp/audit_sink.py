@@ -0,0 +1,352 @@
+"""
+Kasbah RTP - audit sinks.
+
+Every audit producer writes through an AuditSink: emit() one record or
+emit_many() a group that must land together (one write, not one
+open/append/close per record).
+
+    LedgerSink        the hash-chained ledger (audit.jsonl, group commit)
+    BufferedFileSink  plain JSON lines for the auxiliary logs (rtp_audit.log,
+                      the secure-core leaf journal, ...): records are
+                      buffered in memory and written by one flusher thread
+                      per file, at most KASBAH_AUDIT_SINK_FLUSH_MS after
+                      they were emitted, with a single write() per flush
+    get_sink(path)    the process-wide BufferedFileSink for a path
+
+AsyncAuditSink is the asyncio front end for the ledger. Coroutines hand
+records to the ledger's writer thread without blocking the event loop: the
+writer resolves an asyncio future per record through call_soon_threadsafe
+once the record's batch is committed under the ledger's durability mode
+(see audit_ledger.py). When the ledger queue is full, append() backs off
+with asyncio.sleep until the commit timeout, so backpressure slows
+producers instead of stalling the loop.
+
+    sink = AsyncAuditSink(get_ledger(...))
+    ok = await sink.append(rec)
+    await sink.aclose()             # FastAPI shutdown: flush, fsync, stop
+"""
+
+from __future__ import annotations
+
+import abc
+import asyncio
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from .audit_ledger import (
+    DURABILITY_RELAXED,
+    KASBAH_AUDIT_COMMIT_TIMEOUT_SEC,
+    AuditLedger,
+)
+
+
+KASBAH_AUDIT_SINK_FLUSH_MS = float(os.environ.get("KASBAH_AUDIT_SINK_FLUSH_MS", "20"))
+KASBAH_AUDIT_SINK_BUFFER_MAX = int(os.environ.get("KASBAH_AUDIT_SINK_BUFFER_MAX", "10000"))
+
+
+class AuditSink(abc.ABC):
+    """Producer-side interface shared by every audit path. Never raises on emit."""
+
+    def emit(self, rec: Dict[str, Any]) -> bool:
+        return self.emit_many([rec])
+
+    @abc.abstractmethod
+    def emit_many(self, recs: Iterable[Dict[str, Any]]) -> bool:
+        """Write `recs` together; False when they were dropped."""
+
+    def flush(self, timeout: float = KASBAH_AUDIT_COMMIT_TIMEOUT_SEC) -> bool:
+        return True
+
+    def close(self, timeout: float = KASBAH_AUDIT_COMMIT_TIMEOUT_SEC) -> None:
+        self.flush(timeout)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {}
+
+
+class LedgerSink(AuditSink):
+    """Hash-chained sink: a group is committed adjacent, in one batch (AuditLedger.append_many)."""
+
+    def __init__(self, ledger: AuditLedger):
+        self.ledger = ledger
+
+    def emit_many(self, recs: Iterable[Dict[str, Any]], wait: Optional[bool] = None) -> bool:
+        try:
+            return self.ledger.append_many(list(recs), wait=wait)
+        except Exception:
+            return False
+
+    def flush(self, timeout: float = KASBAH_AUDIT_COMMIT_TIMEOUT_SEC) -> bool:
+        return self.ledger.flush(timeout)
+
+    def close(self, timeout: float = KASBAH_AUDIT_COMMIT_TIMEOUT_SEC) -> None:
+        self.ledger.close(timeout)
+
+    def metrics(self) -> Dict[str, Any]:
+        return self.ledger.metrics()
+
+
+class BufferedFileSink(AuditSink):
+    """
+    Unchained JSON-lines writer. emit_many() only encodes and buffers; the
+    flusher thread appends everything buffered with one write() to a file
+    it keeps open (O_APPEND, so concurrent processes never interleave
+    within a flush). The file is reopened when it was rotated away. A full
+    buffer drops records (counted) instead of blocking the caller.
+
+    With `lock_path`, each write holds an exclusive flock on that file, so a
+    process compacting the file under the same lock never loses an append.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        flush_ms: float = KASBAH_AUDIT_SINK_FLUSH_MS,
+        buffer_max: int = KASBAH_AUDIT_SINK_BUFFER_MAX,
+        fsync: bool = False,
+        lock_path: Optional[Path] = None,
+    ):
+        self.path = Path(path)
+        self.lock_path = Path(lock_path) if lock_path is not None else None
+        self.linger_sec = max(0.0, float(flush_ms)) / 1000.0
+        self.buffer_max = max(1, int(buffer_max))
+        self.fsync = bool(fsync)
+
+        self._cv = threading.Condition()
+        self._buf: List[bytes] = []
+        self._urgent = False
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._queued = 0  # records accepted so far
+        self._done = 0  # records handed to write() so far (ok or not)
+        self._last_ok = True
+
+        self._f: Optional[Any] = None
+        self._ino = 0
+
+        self.records_written = 0
+        self.records_dropped = 0
+        self.writes = 0
+        self.write_failures = 0
+
+    def emit_many(self, recs: Iterable[Dict[str, Any]]) -> bool:
+        try:
+            lines = [json.dumps(r, separators=(",", ":"), ensure_ascii=False).encode("utf-8") + b"\n" for r in recs]
+        except Exception:
+            return False
+        if not lines:
+            return True
+        with self._cv:
+            if self._closed or len(self._buf) + len(lines) > self.buffer_max:
+                self.records_dropped += len(lines)
+                return False
+            self._buf.extend(lines)
+            self._queued += len(lines)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"kasbah-sink-{self.path.name}", daemon=True)
+                self._thread.start()
+            self._cv.notify_all()
+        return True
+
+    def flush(self, timeout: float = KASBAH_AUDIT_COMMIT_TIMEOUT_SEC) -> bool:
+        """Block until everything emitted before this call has been written."""
+        with self._cv:
+            target = self._queued
+            if self._done >= target:
+                return self._last_ok
+            self._urgent = True
+            self._cv.notify_all()
+            if not self._cv.wait_for(lambda: self._done >= target, timeout):
+                return False
+            return self._last_ok
+
+    def close(self, timeout: float = KASBAH_AUDIT_COMMIT_TIMEOUT_SEC) -> None:
+        with self._cv:
+            if self._closed:
+                return
+            self._closed = True
+            self._cv.notify_all()
+            t = self._thread
+        if t is not None:
+            t.join(timeout)
+        if self._f is not None:
+            try:
+                self._f.close()
+            except Exception:
+                pass
+            self._f = None
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cv:
+            buffered = len(self._buf)
+        return {
+            "path": str(self.path),
+            "buffered": buffered,
+            "records_written": self.records_written,
+            "records_dropped": self.records_dropped,
+            "writes": self.writes,
+            "write_failures": self.write_failures,
+        }
+
+    def _run(self) -> None:
+        while True:
+            with self._cv:
+                while not self._buf and not self._closed:
+                    self._cv.wait()
+                if not self._buf:
+                    return  # closed and drained
+                # linger so records emitted close together share one write
+                deadline = time.monotonic() + self.linger_sec
+                while not (self._closed or self._urgent) and len(self._buf) < self.buffer_max:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cv.wait(remaining)
+                buf, self._buf = self._buf, []
+                self._urgent = False
+            ok = self._write(b"".join(buf))
+            with self._cv:
+                self._done += len(buf)
+                self._last_ok = ok
+                if ok:
+                    self.records_written += len(buf)
+                self._cv.notify_all()
+
+    def _open(self) -> Any:
+        try:
+            ino = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            ino = -1
+        if self._f is None or ino != self._ino:
+            if self._f is not None:
+                try:
+                    self._f.close()
+                except Exception:
+                    pass
+                self._f = None
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._f = open(self.path, "ab", buffering=0)
+            self._ino = os.fstat(self._f.fileno()).st_ino
+        return self._f
+
+    def _write(self, data: bytes) -> bool:
+        lockf = None
+        try:
+            if self.lock_path is not None:
+                lockf = open(self.lock_path, "a+")
+                fcntl.flock(lockf.fileno(), fcntl.LOCK_EX)
+            f = self._open()
+            view = memoryview(data)
+            while view:
+                view = view[f.write(view):]
+            if self.fsync:
+                os.fsync(f.fileno())
+            self.writes += 1
+            return True
+        except Exception:
+            self.write_failures += 1
+            if self._f is not None:
+                try:
+                    self._f.close()
+                except Exception:
+                    pass
+                self._f = None
+            return False
+        finally:
+            if lockf is not None:
+                lockf.close()  # releases the flock
+
+
+_sinks: Dict[str, BufferedFileSink] = {}
+_sinks_lock = threading.Lock()
+
+
+def get_sink(path: Path, lock_path: Optional[Path] = None) -> BufferedFileSink:
+    """Process-wide buffered sink per file (one flusher thread per file)."""
+    key = str(Path(path).resolve())
+    with _sinks_lock:
+        sink = _sinks.get(key)
+        if sink is None or sink._closed:
+            sink = BufferedFileSink(path, lock_path=lock_path)
+            _sinks[key] = sink
+        return sink
+
+
+@atexit.register
+def _close_all() -> None:
+    for sink in list(_sinks.values()):
+        try:
+            sink.close()
+        except Exception:
+            pass
+
+
+class AsyncAuditSink(LedgerSink):
+    """
+    Asyncio front end for the ledger: append() and aflush() await the
+    record's commit without blocking the event loop (see the module notes).
+    The blocking AuditSink methods (emit_many, flush, close) are LedgerSink's.
+    """
+
+    def __init__(self, ledger: AuditLedger, timeout: float = KASBAH_AUDIT_COMMIT_TIMEOUT_SEC):
+        super().__init__(ledger)
+        self.timeout = float(timeout)
+
+    async def _submit(self, rec: Optional[Dict[str, Any]], timeout: float) -> "Optional[asyncio.Future[bool]]":
+        loop = asyncio.get_running_loop()
+        fut: "asyncio.Future[bool]" = loop.create_future()
+
+        def _resolve(ok: bool) -> None:
+            if not fut.done():
+                fut.set_result(ok)
+
+        def _done(p: Any) -> None:
+            loop.call_soon_threadsafe(_resolve, bool(p.ok))
+
+        deadline = loop.time() + timeout
+        delay = 0.001
+        while not self.ledger.submit(rec, _done):
+            if self.ledger.closed or loop.time() >= deadline:
+                if rec is not None:
+                    self.ledger.note_dropped(1)
+                return None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        return fut
+
+    async def append(self, rec: Dict[str, Any], wait: Optional[bool] = None, timeout: Optional[float] = None) -> bool:
+        """Async ledger.append(): same durability / wait semantics."""
+        timeout = self.timeout if timeout is None else float(timeout)
+        if wait is None:
+            wait = self.ledger.durability != DURABILITY_RELAXED
+        fut = await self._submit(rec, timeout)
+        if fut is None:
+            return False
+        if not wait:
+            return True
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def aflush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued so far is committed and fsynced."""
+        timeout = self.timeout if timeout is None else float(timeout)
+        fut = await self._submit(None, timeout)
+        if fut is None:
+            return False
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def aclose(self) -> None:
+        """Graceful shutdown: flush, then stop the writer (final fsync included)."""
+        await self.aflush()
+        await asyncio.get_running_loop().run_in_executor(None, self.ledger.close)
@@ -0,0 +1,209 @@
+"""
+Kasbah RTP - live audit tail.
+
+AuditBroadcaster is a ledger commit listener: every committed batch is
+matched against each subscriber's filter (event / agent_id / tool_name) on
+the writer thread and handed to the subscriber's event loop, so live
+records never touch the file again.
+
+A subscription may start from a cursor (the same "<idx>" or
+"<idx>.<seq>.<offset>" tokens as the NDJSON export). Records up to the
+tip are then replayed from the log before switching to the live feed;
+duplicates across the switch are dropped by record index. A subscriber
+that falls more than KASBAH_AUDIT_TAIL_BUFFER records behind is caught up
+the same way from its last cursor instead of stalling the writer.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from .audit_export import format_cursor, iter_from_cursor, parse_cursor
+from .audit_index import AuditIndex
+from .audit_ledger import CommittedRecord
+
+
+KASBAH_AUDIT_TAIL_BUFFER = int(os.environ.get("KASBAH_AUDIT_TAIL_BUFFER", "1000"))
+KASBAH_AUDIT_TAIL_MAX_SUBSCRIBERS = int(os.environ.get("KASBAH_AUDIT_TAIL_MAX_SUBSCRIBERS", "64"))
+KASBAH_AUDIT_TAIL_HEARTBEAT_SEC = float(os.environ.get("KASBAH_AUDIT_TAIL_HEARTBEAT_SEC", "15"))
+
+# (index, cursor after the record, stored line)
+TailItem = Tuple[int, str, str]
+
+
+class TooManySubscribers(RuntimeError):
+    pass
+
+
+def _values(v: Optional[Iterable[str]]) -> Optional[Set[str]]:
+    if v is None:
+        return None
+    out = {str(x).strip() for x in v if str(x).strip()}
+    return out or None
+
+
+class TailFilter:
+    """Server-side filter; each set is OR-ed within, AND-ed across (None = any)."""
+
+    def __init__(
+        self,
+        events: Optional[Iterable[str]] = None,
+        agent_ids: Optional[Iterable[str]] = None,
+        tool_names: Optional[Iterable[str]] = None,
+    ):
+        self.events = _values(events)
+        self.agent_ids = _values(agent_ids)
+        self.tool_names = _values(tool_names)
+
+    @staticmethod
+    def tool_of(rec: Dict[str, Any]) -> str:
+        tool = rec.get("tool_name")
+        if tool is None and isinstance(rec.get("extra"), dict):
+            tool = rec["extra"].get("tool_name")
+        return str(tool or "")
+
+    def match(self, rec: Dict[str, Any]) -> bool:
+        if self.events is not None and str(rec.get("event") or "") not in self.events:
+            return False
+        if self.agent_ids is not None and str(rec.get("agent_id") or "") not in self.agent_ids:
+            return False
+        if self.tool_names is not None and self.tool_of(rec) not in self.tool_names:
+            return False
+        return True
+
+
+class _Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, filt: TailFilter, buffer: int):
+        self.loop = loop
+        self.filt = filt
+        self.q: "asyncio.Queue[TailItem]" = asyncio.Queue(max(1, int(buffer)))
+        self.lagged = False
+
+    def push(self, items: List[TailItem]) -> None:
+        # runs on the subscriber's loop
+        for it in items:
+            if self.lagged:
+                break
+            try:
+                self.q.put_nowait(it)
+            except asyncio.QueueFull:
+                self.lagged = True
+
+
+class AuditBroadcaster:
+    def __init__(
+        self,
+        active_path: Path,
+        index: Optional[AuditIndex] = None,
+        seg_dir: Optional[Path] = None,
+        buffer: int = KASBAH_AUDIT_TAIL_BUFFER,
+        max_subscribers: int = KASBAH_AUDIT_TAIL_MAX_SUBSCRIBERS,
+    ):
+        self.active_path = Path(active_path)
+        self.index = index
+        self.seg_dir = seg_dir
+        self.buffer = int(buffer)
+        self.max_subscribers = int(max_subscribers)
+        self._subs: List[_Subscriber] = []
+        self._lock = threading.Lock()
+
+    def on_commit(self, committed: List[CommittedRecord]) -> None:
+        """Ledger commit listener (writer thread): never blocks on a subscriber."""
+        with self._lock:
+            subs = list(self._subs)
+        for sub in subs:
+            if sub.lagged:
+                continue
+            items = [
+                (c.index, format_cursor(c.index + 1, c.seq, c.end), c.line)
+                for c in committed
+                if sub.filt.match(c.record)
+            ]
+            if items:
+                try:
+                    sub.loop.call_soon_threadsafe(sub.push, items)
+                except RuntimeError:
+                    pass  # loop closed; removed when its stream exits
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return len(self._subs)
+
+    def _replay(self, it: Any, filt: TailFilter, after: int, limit: int = 500) -> Tuple[List[TailItem], bool]:
+        out: List[TailItem] = []
+        for idx, seq, _off, end, line in it:
+            if idx <= after:
+                continue
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue
+            if filt.match(rec):
+                out.append((idx, format_cursor(idx + 1, seq, end), line.decode("utf-8", errors="replace")))
+            if len(out) >= limit:
+                return out, False
+        return out, True
+
+    async def stream(
+        self, filt: TailFilter, cursor: Optional[str] = None, heartbeat: float = KASBAH_AUDIT_TAIL_HEARTBEAT_SEC
+    ) -> AsyncIterator[Optional[TailItem]]:
+        """
+        Yield matching records after `cursor` (None: only records committed
+        from now on), then live ones. Yields None as a heartbeat when idle.
+        Raises CursorError for a malformed cursor.
+        """
+        if cursor:
+            parse_cursor(cursor)
+        loop = asyncio.get_running_loop()
+        sub = _Subscriber(loop, filt, self.buffer)
+        with self._lock:
+            if len(self._subs) >= self.max_subscribers:
+                raise TooManySubscribers("too many audit tail subscribers")
+            self._subs.append(sub)
+        last_idx = -1
+        resume = cursor
+        try:
+            while True:
+                if resume:
+                    # subscribed first, so nothing committed meanwhile is missed
+                    it = iter_from_cursor(self.active_path, resume, self.index, self.seg_dir)
+                    while True:
+                        items, done = await loop.run_in_executor(None, self._replay, it, filt, last_idx)
+                        for item in items:
+                            last_idx = item[0]
+                            resume = item[1]
+                            yield item
+                        if done:
+                            break
+                    resume = None
+                try:
+                    item = await asyncio.wait_for(sub.q.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    if sub.lagged and sub.q.empty():
+                        resume = self._catch_up(sub, resume, last_idx)
+                        continue
+                    yield None
+                    continue
+                if item[0] > last_idx:
+                    last_idx = item[0]
+                    yield item
+                if sub.lagged and sub.q.empty():
+                    resume = self._catch_up(sub, item[1], last_idx)
+        finally:
+            with self._lock:
+                try:
+                    self._subs.remove(sub)
+                except ValueError:
+                    pass
+
+    @staticmethod
+    def _catch_up(sub: _Subscriber, cursor: Optional[str], last_idx: int) -> str:
+        # Buffer overflowed: re-read from the log after the last delivered
+        # record, taking live records again from this point on.
+        sub.lagged = False
+        return cursor or str(last_idx + 1)
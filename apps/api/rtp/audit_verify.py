@@ -0,0 +1,275 @@
+"""
+Kasbah RTP - parallel, incremental audit chain verifier.
+
+Each plain JSONL segment is mmapped (compressed or binary segments are
+decoded frame by frame from the checkpointed offset) and checked in a
+worker process: every record's
+hash must match its canonical body and its prev_hash must equal the hash
+before it. Segment boundaries are then stitched in order (header prev_hash
+== previous segment's final hash). The last verified position is stored in
+a checkpoint so later runs only verify records appended since.
+
+    python -m apps.api.rtp.audit_verify --data-dir .kasbah [--workers 4] [--full]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .audit_ledger import encode_record
+from .audit_binary import FORMAT_BIN
+from .audit_segments import (
+    SegmentManifest,
+    default_segment_dir,
+    is_compressed,
+    iter_entries,
+    list_segments,
+    parse_header,
+    read_header,
+    segment_format,
+)
+
+
+def default_verify_path(active_path: Path) -> Path:
+    return Path(active_path).with_suffix(".verify.json")
+
+
+@dataclass
+class SegmentResult:
+    seq: int
+    first_index: int
+    count: int = 0
+    header_prev: Optional[str] = None
+    first_prev: Optional[str] = None
+    last_hash: str = ""
+    end_offset: int = 0
+    error: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class VerifyCheckpoint:
+    verified_through: int = 0
+    last_hash: str = ""
+    seq: int = 0
+    offset: int = 0
+
+
+@dataclass
+class VerifyReport:
+    ok: bool = True
+    records: int = 0
+    segments: int = 0
+    verified_through: int = 0
+    last_hash: str = ""
+    elapsed_sec: float = 0.0
+    records_per_sec: float = 0.0
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def _mmap_lines(mm: Any, start: int, size: int) -> Iterator[Tuple[int, bytes, int]]:
+    pos = start
+    while pos < size:
+        nl = mm.find(b"\n", pos)
+        if nl < 0:
+            return  # torn tail of an in-flight write
+        yield pos, mm[pos:nl], nl + 1
+        pos = nl + 1
+
+
+def _check_lines(
+    res: SegmentResult, lines: Iterator[Tuple[int, bytes, int]], expected_prev: Optional[str]
+) -> SegmentResult:
+    seq = res.seq
+    prev = expected_prev
+    idx = res.first_index
+    for pos, line, nxt in lines:
+        if pos == 0:
+            hdr = parse_header(line)
+            if hdr is not None:
+                res.header_prev = str(hdr.get("prev_hash", ""))
+                if prev is None:
+                    prev = res.header_prev
+                continue
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+            got_prev = str(rec.get("prev_hash", ""))
+            got_hash = str(rec.get("hash", ""))
+        except Exception:
+            res.error = {"seq": seq, "index": idx, "offset": pos, "reason": "unparseable record"}
+            return res
+        if res.first_prev is None:
+            res.first_prev = got_prev
+        if prev is not None and got_prev != prev:
+            res.error = {"seq": seq, "index": idx, "offset": pos, "reason": "prev_hash mismatch"}
+            return res
+        h, _ = encode_record(rec, got_prev)
+        if h != got_hash:
+            res.error = {"seq": seq, "index": idx, "offset": pos, "reason": "hash mismatch"}
+            return res
+        prev = got_hash
+        res.last_hash = got_hash
+        res.count += 1
+        idx += 1
+        res.end_offset = nxt
+    return res
+
+
+def verify_segment(path: str, seq: int, first_index: int, start_offset: int = 0, expected_prev: Optional[str] = None) -> SegmentResult:
+    """
+    Verify one segment from start_offset. With expected_prev=None the first
+    record's prev_hash is taken as-is (to be stitched by the caller).
+    Top-level so it can run in a ProcessPoolExecutor.
+    """
+    res = SegmentResult(seq=seq, first_index=first_index, end_offset=start_offset)
+    hdr = read_header(Path(path))
+    if is_compressed(Path(path)) or segment_format(hdr) == FORMAT_BIN:
+        if not os.path.exists(path):
+            res.error = {"seq": seq, "reason": "segment missing"}
+            return res
+        if hdr is not None and start_offset == 0:
+            res.header_prev = str(hdr.get("prev_hash", ""))
+            if expected_prev is None:
+                expected_prev = res.header_prev
+        try:
+            lines = ((off, line, end) for off, end, line in iter_entries(Path(path), start_offset))
+            return _check_lines(res, lines, expected_prev)
+        except ValueError as e:
+            res.error = {"seq": seq, "index": first_index + res.count, "offset": res.end_offset, "reason": f"unreadable frame: {e}"}
+            return res
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        res.error = {"seq": seq, "reason": "segment missing"}
+        return res
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= start_offset:
+            return res
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return _check_lines(res, _mmap_lines(mm, start_offset, size), expected_prev)
+        finally:
+            mm.close()
+
+
+def _load_checkpoint(path: Path) -> VerifyCheckpoint:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            obj = json.load(f) or {}
+        return VerifyCheckpoint(**{k: obj[k] for k in ("verified_through", "last_hash", "seq", "offset") if k in obj})
+    except Exception:
+        return VerifyCheckpoint()
+
+
+def _save_checkpoint(path: Path, cp: VerifyCheckpoint) -> None:
+    tmp = str(path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(asdict(cp), f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def verify_log(
+    active_path: Path,
+    seg_dir: Optional[Path] = None,
+    checkpoint_path: Optional[Path] = None,
+    workers: int = 0,
+    full: bool = False,
+) -> VerifyReport:
+    active_path = Path(active_path)
+    seg_dir = Path(seg_dir) if seg_dir is not None else default_segment_dir(active_path)
+    checkpoint_path = Path(checkpoint_path) if checkpoint_path is not None else default_verify_path(active_path)
+    t0 = time.perf_counter()
+
+    m = SegmentManifest.load(seg_dir)
+    cp = VerifyCheckpoint() if full else _load_checkpoint(checkpoint_path)
+    segs = list_segments(active_path, seg_dir)
+
+    if cp.seq and m.pruned_through_seq >= cp.seq:
+        # retention removed the checkpointed segment and possibly later ones:
+        # continue from where the retained chain starts
+        cp = VerifyCheckpoint(m.pruned_count, m.pruned_last_hash, m.pruned_through_seq, 0)
+
+    # verify_segment args (path, seq, first_index, start_offset, expected_prev)
+    jobs: List[Tuple[str, int, int, int, Optional[str]]] = []
+    anchor: Optional[str] = None
+    for info, path in segs:
+        if cp.seq and info.seq < cp.seq:
+            continue
+        if cp.seq and info.seq == cp.seq:
+            jobs.append((str(path), info.seq, cp.verified_through, cp.offset, cp.last_hash))
+            anchor = cp.last_hash
+        else:
+            jobs.append((str(path), info.seq, info.first_index, 0, None))
+    if anchor is None:
+        if cp.seq:
+            anchor = cp.last_hash  # checkpointed segment sealed away with no records after it
+        elif m.pruned_through_seq:
+            anchor = m.pruned_last_hash
+        else:
+            anchor = ""
+
+    workers = int(workers) if workers else (os.cpu_count() or 1)
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as ex:
+            results = list(ex.map(verify_segment, *zip(*jobs)))
+    else:
+        results = [verify_segment(*j) for j in jobs]
+
+    report = VerifyReport(segments=len(results), verified_through=cp.verified_through, last_hash=cp.last_hash)
+    good = VerifyCheckpoint(cp.verified_through, cp.last_hash, cp.seq, cp.offset)
+    prev = anchor
+    for r in results:
+        # stitch: the segment must continue from what precedes it
+        for got, what in ((r.header_prev, "header prev_hash"), (r.first_prev, "first prev_hash")):
+            if got is not None and got != prev:
+                report.errors.append({"seq": r.seq, "index": r.first_index, "reason": f"{what} does not match previous segment"})
+                break
+        if report.errors:
+            break
+        report.records += r.count
+        if r.count:
+            prev = r.last_hash
+            good = VerifyCheckpoint(r.first_index + r.count, r.last_hash, r.seq, r.end_offset)
+        elif r.seq == good.seq:
+            good.offset = max(good.offset, r.end_offset)
+        if r.error:
+            report.errors.append(r.error)
+            break
+
+    report.ok = not report.errors
+    report.verified_through = good.verified_through
+    report.last_hash = good.last_hash
+    report.elapsed_sec = round(time.perf_counter() - t0, 6)
+    report.records_per_sec = round(report.records / report.elapsed_sec, 1) if report.elapsed_sec > 0 else 0.0
+    if good != cp:
+        try:
+            _save_checkpoint(checkpoint_path, good)
+        except Exception:
+            pass
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Verify the Kasbah hash-chained audit log")
+    ap.add_argument("--data-dir", default=os.environ.get("KASBAH_DATA_DIR", ".kasbah"))
+    ap.add_argument("--workers", type=int, default=0, help="worker processes (default: CPU count)")
+    ap.add_argument("--full", action="store_true", help="ignore the checkpoint and verify everything")
+    args = ap.parse_args(argv)
+
+    rep = verify_log(Path(args.data_dir) / "audit.jsonl", workers=args.workers, full=args.full)
+    print(json.dumps(asdict(rep), indent=2))
+    return 0 if rep.ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,302 @@
+"""
+Kasbah RTP - in-process cache of the emergency kill switches.
+
+The flags change a few times a year but are consulted on every decide and
+consume, so each API process keeps them in memory and the request path
+reads them without touching Redis.
+
+Every flag lives in its own key (kasbah:emergency:all / tool:<name> /
+principal:<name>, as checked by the precheck scripts) and is mirrored in
+the registry hash kasbah:emergency:flags ("all", "tool:<name>",
+"principal:<name>", plus "_ts_ns" of the last change). set_flag() updates
+key, hash and timestamp in one MULTI and PUBLISHes on kasbah:emergency. On
+Redis Cluster they all share the {emergency} hash slot (keyspace.py).
+Flag keys set before the registry existed are copied into it when a
+cache starts (seed_registry), so a kill switch that was already on stays
+on once the cache is trusted.
+
+A daemon thread per process subscribes to that channel and reloads the
+hash (one HGETALL) on every message. While the subscription is down it
+reloads every KASBAH_EMERGENCY_POLL_SEC and keeps trying to resubscribe;
+while it is up it still resyncs every KASBAH_EMERGENCY_RESYNC_SEC, in case
+a message was lost around a reconnect.
+
+Propagation bound: a change reaches a process within one pub/sub delivery
+plus one HGETALL while subscribed, and within KASBAH_EMERGENCY_POLL_SEC
+plus one HGETALL otherwise. The view is confirmed by every reload and by
+a PONG on the subscription (PINGed every KASBAH_EMERGENCY_MAX_STALE_SEC/2
+when idle); a process that has not confirmed it for
+KASBAH_EMERGENCY_MAX_STALE_SEC (e.g. a half-open connection) stops trusting the cache
+(current() returns None) and the checks go back to the precheck scripts.
+Observed propagation delays (change timestamp -> applied here) are in
+metrics().
+
+    KASBAH_EMERGENCY_CACHE            enable the cache (1)
+    KASBAH_EMERGENCY_POLL_SEC         refresh interval without pub/sub (1)
+    KASBAH_EMERGENCY_RESYNC_SEC       full refresh while subscribed (30)
+    KASBAH_EMERGENCY_MAX_STALE_SEC    distrust an unconfirmed cache after (5)
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, Optional
+
+from .keyspace import KEYS
+from .redis_scripts import (
+    PRECHECK_EMERGENCY_ALL,
+    PRECHECK_EMERGENCY_PRINCIPAL,
+    PRECHECK_EMERGENCY_TOOL,
+    PRECHECK_OK,
+)
+
+
+KASBAH_EMERGENCY_CACHE = os.environ.get("KASBAH_EMERGENCY_CACHE", "1").strip().lower() in ("1", "true", "yes", "on")
+KASBAH_EMERGENCY_POLL_SEC = float(os.environ.get("KASBAH_EMERGENCY_POLL_SEC", "1"))
+KASBAH_EMERGENCY_RESYNC_SEC = float(os.environ.get("KASBAH_EMERGENCY_RESYNC_SEC", "30"))
+KASBAH_EMERGENCY_MAX_STALE_SEC = float(os.environ.get("KASBAH_EMERGENCY_MAX_STALE_SEC", "5"))
+
+CHANNEL = "kasbah:emergency"
+FLAGS_KEY = KEYS.emergency("flags")
+TS_FIELD = "_ts_ns"
+
+
+def flag_key(field: str) -> str:
+    """Registry field ("all", "tool:x", "principal:y") -> the flag's own key."""
+    return KEYS.emergency(field)
+
+
+# copy one pre-registry flag key into the hash, unless it was cleared meanwhile
+_SEED_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 and redis.call('HSETNX', KEYS[2], ARGV[1], '1') == 1 then
+  redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+  return 1
+end
+return 0
+"""
+
+
+def seed_registry(rc: Any) -> int:
+    """Add every tool / principal flag key missing from the registry hash; returns how many."""
+    n = 0
+    prefix = flag_key("")
+    for kind in ("tool:", "principal:"):
+        for key in rc.scan_iter(match=flag_key(kind) + "*", count=1000):
+            key = key.decode("utf-8") if isinstance(key, bytes) else str(key)
+            field = key[len(prefix):]
+            n += int(rc.eval(_SEED_LUA, 2, key, FLAGS_KEY, field, TS_FIELD, str(time.time_ns())) or 0)
+    return n
+
+
+def set_flag(rc: Any, field: str, on: bool) -> int:
+    """Set or clear one flag everywhere and notify every process; returns the change ts_ns."""
+    ts = time.time_ns()
+    pipe = rc.pipeline(transaction=True)
+    if on:
+        pipe.set(flag_key(field), "1")
+        pipe.hset(FLAGS_KEY, field, "1")
+    else:
+        pipe.delete(flag_key(field))
+        pipe.hdel(FLAGS_KEY, field)
+    pipe.hset(FLAGS_KEY, TS_FIELD, str(ts))
+    pipe.publish(CHANNEL, json.dumps({"field": field, "on": bool(on), "ts_ns": ts}, separators=(",", ":")))
+    pipe.execute()
+    return ts
+
+
+@dataclass(frozen=True)
+class EmergencyState:
+    all: bool = False
+    tools: FrozenSet[str] = frozenset()
+    principals: FrozenSet[str] = frozenset()
+    changed_ns: int = 0
+
+    @classmethod
+    def from_hash(cls, h: Dict[str, str], legacy_all: Any = None) -> "EmergencyState":
+        tools = frozenset(f[5:] for f, v in h.items() if f.startswith("tool:") and v)
+        principals = frozenset(f[10:] for f, v in h.items() if f.startswith("principal:") and v)
+        try:
+            ts = int(h.get(TS_FIELD) or 0)
+        except ValueError:
+            ts = 0
+        # the "all" key may have been set directly (before the registry existed)
+        return cls(bool(h.get("all")) or bool(legacy_all), tools, principals, ts)
+
+    def code(self, tool_name: Optional[str], principal: Optional[str]) -> int:
+        """PRECHECK_EMERGENCY_* verdict, in the precheck scripts' order."""
+        if self.all:
+            return PRECHECK_EMERGENCY_ALL
+        if tool_name and tool_name in self.tools:
+            return PRECHECK_EMERGENCY_TOOL
+        if principal and principal in self.principals:
+            return PRECHECK_EMERGENCY_PRINCIPAL
+        return PRECHECK_OK
+
+
+async def load_state_async(rc: Any) -> Optional[EmergencyState]:
+    """The flags straight from Redis (redis.asyncio client); None when unavailable."""
+    if rc is None:
+        return None
+    try:
+        pipe = rc.pipeline(transaction=False)
+        pipe.hgetall(FLAGS_KEY)
+        pipe.get(flag_key("all"))
+        h, legacy_all = await pipe.execute()
+    except Exception:
+        return None
+    return EmergencyState.from_hash(h or {}, legacy_all)
+
+
+class EmergencyCache:
+    def __init__(
+        self,
+        get_client: Callable[[], Any],
+        poll_sec: float = KASBAH_EMERGENCY_POLL_SEC,
+        resync_sec: float = KASBAH_EMERGENCY_RESYNC_SEC,
+        max_stale_sec: float = KASBAH_EMERGENCY_MAX_STALE_SEC,
+    ):
+        self.get_client = get_client
+        self.poll_sec = max(0.05, float(poll_sec))
+        self.resync_sec = max(self.poll_sec, float(resync_sec))
+        self.max_stale_sec = max(self.poll_sec, float(max_stale_sec))
+        self._state: Optional[EmergencyState] = None
+        self._confirmed = 0.0  # monotonic time the view was last known current
+        self._synced = 0.0
+        self._subscribed = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.seeded = 0
+        self.messages = 0
+        self.subscriptions = 0
+        self.propagation_ms_last: Optional[float] = None
+        self.propagation_ms_max = 0.0
+
+    # ---- request path ----
+
+    def current(self) -> Optional[EmergencyState]:
+        """The cached flags, or None when they may be stale (ask Redis instead)."""
+        st = self._state
+        if st is None or time.monotonic() - self._confirmed > self.max_stale_sec:
+            return None
+        return st
+
+    # ---- refresh ----
+
+    def refresh(self, rc: Any = None) -> bool:
+        """Reload the registry hash (one round trip); False when Redis is unavailable."""
+        rc = rc if rc is not None else self.get_client()
+        if rc is None:
+            return False
+        try:
+            pipe = rc.pipeline(transaction=False)
+            pipe.hgetall(FLAGS_KEY)
+            pipe.get(flag_key("all"))
+            h, legacy_all = pipe.execute()
+        except Exception:
+            self.refresh_errors += 1
+            return False
+        st = EmergencyState.from_hash(h or {}, legacy_all)
+        prev = self._state
+        self._state = st
+        self._confirmed = self._synced = time.monotonic()
+        self.refreshes += 1
+        if prev is not None and st.changed_ns and st.changed_ns != prev.changed_ns:
+            ms = max(0.0, (time.time_ns() - st.changed_ns) / 1e6)
+            self.propagation_ms_last = round(ms, 3)
+            self.propagation_ms_max = max(self.propagation_ms_max, ms)
+        return True
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        rc = self.get_client()
+        if rc is not None:
+            try:
+                self.seeded += seed_registry(rc)
+            except Exception:
+                self.refresh_errors += 1
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name="kasbah-emergency-cache", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        t = self._thread
+        if t is not None:
+            t.join(timeout=self.poll_sec + 1.0)
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            rc = self.get_client()
+            ps = None
+            try:
+                if rc is None:
+                    raise RuntimeError("redis unavailable")
+                ps = rc.pubsub(ignore_subscribe_messages=True)
+                ps.subscribe(CHANNEL)
+                self._subscribed = True
+                self.subscriptions += 1
+                # subscribed first, so no change between this load and the feed is missed
+                self.refresh(rc)
+                last_ping = time.monotonic()
+                while not self._stop.is_set():
+                    now = time.monotonic()
+                    if now - self._synced >= self.resync_sec:
+                        self.refresh(rc)
+                    elif now - last_ping >= self.max_stale_sec / 2.0:
+                        # a PONG on this connection proves no message can have been missed
+                        ps.ping()
+                        last_ping = now
+                    msg = ps.get_message(timeout=self.poll_sec)
+                    if msg is None:
+                        continue
+                    if msg.get("type") == "pong":
+                        self._confirmed = time.monotonic()
+                        continue
+                    self.messages += 1
+                    self.refresh(rc)
+            except Exception:
+                pass
+            finally:
+                self._subscribed = False
+                if ps is not None:
+                    try:
+                        ps.close()
+                    except Exception:
+                        pass
+            # subscription down: poll until it can be re-established
+            if not self._stop.wait(self.poll_sec):
+                self.refresh()
+
+    def metrics(self) -> Dict[str, Any]:
+        st = self._state
+        age = time.monotonic() - self._confirmed if st is not None else None
+        return {
+            "enabled": True,
+            "subscribed": self._subscribed,
+            "trusted": self.current() is not None,
+            "confirmed_age_ms": round(age * 1000.0, 3) if age is not None else None,
+            "bound_ms": {
+                "subscribed": "pubsub delivery + 1 RTT",
+                "polling": round(self.poll_sec * 1000.0, 3),
+                "max_stale": round(self.max_stale_sec * 1000.0, 3),
+            },
+            "propagation_ms": {"last": self.propagation_ms_last, "max": round(self.propagation_ms_max, 3)},
+            "flags": (
+                {"all": st.all, "tools": sorted(st.tools), "principals": sorted(st.principals)} if st is not None else None
+            ),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "messages": self.messages,
+            "subscriptions": self.subscriptions,
+            "seeded": self.seeded,
+        }
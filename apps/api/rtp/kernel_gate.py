@@ -4,7 +4,7 @@ from pathlib import Path
 Kasbah RTP - Runtime Policy Gate + Audit
 """
 
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from dataclasses import dataclass
 import hashlib
 import hmac
@@ -14,7 +14,7 @@ import os
 import uuid
 import dataclasses
 
-from .audit import append_audit
+from .audit import append_audit, append_audit_many
 from apps.api.rtp.integrity import geometric_integrity
 from apps.api.rtp.signals import SignalTracker
 
@@ -179,19 +179,27 @@ class KernelGate:
         if ticket.tool_name != tool_name:
             return TicketValidationResult(False, "tool_mismatch")
         
+        # everything this consume logs goes out as one batched write
+        audit: List[Dict] = []
+        try:
+            return self._intercept(tool_name, jti, usage, ticket, audit)
+        finally:
+            append_audit_many(audit)
+
+    def _intercept(self, tool_name: str, jti: str, usage: Dict, ticket: ExecutionTicket, audit: List[Dict]) -> TicketValidationResult:
         # --- behavior integrity: provenance + decay + geometry ---
         agent_id = usage.get("agent_id") or usage.get("session_id") or "anon"
         raw_signals = usage.get("signals", {}) or {}
         
         eff_signals = _signal_tracker.update(agent_id, raw_signals) if raw_signals else {}
-        append_audit({"event":"GEOMETRY_SEEN","agent_id":agent_id,"jti":jti,"raw":raw_signals,"eff":eff_signals})
+        audit.append({"event":"GEOMETRY_SEEN","agent_id":agent_id,"jti":jti,"raw":raw_signals,"eff":eff_signals})
         
         signals_for_gate = eff_signals or raw_signals
         if signals_for_gate:
             gi = geometric_integrity(signals_for_gate)
             threshold = float(os.getenv("KASBAH_GEOMETRY_THRESHOLD", "70"))
             if gi >= threshold:
-                append_audit({
+                audit.append({
                     "event": "GEOMETRY_BLOCK",
                     "jti": jti,
                     "agent_id": agent_id,
@@ -203,14 +211,14 @@ class KernelGate:
                 return TicketValidationResult(False, "geometry_block")
             else:
                 # FIXED: Log GEOMETRY_ALLOW event
-                append_audit({"event":"GEOMETRY_ALLOW","jti":jti,"agent_id":agent_id,"score":gi,"threshold":threshold,"signals_raw":raw_signals,"signals_eff":eff_signals})
+                audit.append({"event":"GEOMETRY_ALLOW","jti":jti,"agent_id":agent_id,"score":gi,"threshold":threshold,"signals_raw":raw_signals,"signals_eff":eff_signals})
         # --- end behavior integrity ---
         
         res = self.validate_ticket(ticket, usage)
         if res.valid:
             self.used_jti_tracker.add(jti)
             del self.ticket_map[jti]
-            append_audit({"event": "CONSUME", "tool": tool_name, "jti": jti})
+            audit.append({"event": "CONSUME", "tool": tool_name, "jti": jti})
         
         return res
 
@@ -0,0 +1,114 @@
+"""
+Kasbah RTP - Redis key layout.
+
+On a single Redis node (or a Sentinel-managed primary) the keys are
+untagged: kasbah:brittle:lock:<agent>, kasbah:rl:<op>:<scope>:<id>,
+kasbah:rl:<bucket>, kasbah:ticket:consumed:<fp>, kasbah:emergency:*,
+kasbah:thermo:*. The brittle, consume-once and emergency keys are the ones
+earlier releases used; the rate-limit and thermo keys hold new value
+formats under new names, so older values are ignored.
+
+Redis Cluster only runs a script or MULTI whose keys all map to one hash
+slot, and a key's slot is chosen by its hash tag (the part in braces). In
+cluster mode the keys are tagged so that what is used together lives
+together:
+
+    kasbah:{agent:<id>}:brittle:lock, :brittle:strikes
+    kasbah:{agent:<id>}:rl:<op>:agent, :rl:<op>:agent:cost
+    kasbah:{rl:<level>:<id>}:<op>:<scope>    global / principal / tool limits
+    kasbah:{rl:<bucket>}                     a named standalone limit
+    kasbah:{ticket:<fp>}:consumed            the consume-once mark
+    kasbah:{emergency}:all, :tool:<name>, :principal:<name>, :flags
+    kasbah:{thermo}:instances, :lock_until
+
+Every per-agent key shares the agent's slot, so an agent's precheck and
+consume gate remain one single-slot script. Limits shared across agents
+(global, principal, tool) are charged by one script per slot before that.
+The consume-once mark depends only on the ticket (the agent_id of a
+consume request is not authenticated), so in cluster mode it lives in the
+ticket's own slot and is set in a second step once the gate has passed.
+
+The two layouts do not share state: switching REDIS_URL to a cluster
+starts with empty rate limits and brittle locks, and the emergency flags
+must be set again.
+
+    KASBAH_REDIS_CLUSTER_KEYS    auto (tagged for redis+cluster:// URLs), 1 or 0
+"""
+
+from __future__ import annotations
+
+import os
+
+
+KASBAH_REDIS_CLUSTER_KEYS = os.environ.get("KASBAH_REDIS_CLUSTER_KEYS", "auto").strip().lower()
+
+
+def is_cluster_url(url: str) -> bool:
+    return url.split("://", 1)[0].lower() in ("redis+cluster", "rediss+cluster")
+
+
+def cluster_keys_enabled(url: str = "", setting: str = KASBAH_REDIS_CLUSTER_KEYS) -> bool:
+    if setting in ("1", "true", "yes", "on"):
+        return True
+    if setting in ("0", "false", "no", "off"):
+        return False
+    return is_cluster_url(url or os.environ.get("REDIS_URL", "redis://redis:6379/0"))
+
+
+def slot_tag(key: str) -> str:
+    """The part of `key` Redis Cluster hashes: the first non-empty {...}, else the whole key."""
+    i = key.find("{")
+    if i >= 0:
+        j = key.find("}", i + 1)
+        if j > i + 1:
+            return key[i + 1 : j]
+    return key
+
+
+def same_slot(a: str, b: str) -> bool:
+    return slot_tag(a) == slot_tag(b)
+
+
+class KeySpace:
+    def __init__(self, cluster: bool = False):
+        self.cluster = bool(cluster)
+
+    def brittle_lock(self, agent_id: str) -> str:
+        if self.cluster:
+            return f"kasbah:{{agent:{agent_id}}}:brittle:lock"
+        return f"kasbah:brittle:lock:{agent_id}"
+
+    def brittle_strikes(self, agent_id: str) -> str:
+        if self.cluster:
+            return f"kasbah:{{agent:{agent_id}}}:brittle:strikes"
+        return f"kasbah:brittle:strikes:{agent_id}"
+
+    def consumed(self, ticket_fp: str) -> str:
+        if self.cluster:
+            return f"kasbah:{{ticket:{ticket_fp}}}:consumed"
+        return "kasbah:ticket:consumed:" + ticket_fp
+
+    def rate_limit(self, op: str, scope: str, level: str, ident: str) -> str:
+        """`scope` is the limit ("tool", "tool:cost", ...), `level` whose it is ("tool")."""
+        if not self.cluster:
+            return f"kasbah:rl:{op}:{scope}:{ident}"
+        if level == "agent":
+            return f"kasbah:{{agent:{ident}}}:rl:{op}:{scope}"
+        return f"kasbah:{{rl:{level}:{ident}}}:{op}:{scope}"
+
+    def bucket(self, name: str) -> str:
+        """A standalone limit outside the decide/consume scopes (its own slot)."""
+        if self.cluster:
+            return f"kasbah:{{rl:{name}}}"
+        return f"kasbah:rl:{name}"
+
+    def emergency(self, field: str) -> str:
+        """Flag key ("all", "tool:<name>", "principal:<name>") or the "flags" registry."""
+        return ("kasbah:{emergency}:" if self.cluster else "kasbah:emergency:") + field
+
+    def thermo(self, name: str) -> str:
+        return ("kasbah:{thermo}:" if self.cluster else "kasbah:thermo:") + name
+
+
+# the layout of this process, from REDIS_URL / KASBAH_REDIS_CLUSTER_KEYS
+KEYS = KeySpace(cluster_keys_enabled())
@@ -0,0 +1,203 @@
+"""
+Kasbah RTP - local quota leasing for the GCRA rate limits.
+
+With KASBAH_RL_LEASE=1, rtp_decide does not ask Redis for every request.
+Each process leases a block of tokens per rate-limit key (one QUOTA_LEASE
+script call covers every limit of the request and the agent's brittle
+lock) and admits requests from it locally. When a lease expires its unused
+tokens are handed back to Redis with the next lease call for that key, so
+Redis traffic grows with the number of processes and lease expiries, not
+with the number of requests.
+
+KASBAH_RL_LEASE_ERROR (e) bounds the error for a limit of L per window W:
+    - a lease holds at most max(1, c, e*L) tokens (c: the cost of the
+      request that took it) and lives e*W seconds
+    - tokens are charged in Redis when leased, so admissions can lag the
+      charge by at most e*W: at most about e*L admissions beyond L in any
+      window
+    - each process can park at most e*L tokens that other processes cannot
+      use until its lease expires
+The agent's brittle lock is refreshed with every lease call, and a strike
+recorded by this process applies at once. A lock set by another process is
+seen within e*W.
+
+Leasing is only used while the emergency flags are known locally (see
+emergency_cache.py). Otherwise, or without Redis, decide uses the
+precheck script as before.
+
+    KASBAH_RL_LEASE          enable leasing for decide (0)
+    KASBAH_RL_LEASE_ERROR    lease size and lifetime as a fraction of each limit (0.1)
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .keyspace import slot_tag
+from .redis_scripts import (
+    PRECHECK_BRITTLE,
+    PRECHECK_OK,
+    PRECHECK_RATE_LIMITED,
+    Precheck,
+    RateLimit,
+    quota_lease_async,
+)
+
+
+KASBAH_RL_LEASE = os.environ.get("KASBAH_RL_LEASE", "0").strip().lower() in ("1", "true", "yes", "on")
+KASBAH_RL_LEASE_ERROR = float(os.environ.get("KASBAH_RL_LEASE_ERROR", "0.1"))
+
+Acquire = Callable[..., Awaitable[Tuple[int, Optional[float], int, Optional[str], List[int]]]]
+
+
+@dataclass
+class _Lease:
+    limit: RateLimit
+    tokens: int
+    expires: float  # monotonic
+
+
+class QuotaLeaser:
+    def __init__(self, error: float = KASBAH_RL_LEASE_ERROR, acquire: Acquire = quota_lease_async):
+        self.error = min(1.0, max(0.0, float(error)))
+        self.acquire = acquire
+        self._lock = threading.Lock()
+        self._leases: Dict[str, _Lease] = {}
+        self._brittle: Dict[str, float] = {}  # brittle key -> locked until (unix seconds)
+
+        self.local_hits = 0
+        self.lease_calls = 0
+        self.tokens_leased = 0
+        self.tokens_returned = 0
+        self.release_failures = 0  # release_all calls that could not hand tokens back
+
+    def lease_size(self, lim: RateLimit) -> int:
+        return max(1, lim.cost, int(lim.limit * self.error))
+
+    def lease_sec(self, lim: RateLimit) -> float:
+        return float(lim.window_sec) * self.error
+
+    def note_brittle(self, brittle_key: str, until: float) -> None:
+        """A brittle lock set by this process applies to its leases at once."""
+        with self._lock:
+            self._brittle[brittle_key] = max(until, self._brittle.get(brittle_key, 0.0))
+
+    def _take_local(self, brittle_key: str, limits: Sequence[RateLimit], brittle_enabled: bool, mono: float) -> Optional[Precheck]:
+        # caller holds self._lock
+        if brittle_enabled and self._brittle.get(brittle_key, 0.0) > time.time():
+            return Precheck(PRECHECK_BRITTLE, 0)
+        leases = [self._leases.get(lim.key) for lim in limits]
+        if any(ls is None or ls.tokens < lim.cost or ls.expires <= mono for ls, lim in zip(leases, limits)):
+            return None
+        for ls, lim in zip(leases, limits):
+            ls.tokens -= lim.cost  # type: ignore[union-attr]
+        self.local_hits += 1
+        return Precheck(PRECHECK_OK, min((ls.tokens for ls in leases), default=0))  # type: ignore[union-attr]
+
+    async def precheck(
+        self, rc: Any, brittle_key: str, limits: Sequence[RateLimit], now: float, brittle_enabled: bool = True
+    ) -> Optional[Precheck]:
+        """
+        Brittle lock + rate limits from local leases, leasing more when
+        needed. None when there is no limit to lease, Redis is unavailable
+        or the fresh lease was used up by concurrent requests (use the
+        precheck script).
+        """
+        if not limits:
+            return None  # nothing to lease; the brittle lock alone is one round trip anyway
+        mono = time.monotonic()
+        with self._lock:
+            pre = self._take_local(brittle_key, limits, brittle_enabled, mono)
+            if pre is not None:
+                return pre
+            # take over the leases to renew: expired ones give back their tokens
+            items: List[Tuple[RateLimit, int, int]] = []
+            for lim in limits:
+                ls = self._leases.get(lim.key)
+                if ls is not None and ls.tokens >= lim.cost and ls.expires > mono:
+                    items.append((lim, 0, 0))
+                    continue
+                ret = ls.tokens if ls is not None and ls.tokens > 0 else 0
+                self._leases.pop(lim.key, None)
+                items.append((lim, self.lease_size(lim), ret))
+        if rc is None:
+            self._restore(items, mono)
+            return None
+        try:
+            code, brittle_until, retry, scope, granted = await self.acquire(
+                rc, brittle_key, items, now=now, brittle_enabled=brittle_enabled
+            )
+        except Exception:
+            self._restore(items, mono)
+            return None
+
+        mono = time.monotonic()
+        with self._lock:
+            self.lease_calls += 1
+            self.tokens_returned += sum(ret for _, _, ret in items)
+            self._brittle[brittle_key] = brittle_until or 0.0
+            if code == PRECHECK_BRITTLE:
+                return Precheck(PRECHECK_BRITTLE, 0)
+            if code == PRECHECK_RATE_LIMITED:
+                return Precheck(PRECHECK_RATE_LIMITED, 0, retry, scope)
+            for (lim, want, _), g in zip(items, granted):
+                if not want:
+                    continue
+                self.tokens_leased += g
+                ls = self._leases.get(lim.key)
+                if ls is None or ls.expires <= mono:
+                    ls = self._leases[lim.key] = _Lease(lim, 0, mono + self.lease_sec(lim))
+                ls.tokens += g
+            # None: concurrent requests used the new lease up meanwhile
+            return self._take_local(brittle_key, limits, brittle_enabled, mono)
+
+    def _restore(self, items: Sequence[Tuple[RateLimit, int, int]], mono: float) -> None:
+        # Redis unreachable: keep the unused tokens of expired leases for the next attempt
+        with self._lock:
+            for lim, want, ret in items:
+                if want and ret and lim.key not in self._leases:
+                    self._leases[lim.key] = _Lease(lim, ret, mono)
+
+    async def release_all(self, rc: Any) -> None:
+        """Hand every unused token back (shutdown)."""
+        with self._lock:
+            items = [(ls.limit, 0, ls.tokens) for ls in self._leases.values() if ls.tokens > 0]
+            self._leases.clear()
+        if rc is None or not items:
+            return
+        # one call per hash slot (Redis Cluster refuses CROSSSLOT scripts);
+        # untagged keys are single-node and share one call
+        groups: Dict[str, List[Tuple[RateLimit, int, int]]] = {}
+        for it in items:
+            tag = slot_tag(it[0].key)
+            groups.setdefault("" if tag == it[0].key else tag, []).append(it)
+        for group in groups.values():
+            try:
+                # brittle check off: the group's first key only stands in for KEYS[1]
+                await self.acquire(rc, group[0][0].key, group, now=time.time(), brittle_enabled=False)
+            except Exception:
+                with self._lock:
+                    self.release_failures += 1
+                continue
+            with self._lock:
+                self.tokens_returned += sum(n for _, _, n in group)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            leased_now = sum(ls.tokens for ls in self._leases.values())
+            keys = len(self._leases)
+        return {
+            "enabled": True,
+            "error": self.error,
+            "leases": keys,
+            "tokens_held": leased_now,
+            "local_hits": self.local_hits,
+            "lease_calls": self.lease_calls,
+            "tokens_leased": self.tokens_leased,
+            "tokens_returned": self.tokens_returned,
+            "release_failures": self.release_failures,
+        }
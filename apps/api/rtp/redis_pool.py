@@ -0,0 +1,357 @@
+"""
+Kasbah RTP - process-wide pooled Redis client.
+
+Every request-path Redis call shares one client over one blocking
+connection pool, created once per process (redis-py rebuilds the pool's
+connections after a fork), so a request pays only for its commands: no
+client construction, no TCP/AUTH handshake per call. When the pool is exhausted a caller waits at most
+KASBAH_REDIS_POOL_TIMEOUT_SEC for a connection, then gets an error - the
+callers' existing fail-open / fail-closed handling applies.
+
+    KASBAH_REDIS_POOL_SIZE              max connections per process (50)
+    KASBAH_REDIS_POOL_TIMEOUT_SEC       wait for a free connection (1)
+    KASBAH_REDIS_SOCKET_TIMEOUT_SEC     per-command socket timeout (0.5)
+    KASBAH_REDIS_CONNECT_TIMEOUT_SEC    connect timeout (0.5)
+    KASBAH_REDIS_HEALTH_CHECK_SEC       PING idle connections before reuse (30)
+
+Async handlers use get_async_redis(): the same settings over a
+redis.asyncio pool, so a request waiting on Redis holds a coroutine, not a
+threadpool worker. asyncio connections belong to the event loop that opened
+them, so that client is bound to the running loop (rebuilt if the loop
+changes, e.g. between test runs).
+
+Besides redis:// / rediss:// / unix:// URLs (one node), REDIS_URL may name
+a Sentinel-managed primary or a Redis Cluster:
+
+    redis+sentinel://[user:password@]host:26379[,host2:26379...]/<service>[/<db>]
+    redis+cluster://[user:password@]host:6379[,host2:6379...]
+
+(rediss+... for TLS). The credentials are those of the data nodes. Sentinel
+and cluster clients manage their own per-node pools of up to
+KASBAH_REDIS_POOL_SIZE connections with the same timeouts; creating one is
+retried at most once per KASBAH_REDIS_RETRY_CREATE_SEC.
+
+    KASBAH_REDIS_RETRY_CREATE_SEC       back-off after a failed client creation (1)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+# Optional dependency: redis
+try:
+    import redis  # type: ignore
+    import redis.asyncio as aioredis  # type: ignore
+except Exception:
+    redis = None
+    aioredis = None
+
+
+KASBAH_REDIS_POOL_SIZE = int(os.environ.get("KASBAH_REDIS_POOL_SIZE", "50"))
+KASBAH_REDIS_POOL_TIMEOUT_SEC = float(os.environ.get("KASBAH_REDIS_POOL_TIMEOUT_SEC", "1"))
+KASBAH_REDIS_SOCKET_TIMEOUT_SEC = float(os.environ.get("KASBAH_REDIS_SOCKET_TIMEOUT_SEC", "0.5"))
+KASBAH_REDIS_CONNECT_TIMEOUT_SEC = float(os.environ.get("KASBAH_REDIS_CONNECT_TIMEOUT_SEC", "0.5"))
+KASBAH_REDIS_HEALTH_CHECK_SEC = int(os.environ.get("KASBAH_REDIS_HEALTH_CHECK_SEC", "30"))
+KASBAH_REDIS_RETRY_CREATE_SEC = float(os.environ.get("KASBAH_REDIS_RETRY_CREATE_SEC", "1"))
+
+
+if redis is not None:
+
+    class MeteredPool(redis.BlockingConnectionPool):  # type: ignore[misc,name-defined]
+        """BlockingConnectionPool that counts checkouts, waits and failed checkouts."""
+
+        def __init__(self, *args: Any, **kwargs: Any):
+            super().__init__(*args, **kwargs)
+            self.checkouts = 0
+            self.checkout_errors = 0  # pool exhausted past the timeout, or connect failed
+            self.wait_ms_total = 0.0
+            self.wait_ms_max = 0.0
+
+        def get_connection(self, *args: Any, **kwargs: Any) -> Any:
+            t0 = time.perf_counter()
+            try:
+                return super().get_connection(*args, **kwargs)
+            except redis.ConnectionError:
+                self.checkout_errors += 1
+                raise
+            finally:
+                ms = (time.perf_counter() - t0) * 1000.0
+                self.checkouts += 1
+                self.wait_ms_total += ms
+                self.wait_ms_max = max(self.wait_ms_max, ms)
+
+    class MeteredAsyncPool(aioredis.BlockingConnectionPool):  # type: ignore[misc,name-defined]
+        """asyncio BlockingConnectionPool with the same counters as MeteredPool."""
+
+        def __init__(self, *args: Any, **kwargs: Any):
+            super().__init__(*args, **kwargs)
+            self.checkouts = 0
+            self.checkout_errors = 0
+            self.wait_ms_total = 0.0
+            self.wait_ms_max = 0.0
+
+        async def get_connection(self, *args: Any, **kwargs: Any) -> Any:
+            t0 = time.perf_counter()
+            try:
+                return await super().get_connection(*args, **kwargs)
+            except redis.ConnectionError:
+                self.checkout_errors += 1
+                raise
+            finally:
+                ms = (time.perf_counter() - t0) * 1000.0
+                self.checkouts += 1
+                self.wait_ms_total += ms
+                self.wait_ms_max = max(self.wait_ms_max, ms)
+
+else:
+    MeteredPool = None  # type: ignore[assignment,misc]
+    MeteredAsyncPool = None  # type: ignore[assignment,misc]
+
+
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+_create_failed: Dict[str, float] = {}  # url -> monotonic time of the last failed creation
+# url -> (event loop, client)
+_async_clients: Dict[str, Tuple[Any, Any]] = {}
+
+
+def _pool_kwargs(max_connections: int) -> Dict[str, Any]:
+    return dict(
+        max_connections=max(1, int(max_connections)),
+        timeout=KASBAH_REDIS_POOL_TIMEOUT_SEC,
+        socket_timeout=KASBAH_REDIS_SOCKET_TIMEOUT_SEC,
+        socket_connect_timeout=KASBAH_REDIS_CONNECT_TIMEOUT_SEC,
+        health_check_interval=KASBAH_REDIS_HEALTH_CHECK_SEC,
+        retry_on_timeout=False,
+        decode_responses=True,
+    )
+
+
+def parse_url(url: str) -> Dict[str, Any]:
+    """
+    {"mode": "single" | "sentinel" | "cluster", "nodes": [(host, port)],
+    "service", "db", "username", "password", "ssl"}. Single-node URLs are
+    left to redis-py (only "mode" is set).
+    """
+    scheme, sep, rest = url.partition("://")
+    scheme = scheme.lower()
+    if not sep or scheme not in ("redis+sentinel", "rediss+sentinel", "redis+cluster", "rediss+cluster"):
+        return {"mode": "single"}
+    mode = scheme.split("+", 1)[1]
+    netloc, _, path = rest.partition("/")
+    path = path.split("?", 1)[0]
+    userinfo, _, hosts = netloc.rpartition("@")
+    username, _, password = userinfo.partition(":")
+    default_port = 26379 if mode == "sentinel" else 6379
+    nodes: List[Tuple[str, int]] = []
+    for h in hosts.split(","):
+        h = h.strip()
+        if not h:
+            continue
+        if h.startswith("["):  # [ipv6]:port
+            host, _, port = h[1:].partition("]")
+            port = port.lstrip(":")
+        else:
+            host, _, port = h.rpartition(":") if ":" in h else (h, "", "")
+        nodes.append((host, int(port) if port else default_port))
+    if not nodes:
+        raise ValueError(f"no hosts in {scheme} URL")
+    parts = [p for p in path.split("/") if p]
+    service = parts[0] if mode == "sentinel" and parts else None
+    if mode == "sentinel" and not service:
+        raise ValueError("redis+sentinel URL needs the service name: .../<service>[/<db>]")
+    db = int(parts[1]) if mode == "sentinel" and len(parts) > 1 else 0
+    return {
+        "mode": mode,
+        "nodes": nodes,
+        "service": service,
+        "db": db,
+        "username": unquote(username) or None,
+        "password": unquote(password) or None,
+        "ssl": scheme.startswith("rediss"),
+    }
+
+
+def _node_kwargs(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    kw: Dict[str, Any] = dict(
+        socket_timeout=KASBAH_REDIS_SOCKET_TIMEOUT_SEC,
+        socket_connect_timeout=KASBAH_REDIS_CONNECT_TIMEOUT_SEC,
+        health_check_interval=KASBAH_REDIS_HEALTH_CHECK_SEC,
+        decode_responses=True,
+    )
+    if cfg.get("username"):
+        kw["username"] = cfg["username"]
+    if cfg.get("password"):
+        kw["password"] = cfg["password"]
+    if cfg.get("ssl"):
+        kw["ssl"] = True
+    return kw
+
+
+def _make_client(url: str) -> Any:
+    cfg = parse_url(url)
+    if cfg["mode"] == "single":
+        return redis.Redis(connection_pool=make_pool(url))  # type: ignore[union-attr]
+    kw = _node_kwargs(cfg)
+    if cfg["mode"] == "sentinel":
+        from redis.sentinel import Sentinel  # type: ignore
+
+        timeouts = {k: kw[k] for k in ("socket_timeout", "socket_connect_timeout")}
+        s = Sentinel(cfg["nodes"], sentinel_kwargs=timeouts, **kw)
+        return s.master_for(cfg["service"], db=cfg["db"], max_connections=max(1, KASBAH_REDIS_POOL_SIZE))
+    from redis.cluster import ClusterNode, RedisCluster  # type: ignore
+
+    # connects to learn the slot map: raises when no node is reachable
+    return RedisCluster(
+        startup_nodes=[ClusterNode(h, p) for h, p in cfg["nodes"]],
+        max_connections=max(1, KASBAH_REDIS_POOL_SIZE),
+        **kw,
+    )
+
+
+def _make_async_client(url: str) -> Any:
+    cfg = parse_url(url)
+    if cfg["mode"] == "single":
+        return aioredis.Redis(connection_pool=make_async_pool(url))  # type: ignore[union-attr]
+    kw = _node_kwargs(cfg)
+    if cfg["mode"] == "sentinel":
+        from redis.asyncio.sentinel import Sentinel as AsyncSentinel  # type: ignore
+
+        timeouts = {k: kw[k] for k in ("socket_timeout", "socket_connect_timeout")}
+        s = AsyncSentinel(cfg["nodes"], sentinel_kwargs=timeouts, **kw)
+        return s.master_for(cfg["service"], db=cfg["db"], max_connections=max(1, KASBAH_REDIS_POOL_SIZE))
+    from redis.asyncio.cluster import ClusterNode as AsyncClusterNode, RedisCluster as AsyncRedisCluster  # type: ignore
+
+    # connects lazily, on the first command
+    return AsyncRedisCluster(
+        startup_nodes=[AsyncClusterNode(h, p) for h, p in cfg["nodes"]],
+        max_connections=max(1, KASBAH_REDIS_POOL_SIZE),
+        **kw,
+    )
+
+
+def make_pool(url: str, max_connections: int = KASBAH_REDIS_POOL_SIZE) -> Any:
+    return MeteredPool.from_url(url, **_pool_kwargs(max_connections))  # type: ignore[union-attr]
+
+
+def make_async_pool(url: str, max_connections: int = KASBAH_REDIS_POOL_SIZE) -> Any:
+    return MeteredAsyncPool.from_url(url, **_pool_kwargs(max_connections))  # type: ignore[union-attr]
+
+
+def get_redis(url: str) -> Optional[Any]:
+    """Shared client for `url` (None when the redis package is unavailable)."""
+    if redis is None:
+        return None
+    c = _clients.get(url)
+    if c is not None:
+        return c
+    with _clients_lock:
+        c = _clients.get(url)
+        if c is None:
+            failed = _create_failed.get(url)
+            if failed is not None and time.monotonic() - failed < KASBAH_REDIS_RETRY_CREATE_SEC:
+                return None
+            try:
+                c = _make_client(url)
+            except Exception:
+                _create_failed[url] = time.monotonic()
+                return None
+            _create_failed.pop(url, None)
+            _clients[url] = c
+        return c
+
+
+def get_async_redis(url: str) -> Optional[Any]:
+    """
+    Shared redis.asyncio client for `url` on the running event loop (None
+    when the redis package is unavailable). Call from a coroutine.
+    """
+    if aioredis is None:
+        return None
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    ent = _async_clients.get(url)
+    if ent is not None and ent[0] is loop:
+        return ent[1]
+    # single-threaded per loop: no lock needed; a client of a previous loop
+    # is dropped (its sockets belong to that loop and cannot be reused)
+    try:
+        c = _make_async_client(url)
+    except Exception:
+        return None
+    _async_clients[url] = (loop, c)
+    return c
+
+
+async def close_async_redis() -> None:
+    """Disconnect the async clients of the running loop (shutdown hook)."""
+    loop = asyncio.get_running_loop()
+    for url, (owner, c) in list(_async_clients.items()):
+        if owner is not loop:
+            continue
+        del _async_clients[url]
+        try:
+            await c.aclose()
+        except Exception:
+            pass
+
+
+def _metrics(p: Any, created: int, idle: int) -> Dict[str, Any]:
+    checkouts = int(getattr(p, "checkouts", 0))
+    return {
+        "available": True,
+        "created": True,
+        "max_connections": p.max_connections,
+        "connections": created,
+        "in_use": max(0, created - idle),
+        "idle": idle,
+        "utilisation": round((created - idle) / float(p.max_connections), 4) if p.max_connections else 0.0,
+        "checkouts": checkouts,
+        "checkout_errors": int(getattr(p, "checkout_errors", 0)),
+        "wait_ms": {
+            "avg": round(getattr(p, "wait_ms_total", 0.0) / checkouts, 3) if checkouts else 0.0,
+            "max": round(getattr(p, "wait_ms_max", 0.0), 3),
+        },
+    }
+
+
+def pool_metrics(url: str) -> Dict[str, Any]:
+    """Utilisation of the shared pools (sync and async) for `url`."""
+    mode = parse_url(url)["mode"]
+    c = _clients.get(url)
+    if c is None:
+        out: Dict[str, Any] = {"available": redis is not None, "created": False}
+    elif mode == "cluster":
+        # one pool per node, managed by the cluster client
+        nodes = c.get_nodes() if hasattr(c, "get_nodes") else []
+        out = {"available": True, "created": True, "nodes": len(nodes)}
+    else:
+        p = c.connection_pool
+        if hasattr(p, "pool"):  # BlockingConnectionPool
+            created = len(getattr(p, "_connections", []) or [])
+            try:
+                idle = sum(1 for conn in list(p.pool.queue) if conn is not None)
+            except Exception:
+                idle = 0
+        else:  # the Sentinel primary's ConnectionPool
+            created = int(getattr(p, "_created_connections", 0))
+            idle = len(getattr(p, "_available_connections", []) or [])
+        out = _metrics(p, created, idle)
+    out["mode"] = mode
+    ent = _async_clients.get(url)
+    if ent is None:
+        out["async"] = {"available": aioredis is not None, "created": False}
+    elif mode == "cluster":
+        out["async"] = {"available": True, "created": True}
+    else:
+        ap = ent[1].connection_pool
+        idle = len(getattr(ap, "_available_connections", []) or [])
+        out["async"] = _metrics(ap, idle + len(getattr(ap, "_in_use_connections", ()) or ()), idle)
+    return out
@@ -0,0 +1,537 @@
+"""
+Kasbah RTP - server-side Redis scripts for the request path.
+
+Each script runs a whole precheck in one round trip (EVALSHA; the script
+is loaded at startup and reloaded transparently after a SCRIPT FLUSH) and
+atomically, so no state can change between the individual checks.
+
+Rate limits are GCRA (generic cell rate algorithm, equivalent to a token
+bucket of `limit` tokens refilled over `window_sec`). The only state is one
+timestamp per key, the theoretical arrival time (TAT) in microseconds of
+Redis TIME, stored with SET PX so the key expires once its bucket is full
+again. A request may carry several independent limits (global, per
+principal, per agent, per tool, counted in requests or weighted by cost):
+all are checked first and only charged if every one admits it, and a
+rejection reports which limit refused and when to retry. A request of cost
+c uses c tokens of a limit at once (a request count is cost 1); one that
+costs more than a limit's whole bucket is always refused by it.
+
+decide precheck, in the order rtp_decide applies them:
+    brittle lock -> rate limits -> emergency all / tool / principal
+It returns {code, remaining, retry_after_ms, limited_by}: a PRECHECK_*
+verdict, the smallest quota left after this request, and for
+PRECHECK_RATE_LIMITED the wait until the refusing limit (1-based) admits
+one more.
+
+consume gate, for a ticket rtp_consume has already verified locally:
+    brittle lock -> rate limits -> emergency -> consume-once SET NX EX
+For a ticket that failed verification only the first two run (the caller
+then reports the verification error), so a bad ticket is still charged to
+the rate limits.
+
+rate limit: the rate limits alone, {allowed, remaining, retry_after_ms,
+limited_by}.
+
+quota lease: brittle lock, then a block of tokens from each GCRA limit at
+once (and unused tokens of expired leases handed back), for the local
+counting in quota_lease.py.
+
+All fail open like the individual checks they replace (without Redis, or
+when the script errors, the verdict is PRECHECK_OK with the full quota) -
+except the consume-once mark, which fails closed (PRECHECK_REPLAY).
+
+decide_precheck_async / consume_gate_async / rate_limit_async are the same
+calls for a redis.asyncio client (redis_pool.get_async_redis).
+
+On Redis Cluster every script's keys must share one hash slot; see
+keyspace.py for how the callers arrange that.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+PRECHECK_OK = 0
+PRECHECK_BRITTLE = 1
+PRECHECK_RATE_LIMITED = 2
+PRECHECK_EMERGENCY_ALL = 3
+PRECHECK_EMERGENCY_TOOL = 4
+PRECHECK_EMERGENCY_PRINCIPAL = 5
+PRECHECK_REPLAY = 6
+
+EMERGENCY_REASONS = {
+    PRECHECK_EMERGENCY_ALL: "emergency:all",
+    PRECHECK_EMERGENCY_TOOL: "emergency:tool",
+    PRECHECK_EMERGENCY_PRINCIPAL: "emergency:principal",
+}
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """
+    `limit` tokens per `window_sec` on `key`, bursting up to `limit`; this
+    request takes `cost` of them.
+    """
+
+    scope: str
+    key: str
+    limit: int
+    window_sec: float
+    cost: int = 1
+
+    @property
+    def interval_us(self) -> int:
+        return max(1, int(self.window_sec * 1_000_000 / max(1, self.limit)))
+
+    @property
+    def tolerance_us(self) -> int:
+        return self.interval_us * max(1, self.limit)
+
+
+# GCRA over KEYS[first_key..] with (interval_us, tolerance_us, cost) triples
+# from ARGV[first_arg..]; every limit is checked before any is charged.
+# Returns ok, remaining (min over limits), retry_after_ms, limited_by.
+_GCRA_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000000 + tonumber(t[2])
+local function limits(first_key, first_arg)
+  local n = #KEYS - first_key + 1
+  local remaining, retry, by = -1, 0, 0
+  local tats = {}
+  for i = 0, n - 1 do
+    local interval = tonumber(ARGV[first_arg + 3 * i])
+    local tolerance = tonumber(ARGV[first_arg + 3 * i + 1])
+    local cost = tonumber(ARGV[first_arg + 3 * i + 2])
+    local tat = tonumber(redis.call('GET', KEYS[first_key + i]) or '') or now
+    if tat < now then tat = now end
+    local new_tat = tat + interval * cost
+    local allow_at = new_tat - tolerance
+    if allow_at > now then
+      if allow_at - now > retry then retry, by = allow_at - now, i + 1 end
+    else
+      tats[i] = new_tat
+      local rem = math.floor((now - allow_at) / interval)
+      if remaining < 0 or rem < remaining then remaining = rem end
+    end
+  end
+  if by > 0 then
+    return false, 0, math.ceil(retry / 1000), by
+  end
+  for i = 0, n - 1 do
+    redis.call('SET', KEYS[first_key + i], string.format('%.0f', tats[i]),
+               'PX', math.max(1, math.ceil((tats[i] - now) / 1000)))
+  end
+  return true, math.max(remaining, 0), 0, 0
+end
+"""
+
+_FLAG_LUA = """
+local function flag(k)
+  local v = redis.call('GET', k)
+  return v and v ~= ''
+end
+"""
+
+# KEYS: brittle lock, emergency all, emergency tool, emergency principal,
+#       rate-limit keys...
+# ARGV: now (unix seconds), brittle enabled, check tool, check principal, check all,
+#       (interval_us, tolerance_us, cost) per rate-limit key
+DECIDE_PRECHECK_LUA = _GCRA_LUA + _FLAG_LUA + """
+if ARGV[2] == '1' then
+  local until_ts = tonumber(redis.call('GET', KEYS[1]) or '')
+  if until_ts and until_ts > tonumber(ARGV[1]) then
+    return {1, 0, 0, 0}
+  end
+end
+local ok, remaining, retry, by = limits(5, 6)
+if not ok then
+  return {2, 0, retry, by}
+end
+if ARGV[5] == '1' and flag(KEYS[2]) then
+  return {3, remaining, 0, 0}
+end
+if ARGV[3] == '1' and flag(KEYS[3]) then
+  return {4, remaining, 0, 0}
+end
+if ARGV[4] == '1' and flag(KEYS[4]) then
+  return {5, remaining, 0, 0}
+end
+return {0, remaining, 0, 0}
+"""
+
+
+# KEYS: brittle lock, emergency all, emergency tool, emergency principal,
+#       consumed mark, rate-limit keys...
+# ARGV: now, brittle enabled, check tool, check principal, check all,
+#       mark (ticket verified), mark ttl_sec,
+#       (interval_us, tolerance_us, cost) per rate-limit key
+CONSUME_GATE_LUA = _GCRA_LUA + _FLAG_LUA + """
+if ARGV[2] == '1' then
+  local until_ts = tonumber(redis.call('GET', KEYS[1]) or '')
+  if until_ts and until_ts > tonumber(ARGV[1]) then
+    return {1, 0, 0, 0}
+  end
+end
+local ok, remaining, retry, by = limits(6, 8)
+if not ok then
+  return {2, 0, retry, by}
+end
+if ARGV[6] ~= '1' then
+  return {0, remaining, 0, 0}
+end
+if ARGV[5] == '1' and flag(KEYS[2]) then
+  return {3, remaining, 0, 0}
+end
+if ARGV[3] == '1' and flag(KEYS[3]) then
+  return {4, remaining, 0, 0}
+end
+if ARGV[4] == '1' and flag(KEYS[4]) then
+  return {5, remaining, 0, 0}
+end
+if not redis.call('SET', KEYS[5], '1', 'NX', 'EX', ARGV[7]) then
+  return {6, remaining, 0, 0}
+end
+return {0, remaining, 0, 0}
+"""
+
+
+# KEYS: rate-limit keys...   ARGV: (interval_us, tolerance_us, cost) per key
+RATE_LIMIT_LUA = _GCRA_LUA + """
+local ok, remaining, retry, by = limits(1, 1)
+return {ok and 1 or 0, remaining, retry, by}
+"""
+
+
+# KEYS: brittle lock, rate-limit keys...
+# ARGV: now (unix seconds), brittle enabled,
+#       (interval_us, tolerance_us, tokens wanted, tokens returned, tokens needed)
+#       per rate-limit key
+# Returns {code, brittle lock value, retry_after_ms, limited_by, granted...}:
+# every key with tokens wanted must grant at least the tokens needed (this
+# request's cost), else nothing is granted (returns are applied either way).
+QUOTA_LEASE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000000 + tonumber(t[2])
+local brittle = redis.call('GET', KEYS[1]) or ''
+if ARGV[2] == '1' then
+  local until_ts = tonumber(brittle)
+  if until_ts and until_ts > tonumber(ARGV[1]) then
+    return {1, brittle, 0, 0}
+  end
+end
+local n = #KEYS - 1
+local tats, grants = {}, {}
+local retry, by = 0, 0
+for i = 1, n do
+  local a = 3 + 5 * (i - 1)
+  local interval, tolerance = tonumber(ARGV[a]), tonumber(ARGV[a + 1])
+  local want, ret, need = tonumber(ARGV[a + 2]), tonumber(ARGV[a + 3]), tonumber(ARGV[a + 4])
+  local tat = tonumber(redis.call('GET', KEYS[i + 1]) or '') or now
+  if tat < now then tat = now end
+  if ret > 0 then tat = math.max(now, tat - ret * interval) end
+  local g = math.min(want, math.max(0, math.floor((now + tolerance - tat) / interval)))
+  if want > 0 and g < need then
+    local wait = tat + interval * need - tolerance - now
+    if wait > retry then retry, by = wait, i end
+  end
+  tats[i], grants[i] = tat, g
+end
+local out = {0, brittle, 0, 0}
+if by > 0 then
+  out = {2, brittle, math.ceil(retry / 1000), by}
+end
+for i = 1, n do
+  local tat = tats[i]
+  if by == 0 then
+    tat = tat + grants[i] * tonumber(ARGV[3 + 5 * (i - 1)])
+    out[4 + i] = grants[i]
+  else
+    out[4 + i] = 0
+  end
+  if tat > now then
+    redis.call('SET', KEYS[i + 1], string.format('%.0f', tat), 'PX', math.max(1, math.ceil((tat - now) / 1000)))
+  else
+    redis.call('DEL', KEYS[i + 1])
+  end
+end
+return out
+"""
+
+
+@dataclass
+class Precheck:
+    code: int
+    remaining: int
+    retry_after_ms: int = 0
+    limited_by: Optional[str] = None  # scope of the refusing RateLimit
+
+    @property
+    def emergency(self) -> Optional[str]:
+        return EMERGENCY_REASONS.get(self.code)
+
+    @property
+    def retry_after_sec(self) -> int:
+        """For a Retry-After header (whole seconds, at least 1)."""
+        return max(1, int(math.ceil(self.retry_after_ms / 1000.0)))
+
+
+_SOURCES: Dict[str, str] = {
+    "decide_precheck": DECIDE_PRECHECK_LUA,
+    "consume_gate": CONSUME_GATE_LUA,
+    "rate_limit": RATE_LIMIT_LUA,
+    "quota_lease": QUOTA_LEASE_LUA,
+}
+# (name, is_async) -> Script / AsyncScript; both share the sha
+_scripts: Dict[Tuple[str, bool], Any] = {}
+_scripts_lock = threading.Lock()
+
+
+def _script(rc: Any, name: str, is_async: bool = False) -> Any:
+    s = _scripts.get((name, is_async))
+    if s is None:
+        with _scripts_lock:
+            s = _scripts.get((name, is_async))
+            if s is None:
+                s = rc.register_script(_SOURCES[name])  # sha computed locally
+                _scripts[(name, is_async)] = s
+    return s
+
+
+def run_script(rc: Any, name: str, keys: List[str], args: List[Any]) -> Any:
+    """EVALSHA `name`; loads the script first if the server does not know it."""
+    return _script(rc, name)(keys=keys, args=args, client=rc)
+
+
+async def run_script_async(rc: Any, name: str, keys: List[str], args: List[Any]) -> Any:
+    """run_script() for a redis.asyncio client."""
+    return await _script(rc, name, is_async=True)(keys=keys, args=args, client=rc)
+
+
+def load_scripts(rc: Any) -> bool:
+    """SCRIPT LOAD everything once (startup), so the first request is a plain EVALSHA."""
+    if rc is None:
+        return False
+    try:
+        for name, src in _SOURCES.items():
+            _script(rc, name).sha = rc.script_load(src)
+        return True
+    except Exception:
+        return False
+
+
+def _flag(b: bool) -> str:
+    return "1" if b else "0"
+
+
+def _limit_args(limits: Sequence[RateLimit]) -> List[Any]:
+    out: List[Any] = []
+    for lim in limits:
+        out += [lim.interval_us, lim.tolerance_us, max(0, int(lim.cost))]
+    return out
+
+
+def _full_quota(limits: Sequence[RateLimit]) -> int:
+    return min((int(lim.limit) for lim in limits), default=0)
+
+
+def _result(res: Sequence[Any], limits: Sequence[RateLimit]) -> Precheck:
+    code, remaining, retry, by = (int(x) for x in res)
+    scope = limits[by - 1].scope if 0 < by <= len(limits) else None
+    return Precheck(code, remaining, retry, scope)
+
+
+def _precheck_call(
+    now: float,
+    limits: Sequence[RateLimit],
+    emergency_keys: Sequence[str],
+    brittle_key: str,
+    brittle_enabled: bool,
+    check_tool: bool,
+    check_principal: bool,
+    check_all: bool,
+    mark: Optional[Tuple[str, Optional[int]]] = None,
+) -> Tuple[List[str], List[Any]]:
+    keys = [brittle_key, *emergency_keys]
+    args: List[Any] = [
+        repr(float(now)),
+        _flag(brittle_enabled),
+        _flag(check_tool),
+        _flag(check_principal),
+        _flag(check_all),
+    ]
+    if mark is not None:
+        mark_key, mark_ttl_sec = mark
+        keys.append(mark_key)
+        args += [_flag(mark_ttl_sec is not None), max(1, int(mark_ttl_sec or 1))]
+    keys += [lim.key for lim in limits]
+    return keys, args + _limit_args(limits)
+
+
+def decide_precheck(
+    rc: Any,
+    brittle_key: str,
+    emergency_keys: Sequence[str],
+    limits: Sequence[RateLimit],
+    now: float,
+    brittle_enabled: bool = True,
+    check_tool: bool = True,
+    check_principal: bool = True,
+    check_all: bool = True,
+) -> Precheck:
+    """
+    One round trip for brittle lock, rate limits and emergency flags.
+    emergency_keys: [all, tool, principal]. check_* False skips that
+    emergency flag (its state is already known, e.g. from the in-process
+    cache in emergency_cache.py).
+    """
+    if rc is None:
+        return Precheck(PRECHECK_OK, _full_quota(limits))
+    keys, args = _precheck_call(
+        now, limits, emergency_keys, brittle_key, brittle_enabled, check_tool, check_principal, check_all
+    )
+    try:
+        return _result(run_script(rc, "decide_precheck", keys, args), limits)
+    except Exception:
+        return Precheck(PRECHECK_OK, _full_quota(limits))
+
+
+async def decide_precheck_async(
+    rc: Any,
+    brittle_key: str,
+    emergency_keys: Sequence[str],
+    limits: Sequence[RateLimit],
+    now: float,
+    brittle_enabled: bool = True,
+    check_tool: bool = True,
+    check_principal: bool = True,
+    check_all: bool = True,
+) -> Precheck:
+    """decide_precheck() for a redis.asyncio client."""
+    if rc is None:
+        return Precheck(PRECHECK_OK, _full_quota(limits))
+    keys, args = _precheck_call(
+        now, limits, emergency_keys, brittle_key, brittle_enabled, check_tool, check_principal, check_all
+    )
+    try:
+        return _result(await run_script_async(rc, "decide_precheck", keys, args), limits)
+    except Exception:
+        return Precheck(PRECHECK_OK, _full_quota(limits))
+
+
+def consume_gate(
+    rc: Any,
+    brittle_key: str,
+    emergency_keys: Sequence[str],
+    mark_key: str,
+    limits: Sequence[RateLimit],
+    now: float,
+    mark_ttl_sec: Optional[int],
+    brittle_enabled: bool = True,
+    check_tool: bool = True,
+    check_principal: bool = True,
+    check_all: bool = True,
+) -> Precheck:
+    """
+    One atomic round trip for brittle lock, rate limits, emergency flags and
+    the consume-once mark. mark_ttl_sec=None: the ticket failed verification,
+    so only the brittle lock and rate limits are evaluated.
+    """
+    unavailable = Precheck(PRECHECK_REPLAY if mark_ttl_sec is not None else PRECHECK_OK, _full_quota(limits))
+    if rc is None:
+        return unavailable
+    keys, args = _precheck_call(
+        now, limits, emergency_keys, brittle_key, brittle_enabled, check_tool, check_principal, check_all,
+        mark=(mark_key, mark_ttl_sec),
+    )
+    try:
+        return _result(run_script(rc, "consume_gate", keys, args), limits)
+    except Exception:
+        return unavailable
+
+
+async def consume_gate_async(
+    rc: Any,
+    brittle_key: str,
+    emergency_keys: Sequence[str],
+    mark_key: str,
+    limits: Sequence[RateLimit],
+    now: float,
+    mark_ttl_sec: Optional[int],
+    brittle_enabled: bool = True,
+    check_tool: bool = True,
+    check_principal: bool = True,
+    check_all: bool = True,
+) -> Precheck:
+    """consume_gate() for a redis.asyncio client."""
+    unavailable = Precheck(PRECHECK_REPLAY if mark_ttl_sec is not None else PRECHECK_OK, _full_quota(limits))
+    if rc is None:
+        return unavailable
+    keys, args = _precheck_call(
+        now, limits, emergency_keys, brittle_key, brittle_enabled, check_tool, check_principal, check_all,
+        mark=(mark_key, mark_ttl_sec),
+    )
+    try:
+        return _result(await run_script_async(rc, "consume_gate", keys, args), limits)
+    except Exception:
+        return unavailable
+
+
+def rate_limit(rc: Any, limits: Sequence[RateLimit]) -> Precheck:
+    """The rate limits alone: PRECHECK_OK or PRECHECK_RATE_LIMITED (with retry_after_ms)."""
+    if rc is None or not limits:
+        return Precheck(PRECHECK_OK, _full_quota(limits))
+    try:
+        res = run_script(rc, "rate_limit", [lim.key for lim in limits], _limit_args(limits))
+        ok, remaining, retry, by = (int(x) for x in res)
+    except Exception:
+        return Precheck(PRECHECK_OK, _full_quota(limits))
+    if ok:
+        return Precheck(PRECHECK_OK, remaining)
+    return Precheck(PRECHECK_RATE_LIMITED, 0, retry, limits[by - 1].scope if 0 < by <= len(limits) else None)
+
+
+async def rate_limit_async(rc: Any, limits: Sequence[RateLimit]) -> Precheck:
+    """rate_limit() for a redis.asyncio client."""
+    if rc is None or not limits:
+        return Precheck(PRECHECK_OK, _full_quota(limits))
+    try:
+        res = await run_script_async(rc, "rate_limit", [lim.key for lim in limits], _limit_args(limits))
+        ok, remaining, retry, by = (int(x) for x in res)
+    except Exception:
+        return Precheck(PRECHECK_OK, _full_quota(limits))
+    if ok:
+        return Precheck(PRECHECK_OK, remaining)
+    return Precheck(PRECHECK_RATE_LIMITED, 0, retry, limits[by - 1].scope if 0 < by <= len(limits) else None)
+
+
+async def quota_lease_async(
+    rc: Any,
+    brittle_key: str,
+    items: Sequence[Tuple[RateLimit, int, int]],
+    now: float,
+    brittle_enabled: bool = True,
+) -> Tuple[int, Optional[float], int, Optional[str], List[int]]:
+    """
+    Lease tokens: items are (limit, tokens wanted, unused tokens returned);
+    a key that wants tokens must grant at least the limit's cost.
+    Returns (code, brittle lock until, retry_after_ms, limited_by scope,
+    tokens granted per item). Raises when Redis is unavailable.
+    """
+    keys = [brittle_key] + [lim.key for lim, _, _ in items]
+    args: List[Any] = [repr(float(now)), _flag(brittle_enabled)]
+    for lim, want, ret in items:
+        need = max(1, int(lim.cost)) if want else 0
+        args += [lim.interval_us, lim.tolerance_us, max(0, int(want)), max(0, int(ret)), need]
+    res = await run_script_async(rc, "quota_lease", keys, args)
+    code, brittle, retry, by = int(res[0]), res[1], int(res[2]), int(res[3])
+    try:
+        brittle_until: Optional[float] = float(brittle) if brittle not in (None, "", b"") else None
+    except (TypeError, ValueError):
+        brittle_until = None
+    scope = items[by - 1][0].scope if 0 < by <= len(items) else None
+    granted = [int(x) for x in res[4:]] + [0] * max(0, len(items) - len(res[4:]))
+    return code, brittle_until, retry, scope, granted
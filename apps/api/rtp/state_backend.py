@@ -0,0 +1,307 @@
+"""
+Kasbah RTP - pluggable state backend for the request-path moats.
+
+Everything rtp_decide / rtp_consume keep between requests goes through one
+StateBackend: rate limits, the brittle strike counter and lock, the
+emergency flags, the consume-once (replay) marks, and the client the thermo
+brake merges its latency EMA through.
+
+    redis     RedisBackend: shared by every API process (the scripts in
+              redis_scripts.py, emergency_cache.py, redis_pool.py). Each
+              check keeps its failure mode when Redis is unreachable.
+    memory    MemoryBackend (state_memory.py): everything in this process,
+              no network round trip. For single-node deployments,
+              benchmarks and tests. Its state is lost on restart and not
+              shared between processes, so run one worker.
+
+    KASBAH_STATE_BACKEND    redis | memory (redis)
+"""
+
+from __future__ import annotations
+
+import abc
+import os
+from typing import Any, Dict, Optional, Sequence
+
+from .emergency_cache import KASBAH_EMERGENCY_CACHE, EmergencyCache, EmergencyState, flag_key, set_flag
+from .redis_pool import close_async_redis, get_async_redis, get_redis, pool_metrics
+from .redis_scripts import (
+    Precheck,
+    RateLimit,
+    consume_gate_async,
+    decide_precheck_async,
+    load_scripts,
+    rate_limit,
+    rate_limit_async,
+)
+
+
+KASBAH_STATE_BACKEND = os.environ.get("KASBAH_STATE_BACKEND", "redis").strip().lower()
+
+
+class StateUnavailable(Exception):
+    """The backend cannot take a write that must not be dropped (e.g. an emergency flag)."""
+
+
+class StateBackend(abc.ABC):
+    """
+    What the request path needs from shared state. Verdicts use the
+    PRECHECK_* codes of redis_scripts.py; key names come from keyspace.py.
+    """
+
+    name = "base"
+    local = False  # True: the state lives in this process (nothing to cache or lease)
+
+    # ---- one-step prechecks ----
+
+    @abc.abstractmethod
+    async def decide_precheck(
+        self,
+        brittle_key: str,
+        emergency_keys: Sequence[str],
+        limits: Sequence[RateLimit],
+        now: float,
+        brittle_enabled: bool = True,
+        check_tool: bool = True,
+        check_principal: bool = True,
+        check_all: bool = True,
+    ) -> Precheck:
+        """Brittle lock, decide rate limits and emergency flags in one step."""
+
+    @abc.abstractmethod
+    async def consume_gate(
+        self,
+        brittle_key: str,
+        emergency_keys: Sequence[str],
+        mark_key: str,
+        limits: Sequence[RateLimit],
+        now: float,
+        mark_ttl_sec: Optional[int],
+        brittle_enabled: bool = True,
+        check_tool: bool = True,
+        check_principal: bool = True,
+        check_all: bool = True,
+    ) -> Precheck:
+        """decide_precheck's checks for consume, plus the consume-once mark (mark_ttl_sec=None: no mark)."""
+
+    async def rate_limit(self, limits: Sequence[RateLimit]) -> Precheck:
+        return self.rate_limit_sync(limits)
+
+    @abc.abstractmethod
+    def rate_limit_sync(self, limits: Sequence[RateLimit]) -> Precheck:
+        """Charge every limit or none."""
+
+    # ---- brittleness ----
+
+    @abc.abstractmethod
+    def brittle_locked(self, lock_key: str, now: float) -> bool:
+        """True while the agent's brittle lock runs."""
+
+    @abc.abstractmethod
+    async def brittle_strike(
+        self, strike_key: str, lock_key: str, strikes: int, window_sec: int, lock_sec: int, now: float
+    ) -> Optional[float]:
+        """Count a strike; returns the lock's end when this strike set it."""
+
+    # ---- replay marks ----
+
+    @abc.abstractmethod
+    def mark_once(self, key: str, ttl_sec: int) -> bool:
+        """True if newly marked, False on replay - or when it cannot be decided (fail closed)."""
+
+    async def mark_once_async(self, key: str, ttl_sec: int) -> bool:
+        return self.mark_once(key, ttl_sec)
+
+    # ---- emergency flags ----
+
+    def emergency_flags(self) -> Optional[EmergencyState]:
+        """The flags when known locally, else None (the prechecks read them)."""
+        return None
+
+    @abc.abstractmethod
+    def emergency_all(self) -> Optional[bool]:
+        """The global kill switch, None when unavailable."""
+
+    @abc.abstractmethod
+    def set_emergency_flag(self, field: str, on: bool) -> None:
+        """Set or clear "all" / "tool:<name>" / "principal:<name>"; raises StateUnavailable."""
+
+    # ---- plumbing ----
+
+    def client(self) -> Any:
+        """Sync Redis client for background mergers (thermo), None when there is none."""
+        return None
+
+    def async_client(self) -> Any:
+        return None
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+    def emergency_metrics(self) -> Dict[str, Any]:
+        return {"enabled": False}
+
+
+class RedisBackend(StateBackend):
+    """State in Redis at `url`, shared by every API process."""
+
+    name = "redis"
+
+    def __init__(self, url: str, emergency_cache: bool = KASBAH_EMERGENCY_CACHE):
+        self.url = url
+        self.emergency = EmergencyCache(self.client) if emergency_cache else None
+
+    def client(self) -> Any:
+        return get_redis(self.url)
+
+    def async_client(self) -> Any:
+        return get_async_redis(self.url)
+
+    async def decide_precheck(
+        self,
+        brittle_key: str,
+        emergency_keys: Sequence[str],
+        limits: Sequence[RateLimit],
+        now: float,
+        brittle_enabled: bool = True,
+        check_tool: bool = True,
+        check_principal: bool = True,
+        check_all: bool = True,
+    ) -> Precheck:
+        return await decide_precheck_async(
+            self.async_client(), brittle_key, emergency_keys, limits, now,
+            brittle_enabled, check_tool, check_principal, check_all,
+        )
+
+    async def consume_gate(
+        self,
+        brittle_key: str,
+        emergency_keys: Sequence[str],
+        mark_key: str,
+        limits: Sequence[RateLimit],
+        now: float,
+        mark_ttl_sec: Optional[int],
+        brittle_enabled: bool = True,
+        check_tool: bool = True,
+        check_principal: bool = True,
+        check_all: bool = True,
+    ) -> Precheck:
+        return await consume_gate_async(
+            self.async_client(), brittle_key, emergency_keys, mark_key, limits, now, mark_ttl_sec,
+            brittle_enabled, check_tool, check_principal, check_all,
+        )
+
+    async def rate_limit(self, limits: Sequence[RateLimit]) -> Precheck:
+        return await rate_limit_async(self.async_client(), limits)
+
+    def rate_limit_sync(self, limits: Sequence[RateLimit]) -> Precheck:
+        return rate_limit(self.client(), limits)
+
+    def brittle_locked(self, lock_key: str, now: float) -> bool:
+        rc = self.client()
+        if rc is None:
+            return False
+        try:
+            v = rc.get(lock_key)
+            return bool(v) and float(v) > now
+        except Exception:
+            return False
+
+    async def brittle_strike(
+        self, strike_key: str, lock_key: str, strikes: int, window_sec: int, lock_sec: int, now: float
+    ) -> Optional[float]:
+        rc = self.async_client()
+        if rc is None:
+            return None
+        try:
+            # one MULTI/EXEC: a strike counter never outlives its window
+            async with rc.pipeline(transaction=True) as pipe:
+                pipe.incr(strike_key)
+                pipe.expire(strike_key, window_sec)
+                n, _ = await pipe.execute()
+            if int(n) < strikes:
+                return None
+            until = now + float(lock_sec)
+            await rc.set(lock_key, str(until), ex=max(2, lock_sec + 2))
+            return until
+        except Exception:
+            return None
+
+    def mark_once(self, key: str, ttl_sec: int) -> bool:
+        rc = self.client()
+        if rc is None:
+            return False
+        try:
+            return bool(rc.set(key, "1", nx=True, ex=max(1, int(ttl_sec))))
+        except Exception:
+            return False
+
+    async def mark_once_async(self, key: str, ttl_sec: int) -> bool:
+        rc = self.async_client()
+        if rc is None:
+            return False
+        try:
+            return bool(await rc.set(key, "1", nx=True, ex=max(1, int(ttl_sec))))
+        except Exception:
+            return False
+
+    def emergency_flags(self) -> Optional[EmergencyState]:
+        return self.emergency.current() if self.emergency is not None else None
+
+    def emergency_all(self) -> Optional[bool]:
+        rc = self.client()
+        if rc is None:
+            return None
+        try:
+            return bool(rc.get(flag_key("all")))
+        except Exception:
+            return None
+
+    def set_emergency_flag(self, field: str, on: bool) -> None:
+        rc = self.client()
+        if rc is None:
+            raise StateUnavailable("redis unavailable")
+        # other instances learn of it over pub/sub; this one immediately
+        set_flag(rc, field, on)
+        if self.emergency is not None:
+            self.emergency.refresh(rc)
+
+    def start(self) -> None:
+        load_scripts(self.client())
+        if self.emergency is not None:
+            self.emergency.start()
+
+    def stop(self) -> None:
+        if self.emergency is not None:
+            self.emergency.stop()
+
+    async def aclose(self) -> None:
+        await close_async_redis()
+
+    def metrics(self) -> Dict[str, Any]:
+        out = pool_metrics(self.url)
+        out["backend"] = self.name
+        return out
+
+    def emergency_metrics(self) -> Dict[str, Any]:
+        return self.emergency.metrics() if self.emergency is not None else {"enabled": False}
+
+
+def make_backend(name: str = KASBAH_STATE_BACKEND, redis_url: str = "") -> StateBackend:
+    if name == "memory":
+        from .state_memory import MemoryBackend
+
+        return MemoryBackend()
+    if name != "redis":
+        raise ValueError(f"unknown KASBAH_STATE_BACKEND: {name!r} (redis | memory)")
+    return RedisBackend(redis_url or os.environ.get("REDIS_URL", "redis://redis:6379/0"))
+
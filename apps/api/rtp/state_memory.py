@@ -0,0 +1,375 @@
+"""
+Kasbah RTP - in-process state backend (KASBAH_STATE_BACKEND=memory).
+
+The same checks as the Redis scripts, against dicts in this process: no
+network round trip, no Redis needed (single node, benchmarks, tests).
+
+Keys are spread over KASBAH_STATE_STRIPES dicts, each behind its own lock,
+so unrelated agents do not contend. A multi-key check (brittle lock + rate
+limits + emergency flags + consume-once mark) holds the locks of all its
+stripes, taken in stripe order, so it is atomic like the script it
+replaces.
+
+Expiring keys (GCRA timestamps, strikes, brittle locks, replay marks) are
+also filed in a hashed timing wheel of KASBAH_STATE_WHEEL_TICK_MS ticks.
+Requests advance the wheel and drop the keys that came due, so memory is
+bounded by what is live, without a sweeper thread or a scan. A read never
+trusts an expired value, whether or not the wheel has reached it yet.
+
+    KASBAH_STATE_STRIPES          lock stripes (64)
+    KASBAH_STATE_WHEEL_TICK_MS    expiry resolution (100)
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .emergency_cache import EmergencyState, flag_key
+from .redis_scripts import (
+    PRECHECK_BRITTLE,
+    PRECHECK_EMERGENCY_ALL,
+    PRECHECK_EMERGENCY_PRINCIPAL,
+    PRECHECK_EMERGENCY_TOOL,
+    PRECHECK_OK,
+    PRECHECK_RATE_LIMITED,
+    PRECHECK_REPLAY,
+    Precheck,
+    RateLimit,
+)
+from .state_backend import StateBackend
+
+
+KASBAH_STATE_STRIPES = int(os.environ.get("KASBAH_STATE_STRIPES", "64"))
+KASBAH_STATE_WHEEL_TICK_MS = float(os.environ.get("KASBAH_STATE_WHEEL_TICK_MS", "100"))
+
+_WHEEL_SLOTS = 512
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel: schedule(key, deadline) is O(1); advance(now)
+    returns the keys whose deadline passed, touching only the slots of the
+    elapsed ticks (at most one turn of the wheel). A deadline more than one
+    turn ahead stays in its slot until its turn comes. A key has at most one
+    deadline: scheduling it again moves it, so overwrites do not pile up.
+    """
+
+    def __init__(self, tick_sec: float, slots: int = _WHEEL_SLOTS, now: Optional[float] = None):
+        self.tick_sec = max(0.001, float(tick_sec))
+        # per slot: key -> tick it is due
+        self.slots: List[Dict[str, int]] = [{} for _ in range(max(1, int(slots)))]
+        self._due: Dict[str, int] = {}
+        self._tick = self._tick_of(time.monotonic() if now is None else now)
+        self._lock = threading.Lock()
+        self.fired = 0
+
+    @property
+    def scheduled(self) -> int:
+        return len(self._due)
+
+    def _tick_of(self, t: float) -> int:
+        return int(t / self.tick_sec)
+
+    def schedule(self, key: str, deadline: float) -> None:
+        tick = int(math.ceil(deadline / self.tick_sec))
+        n = len(self.slots)
+        with self._lock:
+            tick = max(tick, self._tick + 1)
+            old = self._due.get(key)
+            if old == tick:
+                return
+            if old is not None:
+                self.slots[old % n].pop(key, None)
+            self.slots[tick % n][key] = tick
+            self._due[key] = tick
+
+    def cancel(self, key: str) -> None:
+        with self._lock:
+            old = self._due.pop(key, None)
+            if old is not None:
+                self.slots[old % len(self.slots)].pop(key, None)
+
+    def advance(self, now: float) -> List[str]:
+        target = self._tick_of(now)
+        due: List[str] = []
+        with self._lock:
+            if target <= self._tick:
+                return due
+            n = len(self.slots)
+            for tick in range(self._tick + 1, min(target, self._tick + n) + 1):
+                slot = self.slots[tick % n]
+                if not slot:
+                    continue
+                fired = [k for k, t in slot.items() if t <= target]
+                for k in fired:
+                    del slot[k]
+                    del self._due[k]
+                due += fired
+            self._tick = target
+            self.fired += len(due)
+        return due
+
+
+class MemoryBackend(StateBackend):
+    name = "memory"
+    local = True
+
+    def __init__(self, stripes: int = KASBAH_STATE_STRIPES, tick_ms: float = KASBAH_STATE_WHEEL_TICK_MS):
+        n = max(1, int(stripes))
+        self._locks = [threading.Lock() for _ in range(n)]
+        # key -> (value, expires at (monotonic) or None)
+        self._data: List[Dict[str, Tuple[Any, Optional[float]]]] = [{} for _ in range(n)]
+        self._wheel = TimingWheel(tick_ms / 1000.0)
+        self._flags_lock = threading.Lock()
+        self._flags: Dict[str, str] = {}
+        self._state = EmergencyState()
+        self.expired = 0
+
+    # ---- striped store (callers hold the key's stripe lock) ----
+
+    def _stripe(self, key: str) -> int:
+        return hash(key) % len(self._locks)
+
+    @contextmanager
+    def _locked(self, keys: Sequence[str]) -> Iterator[None]:
+        idx = sorted({self._stripe(k) for k in keys})
+        for i in idx:
+            self._locks[i].acquire()
+        try:
+            yield
+        finally:
+            for i in reversed(idx):
+                self._locks[i].release()
+
+    def _get(self, key: str, mono: float) -> Any:
+        d = self._data[self._stripe(key)]
+        ent = d.get(key)
+        if ent is None:
+            return None
+        if ent[1] is not None and ent[1] <= mono:
+            del d[key]
+            return None
+        return ent[0]
+
+    def _set(self, key: str, value: Any, mono: float, ttl_sec: Optional[float] = None) -> None:
+        expires = mono + max(0.001, float(ttl_sec)) if ttl_sec is not None else None
+        self._data[self._stripe(key)][key] = (value, expires)
+        if expires is not None:
+            self._wheel.schedule(key, expires)
+        else:
+            self._wheel.cancel(key)
+
+    def _expire_due(self, mono: float) -> None:
+        for key in self._wheel.advance(mono):
+            i = self._stripe(key)
+            with self._locks[i]:
+                ent = self._data[i].get(key)
+                # the key may have been set again since, with a later expiry
+                if ent is not None and ent[1] is not None and ent[1] <= mono:
+                    del self._data[i][key]
+                    self.expired += 1
+
+    # ---- checks (the scripts' logic) ----
+
+    def _limits(self, limits: Sequence[RateLimit], mono: float) -> Tuple[bool, int, int, int]:
+        # GCRA as in redis_scripts._GCRA_LUA; the TAT is in monotonic microseconds
+        now = mono * 1_000_000
+        remaining, retry, by = -1, 0.0, 0
+        tats: List[float] = []
+        for i, lim in enumerate(limits):
+            interval = lim.interval_us
+            tat = max(float(self._get(lim.key, mono) or now), now)
+            new_tat = tat + interval * max(0, int(lim.cost))
+            allow_at = new_tat - lim.tolerance_us
+            if allow_at > now:
+                if allow_at - now > retry:
+                    retry, by = allow_at - now, i + 1
+            else:
+                tats.append(new_tat)
+                rem = int((now - allow_at) // interval)
+                if remaining < 0 or rem < remaining:
+                    remaining = rem
+        if by:
+            return False, 0, int(math.ceil(retry / 1000.0)), by
+        for lim, tat in zip(limits, tats):
+            self._set(lim.key, tat, mono, ttl_sec=max(0.001, (tat - now) / 1_000_000))
+        return True, max(remaining, 0), 0, 0
+
+    def _brittle(self, brittle_key: str, now: float, mono: float) -> bool:
+        v = self._get(brittle_key, mono)
+        return v is not None and float(v) > now
+
+    def _emergency(
+        self, emergency_keys: Sequence[str], mono: float, check_tool: bool, check_principal: bool, check_all: bool
+    ) -> int:
+        em_all, em_tool, em_principal = emergency_keys
+        if check_all and self._get(em_all, mono):
+            return PRECHECK_EMERGENCY_ALL
+        if check_tool and self._get(em_tool, mono):
+            return PRECHECK_EMERGENCY_TOOL
+        if check_principal and self._get(em_principal, mono):
+            return PRECHECK_EMERGENCY_PRINCIPAL
+        return PRECHECK_OK
+
+    def _precheck(
+        self,
+        brittle_key: str,
+        emergency_keys: Sequence[str],
+        mark: Optional[Tuple[str, Optional[int]]],
+        limits: Sequence[RateLimit],
+        now: float,
+        brittle_enabled: bool,
+        check_tool: bool,
+        check_principal: bool,
+        check_all: bool,
+    ) -> Precheck:
+        mono = time.monotonic()
+        self._expire_due(mono)
+        keys = [brittle_key, *emergency_keys, *(lim.key for lim in limits)]
+        if mark is not None:
+            keys.append(mark[0])
+        with self._locked(keys):
+            if brittle_enabled and self._brittle(brittle_key, now, mono):
+                return Precheck(PRECHECK_BRITTLE, 0)
+            ok, remaining, retry, by = self._limits(limits, mono)
+            if not ok:
+                return Precheck(PRECHECK_RATE_LIMITED, 0, retry, limits[by - 1].scope)
+            if mark is not None and mark[1] is None:
+                return Precheck(PRECHECK_OK, remaining)  # unverified ticket: no flags, no mark
+            code = self._emergency(emergency_keys, mono, check_tool, check_principal, check_all)
+            if code != PRECHECK_OK or mark is None:
+                return Precheck(code, remaining)
+            mark_key, ttl = mark
+            if self._get(mark_key, mono) is not None:
+                return Precheck(PRECHECK_REPLAY, remaining)
+            self._set(mark_key, "1", mono, ttl_sec=max(1, int(ttl or 1)))
+            return Precheck(PRECHECK_OK, remaining)
+
+    async def decide_precheck(
+        self,
+        brittle_key: str,
+        emergency_keys: Sequence[str],
+        limits: Sequence[RateLimit],
+        now: float,
+        brittle_enabled: bool = True,
+        check_tool: bool = True,
+        check_principal: bool = True,
+        check_all: bool = True,
+    ) -> Precheck:
+        return self._precheck(
+            brittle_key, emergency_keys, None, limits, now, brittle_enabled, check_tool, check_principal, check_all
+        )
+
+    async def consume_gate(
+        self,
+        brittle_key: str,
+        emergency_keys: Sequence[str],
+        mark_key: str,
+        limits: Sequence[RateLimit],
+        now: float,
+        mark_ttl_sec: Optional[int],
+        brittle_enabled: bool = True,
+        check_tool: bool = True,
+        check_principal: bool = True,
+        check_all: bool = True,
+    ) -> Precheck:
+        return self._precheck(
+            brittle_key, emergency_keys, (mark_key, mark_ttl_sec), limits, now,
+            brittle_enabled, check_tool, check_principal, check_all,
+        )
+
+    def rate_limit_sync(self, limits: Sequence[RateLimit]) -> Precheck:
+        if not limits:
+            return Precheck(PRECHECK_OK, 0)
+        mono = time.monotonic()
+        self._expire_due(mono)
+        with self._locked([lim.key for lim in limits]):
+            ok, remaining, retry, by = self._limits(limits, mono)
+        if ok:
+            return Precheck(PRECHECK_OK, remaining)
+        return Precheck(PRECHECK_RATE_LIMITED, 0, retry, limits[by - 1].scope)
+
+    # ---- brittleness ----
+
+    def brittle_locked(self, lock_key: str, now: float) -> bool:
+        mono = time.monotonic()
+        with self._locked([lock_key]):
+            return self._brittle(lock_key, now, mono)
+
+    async def brittle_strike(
+        self, strike_key: str, lock_key: str, strikes: int, window_sec: int, lock_sec: int, now: float
+    ) -> Optional[float]:
+        mono = time.monotonic()
+        self._expire_due(mono)
+        with self._locked([strike_key, lock_key]):
+            n = int(self._get(strike_key, mono) or 0) + 1
+            self._set(strike_key, n, mono, ttl_sec=window_sec)
+            if n < strikes:
+                return None
+            until = now + float(lock_sec)
+            self._set(lock_key, until, mono, ttl_sec=max(2, lock_sec + 2))
+            return until
+
+    # ---- replay marks ----
+
+    def mark_once(self, key: str, ttl_sec: int) -> bool:
+        mono = time.monotonic()
+        self._expire_due(mono)
+        with self._locked([key]):
+            if self._get(key, mono) is not None:
+                return False
+            self._set(key, "1", mono, ttl_sec=max(1, int(ttl_sec)))
+            return True
+
+    # ---- emergency flags: authoritative here, so always "known" ----
+
+    def emergency_flags(self) -> Optional[EmergencyState]:
+        return self._state
+
+    def emergency_all(self) -> Optional[bool]:
+        return self._state.all
+
+    def set_emergency_flag(self, field: str, on: bool) -> None:
+        key = flag_key(field)
+        mono = time.monotonic()
+        with self._flags_lock:
+            with self._locked([key]):
+                if on:
+                    self._set(key, "1", mono)
+                else:
+                    self._data[self._stripe(key)].pop(key, None)
+            if on:
+                self._flags[field] = "1"
+            else:
+                self._flags.pop(field, None)
+            self._flags["_ts_ns"] = str(time.time_ns())
+            self._state = EmergencyState.from_hash(self._flags)
+
+    # ---- plumbing ----
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "keys": sum(len(d) for d in self._data),
+            "stripes": len(self._locks),
+            "wheel": {
+                "tick_ms": round(self._wheel.tick_sec * 1000.0, 3),
+                "slots": len(self._wheel.slots),
+                "scheduled": self._wheel.scheduled,
+                "fired": self._wheel.fired,
+            },
+            "expired": self.expired,
+        }
+
+    def emergency_metrics(self) -> Dict[str, Any]:
+        st = self._state
+        return {
+            "enabled": False,
+            "local": True,
+            "flags": {"all": st.all, "tools": sorted(st.tools), "principals": sorted(st.principals)},
+        }
@@ -0,0 +1,205 @@
+"""
+Kasbah RTP - thermo lockdown (latency safety brake) without Redis on the
+request path.
+
+Each process keeps its own latency EMA in memory: observe() after every
+/api/* response and locked() before every request are plain memory
+operations.
+
+A daemon thread publishes the local value every KASBAH_THERMO_PUBLISH_SEC
+into the hash kasbah:thermo:instances (field = instance id, value =
+{"ema_ms", "n" requests since the last publish, "ts"}) and reads back every
+instance's entry plus the shared lock key in the same round trip. The
+cluster EMA is the mean of the instance EMAs weighted by their recent
+request counts (idle or silent instances do not count; entries older than
+KASBAH_THERMO_INSTANCE_TTL_SEC are removed). When it reaches the threshold
+the cluster lock kasbah:thermo:lock_until is set for the cooldown, so every
+instance applies the same decision at its next publish. Without Redis the
+merge is over this process alone.
+
+    KASBAH_THERMO_PUBLISH_SEC         publish / merge interval (1)
+    KASBAH_THERMO_INSTANCE_TTL_SEC    forget instances silent for longer (10)
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .keyspace import KEYS
+
+
+KASBAH_THERMO_PUBLISH_SEC = float(os.environ.get("KASBAH_THERMO_PUBLISH_SEC", "1"))
+KASBAH_THERMO_INSTANCE_TTL_SEC = float(os.environ.get("KASBAH_THERMO_INSTANCE_TTL_SEC", "10"))
+
+INSTANCES_KEY = KEYS.thermo("instances")
+LOCK_KEY = KEYS.thermo("lock_until")
+
+
+def instance_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def merge(entries: Dict[str, Any], now: float, ttl_sec: float) -> Tuple[Optional[float], int, List[str]]:
+    """
+    (cluster EMA or None, requests counted, stale instance ids) from the
+    instances hash. Only instances that served requests since their
+    previous publish contribute, weighted by how many.
+    """
+    total = 0
+    acc = 0.0
+    stale: List[str] = []
+    for inst, raw in entries.items():
+        try:
+            d = json.loads(raw)
+            ts, n, ema = float(d["ts"]), int(d["n"]), float(d["ema_ms"])
+        except Exception:
+            stale.append(inst)
+            continue
+        if now - ts > ttl_sec:
+            stale.append(inst)
+            continue
+        if n > 0:
+            acc += ema * n
+            total += n
+    return (acc / total if total else None), total, stale
+
+
+class ThermoBrake:
+    def __init__(
+        self,
+        get_client: Callable[[], Any],
+        threshold_ms: float,
+        alpha: float,
+        cooldown_sec: int,
+        force: bool = False,
+        publish_sec: float = KASBAH_THERMO_PUBLISH_SEC,
+        instance_ttl_sec: float = KASBAH_THERMO_INSTANCE_TTL_SEC,
+        instance: Optional[str] = None,
+    ):
+        self.get_client = get_client
+        self.threshold_ms = float(threshold_ms)
+        self.alpha = float(alpha)
+        self.cooldown_sec = int(cooldown_sec)
+        self.force = bool(force)
+        self.publish_sec = max(0.05, float(publish_sec))
+        self.instance_ttl_sec = max(self.publish_sec * 2, float(instance_ttl_sec))
+        self.instance = instance or instance_id()
+        self._lock = threading.Lock()
+        self._ema: Optional[float] = None
+        self._n = 0  # requests observed since the last publish
+        self._lock_until = 0.0  # wall clock, shared meaning across instances
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.cluster_ema_ms: Optional[float] = None
+        self.cluster_instances = 0
+        self.publishes = 0
+        self.publish_errors = 0
+        self.lockdowns = 0
+
+    # ---- request path (no I/O) ----
+
+    def observe(self, lat_ms: float) -> None:
+        with self._lock:
+            if self._ema is None:
+                self._ema = float(lat_ms)
+            else:
+                self._ema = self.alpha * float(lat_ms) + (1.0 - self.alpha) * self._ema
+            self._n += 1
+
+    def locked(self) -> bool:
+        return self.force or self._lock_until > time.time()
+
+    # ---- merge ----
+
+    def tick(self) -> None:
+        """Publish the local EMA, merge the cluster's and apply the lockdown decision."""
+        with self._lock:
+            ema, n = self._ema, self._n
+            self._n = 0
+        now = time.time()
+        mine = json.dumps({"ema_ms": ema if ema is not None else 0.0, "n": n, "ts": now}, separators=(",", ":"))
+        rc = self.get_client()
+        shared_until = 0.0
+        entries: Dict[str, Any] = {self.instance: mine}
+        if rc is not None:
+            try:
+                pipe = rc.pipeline(transaction=False)
+                pipe.hset(INSTANCES_KEY, self.instance, mine)
+                pipe.hgetall(INSTANCES_KEY)
+                pipe.get(LOCK_KEY)
+                _, entries, lock_raw = pipe.execute()
+                shared_until = float(lock_raw or 0.0)
+                self.publishes += 1
+            except Exception:
+                self.publish_errors += 1
+                rc = None
+                entries = {self.instance: mine}
+
+        cluster, _total, stale = merge(entries or {}, now, self.instance_ttl_sec)
+        self.cluster_ema_ms = cluster
+        self.cluster_instances = len(entries or {}) - len(stale)
+        until = shared_until
+        if cluster is not None and cluster >= self.threshold_ms:
+            until = max(until, now + float(self.cooldown_sec))
+            self.lockdowns += 1
+        if rc is not None and (until > shared_until or stale):
+            try:
+                pipe = rc.pipeline(transaction=False)
+                if until > shared_until:
+                    pipe.set(LOCK_KEY, repr(until), ex=max(2, self.cooldown_sec + 2))
+                if stale:
+                    pipe.hdel(INSTANCES_KEY, *stale)
+                pipe.execute()
+            except Exception:
+                self.publish_errors += 1
+        self._lock_until = until
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="kasbah-thermo", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        t = self._thread
+        if t is not None:
+            t.join(timeout=self.publish_sec + 1.0)
+        self._thread = None
+        rc = self.get_client()
+        if rc is not None:
+            try:
+                rc.hdel(INSTANCES_KEY, self.instance)
+            except Exception:
+                pass
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.publish_sec):
+            try:
+                self.tick()
+            except Exception:
+                pass
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "instance": self.instance,
+            "locked": self.locked(),
+            "lock_until": self._lock_until or None,
+            "force": self.force,
+            "threshold_ms": self.threshold_ms,
+            "local_ema_ms": round(self._ema, 3) if self._ema is not None else None,
+            "cluster_ema_ms": round(self.cluster_ema_ms, 3) if self.cluster_ema_ms is not None else None,
+            "cluster_instances": self.cluster_instances,
+            "publish_sec": self.publish_sec,
+            "publishes": self.publishes,
+            "publish_errors": self.publish_errors,
+            "lockdowns": self.lockdowns,
+        }
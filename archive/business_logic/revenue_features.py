@@ -1,11 +1,19 @@
 import json
+import os
+from collections import deque
 from datetime import datetime
 
+from apps.api.rtp.audit_sink import get_sink
+
+AUDIT_LOG_PATH = os.path.join(".kasbah", "decisions.jsonl")
+AUDIT_LOG_MEMORY = int(os.environ.get("KASBAH_REVENUE_AUDIT_MEMORY", "10000"))
+
 class RevenueFeatures:
     def __init__(self):
         # Feature 1: Shadow Mode (Safe Mode)
         self.shadow_mode = True  # DEFAULT: We start in Safe Mode
-        self.audit_log = []      # Stores the "Immutable Audit Trail"
+        self.audit_log = deque(maxlen=AUDIT_LOG_MEMORY)  # recent entries; the trail itself is on disk
+        self.audit_sink = get_sink(AUDIT_LOG_PATH)
         self.cost_savings = 0    # TDP Savings Tracker
 
     def toggle_shadow_mode(self, is_enabled):
@@ -25,6 +33,7 @@ class RevenueFeatures:
             "signature_hash": "0xSIMULATED_ZK_PROOF" # Placeholder for VSM
         }
         self.audit_log.append(entry)
+        self.audit_sink.emit(entry)
 
     def export_audit_report(self):
         """
@@ -32,7 +41,7 @@ class RevenueFeatures:
         Generates the report the CISO buys.
         """
         print("\n=== GENERATING AUDIT REPORT (SOC2 READY) ===")
-        for entry in self.audit_log[-5:]: # Show last 5 events
+        for entry in list(self.audit_log)[-5:]: # Show last 5 events
             print(f"{entry['timestamp']} | {entry['decision']} | {entry['reason']}")
         print("=== END REPORT ===\n")
 
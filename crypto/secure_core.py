@@ -1,9 +1,16 @@
 import os
+import fcntl
 import hashlib
 import json
 from cryptography.hazmat.primitives.asymmetric import ed25519
 from cryptography.hazmat.primitives import serialization
 
+from apps.api.rtp.audit_sink import get_sink
+
+class LedgerCorrupt(Exception):
+    """ledger.json cannot be read; it and the journal are left as they are."""
+
+
 class CryptoSecureCore:
     """
     Implements New Code #2 (CryptoBoundCommandBus) and New Code #4 (IMIL).
@@ -15,34 +22,82 @@ class CryptoSecureCore:
         self.public_key = self.private_key.public_key()
         
         # Merkle Tree State (Persistent)
+        # ledger.json is a snapshot; new leaves are appended to the journal
+        # through the buffered audit sink and folded in on the next start.
+        # Journal writes and the fold hold ledger.lock, so a fold never
+        # drops a leaf another process is appending.
+        # A leaf reaches the journal within KASBAH_AUDIT_SINK_FLUSH_MS of
+        # update_merkle_ledger() returning and is not fsynced: a crash can
+        # lose the last leaves. Call self.sink.flush() for a written leaf.
         self.storage_file = ".kasbah/ledger.json"
+        self.journal_file = ".kasbah/ledger.leaves.jsonl"
+        self.lock_file = ".kasbah/ledger.lock"
         self.ledger_path = os.path.dirname(self.storage_file)
         
         # Create dir if missing
         if not os.path.exists(self.ledger_path):
             os.makedirs(self.ledger_path)
             
-        # Load existing leaves
-        self.leaves = self._load_ledger()
+        self.sink = get_sink(self.journal_file, lock_path=self.lock_file)
+
+        # Load existing leaves, then fold the journal into the snapshot.
+        # A corrupt snapshot raises LedgerCorrupt before anything is written.
+        self.sink.flush()
+        with open(self.lock_file, 'a+') as lockf:
+            fcntl.flock(lockf.fileno(), fcntl.LOCK_EX)
+            self.leaves, covered = self._load_ledger()
+            self._save_ledger(covered)
 
     def _load_ledger(self):
+        """Snapshot + journal leaves, and the journal byte offset they cover. Call under the lock."""
+        leaves = []
         if os.path.exists(self.storage_file):
             try:
                 with open(self.storage_file, 'r') as f:
                     # Hashes are bytes, json stores strings. We need to decode back.
                     hashes_str = json.load(f)
-                    return [bytes.fromhex(h) for h in hashes_str]
+                    leaves = [bytes.fromhex(h) for h in hashes_str]
             except Exception as e:
-                print(f"[SECURE_CORE] Warning: Could not load ledger: {e}")
-                return []
-        return []
+                raise LedgerCorrupt(f"could not load {self.storage_file}: {e}") from e
+        covered = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # torn last line: left in the journal
+                    covered += len(line)
+                    try:
+                        leaves.append(bytes.fromhex(json.loads(line)["leaf"]))
+                    except Exception:
+                        pass
+        return leaves, covered
 
-    def _save_ledger(self):
+    def _save_ledger(self, covered=0):
+        """Write the snapshot, then drop the first `covered` journal bytes. Call under the lock."""
         try:
             # Convert bytes back to hex strings for JSON storage
             hashes_str = [h.hex() for h in self.leaves]
-            with open(self.storage_file, 'w') as f:
+            tmp = self.storage_file + ".tmp"
+            with open(tmp, 'w') as f:
                 json.dump(hashes_str, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.storage_file)
+            if covered and os.path.exists(self.journal_file):
+                # replaced, never rewritten in place: a crash leaves the old
+                # journal or the new one. The sink reopens it on its next
+                # append (the inode changed), which waits for this lock.
+                with open(self.journal_file, 'rb') as f:
+                    f.seek(covered)
+                    rest = f.read()
+                if rest and not rest.endswith(b"\n"):
+                    rest += b"\n"  # end the torn line so the next append stays intact
+                tmp = self.journal_file + ".tmp"
+                with open(tmp, 'wb') as f:
+                    f.write(rest)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.journal_file)
         except Exception as e:
             print(f"[SECURE_CORE] Critical: Failed to save ledger: {e}")
 
@@ -73,7 +128,8 @@ class CryptoSecureCore:
         leaf_hash = hashlib.sha256(data_str.encode()).digest()
         self.leaves.append(leaf_hash)
         
-        # PERSISTENCE: Write to disk immediately
-        self._save_ledger()
+        # PERSISTENCE: journaled through the buffered sink (one append per flush,
+        # not a rewrite of the whole ledger per leaf)
+        self.sink.emit({"leaf": leaf_hash.hex()})
         
         return leaf_hash
@@ -0,0 +1,20 @@
+import importlib
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    """apps.api.main, imported once against a scratch data dir and the in-process state backend."""
+    pytest.importorskip("fastapi")
+    mp = pytest.MonkeyPatch()
+    data_dir = str(tmp_path_factory.mktemp("data"))
+    mp.setenv("KASBAH_DATA_DIR", data_dir)
+    mp.setenv("KASBAH_STATE_BACKEND", "memory")
+    # other test modules may have imported these before the env was set
+    mp.setattr("apps.api.rtp.state_backend.KASBAH_STATE_BACKEND", "memory")
+    mp.setattr("apps.api.rtp.authz.DATA_DIR", data_dir)
+    mp.setenv("KASBAH_AUTHZ", "0")
+    mp.setenv("API_KEY", "admin-key")
+    yield importlib.import_module("apps.api.main")
+    mp.undo()
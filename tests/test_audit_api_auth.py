@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient  # noqa: E402
+
+ADMIN = {"Authorization": "Bearer admin-key"}
+PATHS = [
+    "/api/rtp/audit/metrics",
+    "/api/rtp/audit/proof/j-auth",
+    "/api/rtp/audit/merkle/roots",
+    "/api/rtp/audit/aggregates?group_by=agent_id",
+]
+
+
+@pytest.fixture(scope="module")
+def client(api):
+    return TestClient(api.app)
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_admin_only(client, path):
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 403
+    assert client.get(path, headers=ADMIN).status_code == 200
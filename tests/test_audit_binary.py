@@ -0,0 +1,76 @@
+from apps.api.rtp.audit_binary import convert_segment
+from apps.api.rtp.audit_export import export_ndjson
+from apps.api.rtp.audit_ledger import AuditLedger, load_tip, read_tail_lines
+from apps.api.rtp.audit_segments import SegmentManifest, list_segments, read_line_at
+from apps.api.rtp.audit_verify import verify_log
+
+
+def _rec(i):
+    return {
+        "event": "DECIDE" if i % 2 else "CONSUME",
+        "agent_id": f"agent-{i % 3}",
+        "tool_name": "shell",
+        "ts_ns": i,
+        "jti": f"j{i}",
+        "extra": {"score": i / 7, "tags": ["a", None, True], "note": "ü"},
+    }
+
+
+def _export(path):
+    return b"".join(export_ndjson(path, limit=0)).splitlines()[:-1]
+
+
+def test_binary_segments_chain_like_jsonl(tmp_path):
+    out = {}
+    for fmt in ("jsonl", "bin"):
+        d = tmp_path / fmt
+        d.mkdir()
+        led = AuditLedger(d / "audit.jsonl", d / "audit.lock", batch_max=3, segment_max_bytes=1500, format=fmt, compress=False)
+        for i in range(40):
+            assert led.append(_rec(i))
+        led.close()
+        out[fmt] = d / "audit.jsonl"
+
+    # same records, same hashes, same canonical lines; fewer bytes on disk
+    assert _export(out["bin"]) == _export(out["jsonl"])
+    assert {s.format for s, _ in list_segments(out["bin"])} == {"bin"}
+    size = {fmt: sum(s.bytes for s in SegmentManifest.load(p.with_suffix(".segments")).sealed) for fmt, p in out.items()}
+    assert size["bin"] < size["jsonl"] * 0.7
+
+    rep = verify_log(out["bin"], full=True)
+    assert rep.ok, rep.errors
+    assert rep.records == 40
+    assert read_tail_lines(out["bin"], 2) == read_tail_lines(out["jsonl"], 2)
+
+    # a second writer picks up the string table and tip of the binary segment
+    led = AuditLedger(out["bin"], tmp_path / "bin" / "audit.lock", format="bin", compress=False)
+    assert led.append(_rec(40))
+    led.close()
+    assert load_tip(out["bin"]).count == 41
+    assert verify_log(out["bin"]).ok
+
+
+def test_convert_round_trip_and_torn_tail(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    led = AuditLedger(path, tmp_path / "audit.lock", batch_max=4, format="bin", compress=False)
+    for i in range(20):
+        assert led.append(_rec(i))
+    led.close()
+
+    as_jsonl = tmp_path / "seg.jsonl"
+    as_bin = tmp_path / "seg.bin"
+    assert convert_segment(path, as_jsonl, "jsonl") == 20
+    assert convert_segment(as_jsonl, as_bin, "bin") == 20
+    assert as_bin.read_bytes() == path.read_bytes()
+    lines = as_jsonl.read_bytes().splitlines()
+    off = sum(len(ln) + 1 for ln in lines[:6])
+    assert read_line_at(as_jsonl, off) == lines[6]
+
+    with open(path, "ab") as f:
+        f.write(b"\x00\x00\x02")  # crash mid-frame
+    led = AuditLedger(path, tmp_path / "audit.lock", format="bin", compress=False)
+    assert led.append(_rec(20))
+    led.close()
+    rep = verify_log(path, full=True)
+    assert rep.ok, rep.errors
+    assert rep.records == 21
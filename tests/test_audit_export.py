@@ -0,0 +1,50 @@
+import json
+
+from apps.api.rtp.audit_export import export_ndjson
+from apps.api.rtp.audit_index import AuditIndex
+from apps.api.rtp.audit_ledger import AuditLedger
+
+
+def _page(tmp_path, **kw):
+    chunks = b"".join(export_ndjson(tmp_path / "audit.jsonl", **kw)).decode("utf-8").splitlines()
+    recs = [json.loads(c) for c in chunks[:-1]]
+    return recs, json.loads(chunks[-1])["meta"]
+
+
+def test_cursor_pages_cover_log_once(tmp_path):
+    idx = AuditIndex(tmp_path / "audit.index.sqlite")
+    led = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock", batch_max=3, segment_max_bytes=600)
+    led.add_listener(idx.on_commit)
+    for i in range(25):
+        assert led.append({"event": "E", "ts_ns": i})
+
+    seen = []
+    cursor = None
+    while True:
+        recs, meta = _page(tmp_path, cursor=cursor, limit=7, index=idx)
+        if not recs:
+            break
+        seen.extend(r["ts_ns"] for r in recs)
+        assert meta["last_hash"] == recs[-1]["hash"]
+        cursor = meta["next_cursor"]
+    assert seen == list(range(25))
+
+    # incremental pull picks up only new records
+    for i in range(25, 28):
+        assert led.append({"event": "E", "ts_ns": i})
+    led.close()
+    recs, meta = _page(tmp_path, cursor=cursor, limit=0)
+    assert [r["ts_ns"] for r in recs] == [25, 26, 27]
+
+
+def test_sequence_number_cursor_and_end_index(tmp_path):
+    idx = AuditIndex(tmp_path / "audit.index.sqlite")
+    led = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock", batch_max=4)
+    led.add_listener(idx.on_commit)
+    for i in range(10):
+        assert led.append({"event": "E", "ts_ns": i})
+    led.close()
+    for index in (idx, None):
+        recs, meta = _page(tmp_path, cursor="6", limit=0, end_index=9, index=index)
+        assert [r["ts_ns"] for r in recs] == [6, 7, 8]
+        assert meta["next_cursor"].startswith("9.")
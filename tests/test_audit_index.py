@@ -0,0 +1,37 @@
+from apps.api.rtp.audit_index import AuditIndex, explain, rebuild
+from apps.api.rtp.audit_ledger import AuditLedger
+
+
+def _ledger(tmp_path, **kw):
+    return AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock", **kw)
+
+
+def test_index_follows_commits_across_segments(tmp_path):
+    idx = AuditIndex(tmp_path / "audit.index.sqlite")
+    led = _ledger(tmp_path, batch_max=4, segment_max_bytes=500)
+    led.add_listener(idx.on_commit)
+    for i in range(40):
+        assert led.append({"event": "DECIDE", "ts_ns": i, "jti": f"j{i % 10}"})
+    led.close()
+
+    trace = explain(idx, tmp_path / "audit.jsonl", "j3")
+    assert [r["ts_ns"] for r in trace] == [3, 13, 23, 33]
+    assert idx.indexed_through() == 40
+    assert explain(idx, tmp_path / "audit.jsonl", "nope") == []
+
+
+def test_offline_rebuild_and_catch_up(tmp_path):
+    led = _ledger(tmp_path, segment_max_bytes=300)
+    for i in range(12):
+        assert led.append({"event": "CONSUME", "ts_ns": i, "jti": f"j{i}"})
+    led.close()
+
+    assert rebuild(tmp_path / "audit.jsonl") == 12
+    idx = AuditIndex(tmp_path / "audit.index.sqlite")
+    assert [r["ts_ns"] for r in explain(idx, tmp_path / "audit.jsonl", "j0")] == [0]
+
+    led = _ledger(tmp_path)
+    assert led.append({"event": "CONSUME", "ts_ns": 99, "jti": "late"})
+    led.close()
+    assert idx.catch_up(tmp_path / "audit.jsonl") == 1
+    assert explain(idx, tmp_path / "audit.jsonl", "late")[0]["ts_ns"] == 99
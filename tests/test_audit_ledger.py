@@ -0,0 +1,185 @@
+import json
+import threading
+
+from apps.api.rtp.audit_ledger import AuditLedger, audit_hash_line, load_tip, read_tail_lines
+from apps.api.rtp.audit_segments import SegmentManifest, iter_lines, list_segments
+
+
+def _legacy_hash(rec: dict) -> str:
+    tmp = {k: v for k, v in rec.items() if k not in ("hash", "prev_hash")}
+    line = json.dumps(tmp, separators=(",", ":"), sort_keys=True)
+    return audit_hash_line(rec["prev_hash"], line)
+
+
+def _read(path):
+    return [json.loads(ln) for _, ln in iter_lines(path)]
+
+
+def test_concurrent_appends_form_one_chain(tmp_path):
+    led = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock", batch_max=16, linger_ms=5)
+
+    def worker(n):
+        for i in range(25):
+            assert led.append({"ts_ns": i, "event": "DECIDE", "agent_id": f"a{n}", "jti": f"{n}-{i}", "extra": {}})
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    led.close()
+
+    recs = _read(tmp_path / "audit.jsonl")
+    assert len(recs) == 200
+    prev = ""
+    for r in recs:
+        assert r["prev_hash"] == prev
+        assert r["hash"] == _legacy_hash(r)
+        prev = r["hash"]
+    assert led.batches_committed < 200
+
+
+def test_line_bytes_match_legacy_serialization(tmp_path):
+    led = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock")
+    rec = {"ts_ns": 1, "event": "CONSUME", "agent_id": "x", "jti": None, "extra": {"b": 1, "a": [1, "é"]}}
+    assert led.append(dict(rec))
+    led.close()
+    line = (tmp_path / "audit.jsonl").read_text(encoding="utf-8").splitlines()[-1]
+    stored = json.loads(line)
+    assert line == json.dumps(stored, separators=(",", ":"), sort_keys=True)
+
+
+def test_chain_continues_across_ledger_instances(tmp_path):
+    a = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock")
+    b = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock")
+    assert a.append({"event": "A", "ts_ns": 1})
+    assert b.append({"event": "B", "ts_ns": 2})
+    assert a.append({"event": "C", "ts_ns": 3})
+    a.close()
+    b.close()
+    recs = _read(tmp_path / "audit.jsonl")
+    assert [r["event"] for r in recs] == ["A", "B", "C"]
+    assert recs[1]["prev_hash"] == recs[0]["hash"]
+    assert recs[2]["prev_hash"] == recs[1]["hash"]
+
+
+def test_tip_checkpoint_and_tail_recovery(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    led = AuditLedger(path, tmp_path / "audit.lock")
+    for i in range(5):
+        assert led.append({"event": "E", "ts_ns": i})
+    led.close()
+    recs = _read(path)
+
+    tip = load_tip(path)
+    assert tip.last_hash == recs[-1]["hash"]
+    assert tip.count == 5
+    assert tip.offset == path.stat().st_size
+
+    # checkpoint lagging behind the file: only the delta is counted
+    offsets = [off for off, _ in iter_lines(path)]
+    (tmp_path / "audit.tip.json").write_text(json.dumps({"last_hash": recs[2]["hash"], "count": 3, "offset": offsets[3]}))
+    tip = load_tip(path)
+    assert (tip.last_hash, tip.count) == (recs[-1]["hash"], 5)
+
+    # no / bogus checkpoint: reverse-seek fallback
+    (tmp_path / "audit.tip.json").write_text("{}")
+    assert load_tip(path).last_hash == recs[-1]["hash"]
+    (tmp_path / "audit.tip.json").unlink()
+    assert load_tip(path).count == 5
+
+
+def test_read_tail_lines(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    path.write_text("".join(f"line{i}\n" for i in range(1000)))
+    assert read_tail_lines(path, 3, block=16) == ["line997", "line998", "line999"]
+    assert len(read_tail_lines(path, 5000)) == 1000
+
+
+def test_read_tail_lines_across_rotation(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    led = AuditLedger(path, tmp_path / "audit.lock", batch_max=1, segment_max_bytes=400)
+    for i in range(20):
+        assert led.append({"event": "E", "ts_ns": i})
+    led.close()
+    assert len(list_segments(path)) > 2  # sealed segments are compressed too
+
+    tail = [json.loads(ln)["ts_ns"] for ln in read_tail_lines(path, 12)]
+    assert tail == list(range(8, 20))
+    assert [json.loads(ln)["ts_ns"] for ln in read_tail_lines(path, 0)] == list(range(20))
+    assert len(read_tail_lines(path, 500)) == 20
+
+
+def test_rotation_keeps_chain_across_segments(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    led = AuditLedger(path, tmp_path / "audit.lock", batch_max=1, segment_max_bytes=400)
+    for i in range(20):
+        assert led.append({"event": "E", "ts_ns": i, "jti": f"j{i}"})
+    led.close()
+
+    segs = list_segments(path)
+    assert len(segs) > 2
+    prev = ""
+    recs = []
+    for info, seg_path in segs:
+        assert info.prev_hash == prev
+        for _, ln in iter_lines(seg_path):
+            r = json.loads(ln)
+            assert r["prev_hash"] == prev
+            assert r["hash"] == _legacy_hash(r)
+            prev = r["hash"]
+            recs.append(r)
+        if info.sealed_ns:
+            assert info.last_hash == prev
+    assert [r["jti"] for r in recs] == [f"j{i}" for i in range(20)]
+    assert led.tip().count == 20
+
+
+def test_retention_by_count(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    led = AuditLedger(path, tmp_path / "audit.lock", batch_max=1, segment_max_bytes=300, retain_segments=2)
+    for i in range(30):
+        assert led.append({"event": "E", "ts_ns": i})
+    led.close()
+    m = SegmentManifest.load(tmp_path / "audit.segments")
+    assert len(m.sealed) == 2
+    assert m.pruned_through_seq == m.sealed[0].seq - 1
+    assert m.sealed[0].prev_hash == m.pruned_last_hash
+    names = sorted(p.name for p in (tmp_path / "audit.segments").iterdir() if p.name.endswith((".jsonl", ".jsonl.z")))
+    assert names == [s.name for s in m.sealed]
+
+
+def test_listeners_run_after_the_flock_is_released(tmp_path):
+    import fcntl
+
+    lock = tmp_path / "audit.lock"
+    led = AuditLedger(tmp_path / "audit.jsonl", lock, batch_max=2, durability="interval")
+    seen = []
+
+    def listener(committed):
+        with open(lock, "a+") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)  # raises while the writer holds it
+            seen.extend(c.index for c in committed)
+
+    led.add_listener(listener)
+    for i in range(5):
+        assert led.append({"event": "E", "ts_ns": i})
+    led.close()
+    assert seen == list(range(5))
+
+
+def test_strict_fsync_failure_fails_the_batch(tmp_path, monkeypatch):
+    led = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock", durability="strict")
+
+    def _fail(fd):
+        raise OSError(5, "EIO")
+
+    monkeypatch.setattr("os.fsync", _fail)
+    assert not led.append({"ts_ns": 1, "event": "DECIDE", "agent_id": "a", "jti": "j1", "extra": {}})
+    assert led.fsyncs == 0
+    assert led.commit_failures == 1
+
+    monkeypatch.undo()
+    assert led.append({"ts_ns": 2, "event": "DECIDE", "agent_id": "a", "jti": "j2", "extra": {}})
+    assert led.fsyncs == 1
+    led.close()
@@ -0,0 +1,55 @@
+from apps.api.rtp.audit_ledger import AuditLedger
+from apps.api.rtp.audit_merkle import MerkleCheckpoints, merkle_root, verify_proof
+from apps.api.rtp.audit_segments import iter_records_from
+
+
+def test_block_roots_and_inclusion_proofs(tmp_path):
+    mk = MerkleCheckpoints(tmp_path / "audit.segments", block=8)
+    led = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock", batch_max=3, segment_max_bytes=700)
+    led.add_listener(mk.on_commit)
+    for i in range(21):
+        assert led.append({"event": "DECIDE", "ts_ns": i, "jti": f"j{i}"})
+    led.close()
+
+    roots = mk.roots()
+    assert [r["block"] for r in roots] == [0, 1]
+    lines = {idx: line for idx, _, _, line in iter_records_from(tmp_path / "audit.jsonl")}
+    assert len(lines) == 21
+
+    for idx in (0, 5, 15, 20):
+        p = mk.proof(idx)
+        assert len(p["path"]) <= 3
+        assert verify_proof(lines[idx], p)
+        if p["sealed"]:
+            assert p["root"] == roots[p["block"]]["root"]
+    assert not verify_proof(lines[4], mk.proof(5))
+
+
+def test_catch_up_matches_live_leaves(tmp_path):
+    led = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock")
+    for i in range(10):
+        assert led.append({"event": "E", "ts_ns": i})
+    led.close()
+    mk = MerkleCheckpoints(tmp_path / "audit.segments", block=4)
+    assert mk.catch_up(tmp_path / "audit.jsonl") == 10
+    assert mk.leaf_count() == 10
+    assert len(mk.roots()) == 2
+    assert mk.roots()[1]["root"] == merkle_root(mk.read_leaves(4, 4)).hex()
+
+
+def test_proofs_outlive_retention(tmp_path):
+    mk = MerkleCheckpoints(tmp_path / "audit.segments", block=4)
+    led = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock", batch_max=1, segment_max_bytes=300, retain_segments=1)
+    led.add_listener(mk.on_commit)
+    archived = {}
+    for i in range(20):
+        assert led.append({"event": "E", "ts_ns": i, "jti": f"j{i}"})
+        if i == 1:
+            archived = {idx: line for idx, _, _, line in iter_records_from(tmp_path / "audit.jsonl")}
+    led.close()
+
+    retained = {idx for idx, _, _, _ in iter_records_from(tmp_path / "audit.jsonl", 0)}
+    assert 0 not in retained  # pruned by retention
+    p = mk.proof(0)
+    assert p["sealed"] and p["root"] == mk.roots()[0]["root"]
+    assert verify_proof(archived[0], p)
@@ -0,0 +1,75 @@
+import json
+import sqlite3
+
+from apps.api.rtp.audit_index import AuditIndex
+from apps.api.rtp.audit_ledger import AuditLedger
+from apps.api.rtp.audit_query import parse_filters, query_ndjson
+
+SEC = 1_000_000_000
+
+
+def _rec(i):
+    event = "AUTHZ_DENY" if i % 4 == 0 else "DECIDE"
+    return {
+        "event": event,
+        "agent_id": f"a{i % 2}",
+        "ts_ns": i * 30 * SEC,  # two records per 60s bucket
+        "jti": None,
+        "extra": {"tool_name": "shell" if i % 3 else "http", "principal": f"p{i % 5}"},
+    }
+
+
+def _page(idx, path, filters, **kw):
+    lines = b"".join(query_ndjson(idx, path, filters, **kw)).splitlines()
+    return [json.loads(ln)["ts_ns"] // (30 * SEC) for ln in lines[:-1]], json.loads(lines[-1])["meta"]
+
+
+def test_field_and_time_queries_page_through_matches(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    idx = AuditIndex(tmp_path / "audit.index.sqlite")
+    led = AuditLedger(path, tmp_path / "audit.lock", batch_max=5, segment_max_bytes=2000)
+    led.add_listener(idx.on_commit)
+    for i in range(100):
+        assert led.append(_rec(i))
+    led.close()
+
+    f = parse_filters(event="AUTHZ_DENY", agent_id="a0")
+    window = dict(since_ns=20 * 30 * SEC, until_ns=70 * 30 * SEC)
+    got, cursor = [], None
+    while True:
+        page, meta = _page(idx, path, f, cursor=cursor, limit=3, **window)
+        got += page
+        cursor = meta["next_cursor"]
+        if meta["done"]:
+            break
+    assert got == [i for i in range(20, 71) if i % 4 == 0]
+
+    got, _ = _page(idx, path, parse_filters(tool_name="http,none", principal="p0"), limit=0)
+    assert got == [i for i in range(100) if i % 3 == 0 and i % 5 == 0]
+
+    # no field filter: sequential read from the window start only
+    got, meta = _page(idx, path, {}, since_ns=95 * 30 * SEC, limit=0)
+    assert got == [95, 96, 97, 98, 99] and meta["done"]
+    got, meta = _page(idx, path, {}, until_ns=10 * 30 * SEC, scan_max=4)
+    assert got == [0, 1, 2, 3] and not meta["done"] and meta["next_cursor"] == "4"
+
+
+def test_old_index_is_rebuilt_for_queries(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    db = tmp_path / "audit.index.sqlite"
+    idx = AuditIndex(db)
+    led = AuditLedger(path, tmp_path / "audit.lock")
+    led.add_listener(idx.on_commit)
+    for i in range(8):
+        assert led.append(_rec(i))
+    led.close()
+    idx.close()
+    with sqlite3.connect(str(db)) as c:  # as written before the query tables existed
+        c.execute("DELETE FROM attr_index")
+        c.execute("DELETE FROM meta WHERE key = 'schema'")
+
+    idx = AuditIndex(db)
+    assert idx.indexed_through() == 0
+    assert idx.catch_up(path) == 8
+    got, _ = _page(idx, path, parse_filters(event="AUTHZ_DENY"), limit=0)
+    assert got == [0, 4]
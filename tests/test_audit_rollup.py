@@ -0,0 +1,97 @@
+import threading
+import time
+
+from apps.api.rtp.audit_ledger import AuditLedger
+from apps.api.rtp.audit_rollup import AuditRollups
+
+MIN = 60 * 1_000_000_000
+T0 = (time.time_ns() // (60 * MIN) - 1) * 60 * MIN  # hour-aligned, inside the retention window
+
+
+def _rec(i):
+    return {
+        "event": ("DECIDE", "CONSUME", "AUTHZ_DENY")[i % 3],
+        "agent_id": f"a{i % 2}",
+        "ts_ns": T0 + (i // 10) * MIN + i,  # ten records per minute
+        "extra": {"tool_name": "shell"},
+    }
+
+
+def test_rollups_merge_minutes_and_survive_restart(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    roll = AuditRollups(tmp_path / "audit.rollups.jsonl", flush_sec=0, compact_lines=4)
+    led = AuditLedger(path, tmp_path / "audit.lock", batch_max=7)
+    led.add_listener(roll.on_commit)
+    for i in range(60):
+        assert led.append(_rec(i))
+    led.close()
+    roll.flush()
+
+    agg = roll.aggregate(since_ns=T0 + 2 * MIN, until_ns=T0 + 3 * MIN + 5, group_by=["event"])
+    assert agg["total"] == 20 and agg["until_ns"] == T0 + 4 * MIN - 1
+    assert {g["event"]: g["count"] for g in agg["groups"]} == {"DECIDE": 7, "CONSUME": 6, "AUTHZ_DENY": 7}
+
+    agg = roll.aggregate(filters={"event": ["AUTHZ_DENY"]}, group_by=["agent_id"], step_sec=180)
+    assert agg["total"] == 20
+    assert [s["t_ns"] for s in agg["series"]] == [T0, T0 + 3 * MIN]
+    assert sum(g["count"] for s in agg["series"] for g in s["groups"]) == 20
+
+    # compacted to one line per minute; a new reader sees the same counts
+    assert len((tmp_path / "audit.rollups.jsonl").read_text().splitlines()) <= 6
+    again = AuditRollups(tmp_path / "audit.rollups.jsonl")
+    assert again.through() == 60
+    assert again.aggregate()["groups"] == roll.aggregate()["groups"]
+
+    # records committed while no rollup listener was attached are recounted once
+    led = AuditLedger(path, tmp_path / "audit.lock")
+    for i in range(60, 65):
+        assert led.append(_rec(i))
+    led.close()
+    assert again.catch_up(path) == 5
+    assert again.catch_up(path) == 0
+    assert again.aggregate(group_by=["tool_name"])["groups"] == [{"tool_name": "shell", "count": 65}]
+
+
+def test_two_instances_count_each_record_once(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    rpath = tmp_path / "audit.rollups.jsonl"
+    led = AuditLedger(path, tmp_path / "audit.lock", batch_max=4)
+    for i in range(20):  # no listener attached: both workers find the gap
+        assert led.append(_rec(i))
+    led.close()
+
+    a = AuditRollups(rpath, flush_sec=3600)
+    b = AuditRollups(rpath, flush_sec=3600)
+    counts = []
+    threads = [threading.Thread(target=lambda r=r: counts.append(r.catch_up(path))) for r in (a, b)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(counts) == [0, 20]
+
+    # a's live counts are not flushed yet when b catches up: b counts them,
+    # a drops them at its flush
+    led = AuditLedger(path, tmp_path / "audit.lock", batch_max=4)
+    led.add_listener(a.on_commit)
+    for i in range(20, 30):
+        assert led.append(_rec(i))
+    led.close()
+    assert b.catch_up(path) == 10
+    assert a.aggregate()["total"] == 30
+    assert a.flush()
+    for r in (a, b, AuditRollups(rpath)):
+        assert r.aggregate()["total"] == 30 and r.through() == 30
+
+
+def test_legacy_lines_cover_below_through(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    led = AuditLedger(path, tmp_path / "audit.lock")
+    for i in range(12):
+        assert led.append(_rec(i))
+    led.close()
+    rpath = tmp_path / "audit.rollups.jsonl"
+    rpath.write_text('{"through":10,"rows":[[%d,"DECIDE","a0","shell",10]]}\n' % (T0 // MIN))
+    roll = AuditRollups(rpath)
+    assert roll.catch_up(path) == 2
+    assert roll.aggregate()["total"] == 12
@@ -0,0 +1,57 @@
+import json
+
+from apps.api.rtp.audit_export import export_ndjson
+from apps.api.rtp.audit_index import AuditIndex, explain
+from apps.api.rtp.audit_ledger import AuditLedger
+from apps.api.rtp.audit_segments import (
+    FrameIndex,
+    SegmentManifest,
+    compress_segment,
+    iter_lines,
+    list_segments,
+    read_line_at,
+)
+from apps.api.rtp.audit_verify import verify_log
+
+
+def test_compressed_offsets_match_plain(tmp_path):
+    led = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock", batch_max=4, compress=False)
+    for i in range(50):
+        assert led.append({"event": "E", "ts_ns": i})
+    led.close()
+    plain = tmp_path / "audit.jsonl"
+    want = list(iter_lines(plain))
+
+    z = compress_segment(plain, "zlib", frame_records=8)
+    assert len(FrameIndex.load(z).frames) == 7  # header + 50 records
+    assert list(iter_lines(z)) == want
+    mid_off, mid_line = want[23]
+    assert read_line_at(z, mid_off) == mid_line
+    assert list(iter_lines(z, mid_off)) == want[23:]
+
+
+def test_readers_after_compaction(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    idx = AuditIndex(tmp_path / "audit.index.sqlite")
+    led = AuditLedger(path, tmp_path / "audit.lock", batch_max=2, segment_max_bytes=1200, frame_records=3, compress=False)
+    led.add_listener(idx.on_commit)
+    for i in range(40):
+        assert led.append({"event": "E", "ts_ns": i, "jti": f"j{i % 5}"})
+    led.flush()
+    before = b"".join(export_ndjson(path, limit=0)).splitlines()[:-1]
+
+    assert led.compact() > 1
+    led.close()
+    m = SegmentManifest.load(tmp_path / "audit.segments")
+    assert all(s.codec == "zlib" and s.name.endswith(".jsonl.z") for s in m.sealed)
+    assert not list((tmp_path / "audit.segments").glob("*.jsonl"))
+
+    assert b"".join(export_ndjson(path, limit=0)).splitlines()[:-1] == before
+    trace = explain(idx, path, "j3")
+    assert [r["ts_ns"] for r in trace] == list(range(3, 40, 5))
+    assert len(list_segments(path)) == len(m.sealed) + 1
+
+    rep = verify_log(path, full=True, workers=2)
+    assert rep.ok, rep.errors
+    assert rep.records == 40
+    assert json.loads(before[-1])["hash"] == rep.last_hash
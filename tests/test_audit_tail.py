@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+from apps.api.rtp.audit_ledger import AuditLedger
+from apps.api.rtp.audit_tail import AuditBroadcaster, TailFilter
+
+
+def _setup(tmp_path, **kw):
+    led = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock", batch_max=4, segment_max_bytes=1500)
+    tail = AuditBroadcaster(tmp_path / "audit.jsonl", **kw)
+    led.add_listener(tail.on_commit)
+    return led, tail
+
+
+def _rec(i):
+    return {"event": "CONSUME" if i % 3 == 0 else "DECIDE", "agent_id": f"a{i % 2}", "ts_ns": i, "extra": {"tool_name": "shell"}}
+
+
+async def _collect(feed, n):
+    out = []
+    async for item in feed:
+        if item is not None:
+            out.append(item)
+        if len(out) == n:
+            break
+    await feed.aclose()
+    return out
+
+
+def test_live_feed_filters(tmp_path):
+    led, tail = _setup(tmp_path)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        feed = tail.stream(TailFilter(events=["CONSUME"], agent_ids=["a0"], tool_names=["shell"]), heartbeat=0.05)
+        task = asyncio.ensure_future(_collect(feed, 4))
+        while tail.subscribers() == 0:
+            await asyncio.sleep(0.01)
+        for i in range(30):
+            await loop.run_in_executor(None, led.append, _rec(i))
+        return await asyncio.wait_for(task, 5)
+
+    items = asyncio.run(main())
+    led.close()
+    assert [json.loads(line)["ts_ns"] for _, _, line in items] == [0, 6, 12, 18]
+    assert tail.subscribers() == 0
+
+
+def test_resume_from_cursor_and_lag_catch_up(tmp_path):
+    led, tail = _setup(tmp_path, buffer=2)
+    for i in range(10):
+        assert led.append(_rec(i))
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        feed = tail.stream(TailFilter(), cursor="3", heartbeat=0.05)
+        first = await feed.__anext__()
+        # stop reading while 20 more records arrive: the 2-slot buffer overflows
+        for i in range(10, 30):
+            await loop.run_in_executor(None, led.append, _rec(i))
+        rest = await asyncio.wait_for(_collect(feed, 26), 5)
+        return [first] + rest
+
+    items = asyncio.run(main())
+    led.close()
+    assert [json.loads(line)["ts_ns"] for _, _, line in items] == list(range(3, 30))
+    idx, cursor, _ = items[-1]
+    assert idx == 29 and cursor.startswith("30.")
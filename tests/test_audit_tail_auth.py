@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient  # noqa: E402
+from starlette.websockets import WebSocketDisconnect  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def client(api):
+    return TestClient(api.app)
+
+
+def test_sse_tail_requires_admin(client):
+    assert client.get("/api/rtp/audit/tail").status_code == 403
+    r = client.get("/api/rtp/audit/tail", headers={"Authorization": "Bearer wrong"})
+    assert r.status_code == 403
+
+
+@pytest.mark.parametrize("kw", [{}, {"headers": {"Authorization": "Bearer wrong"}}, {"params": "?token=wrong"}])
+def test_ws_tail_closes_non_admin_with_policy_violation(client, kw):
+    url = "/api/rtp/audit/tail/ws" + kw.pop("params", "")
+    with pytest.raises(WebSocketDisconnect) as e:
+        with client.websocket_connect(url, **kw) as ws:
+            ws.receive_text()
+    assert e.value.code == 1008
+
+
+def test_ws_tail_accepts_admin_token(client, api):
+    api.append_audit("DECIDE", agent_id="tail-auth", jti="j-tail", extra={"tool_name": "read.me"})
+    assert api._AUDIT_LEDGER.flush()
+    with client.websocket_connect("/api/rtp/audit/tail/ws?token=admin-key&cursor=0&agent_id=tail-auth") as ws:
+        assert '"jti":"j-tail"' in ws.receive_text()
@@ -0,0 +1,62 @@
+import json
+
+from apps.api.rtp.audit_ledger import AuditLedger, verify
+from apps.api.rtp.audit_segments import list_segments
+from apps.api.rtp.audit_verify import verify_log
+
+
+def _fill(tmp_path, n, start=0, **kw):
+    led = AuditLedger(tmp_path / "audit.jsonl", tmp_path / "audit.lock", batch_max=2, **kw)
+    for i in range(start, start + n):
+        assert led.append({"event": "E", "ts_ns": i, "jti": f"j{i}"})
+    led.close()
+
+
+def test_parallel_full_then_incremental(tmp_path):
+    _fill(tmp_path, 60, segment_max_bytes=1500)
+    assert len(list_segments(tmp_path / "audit.jsonl")) > 3
+
+    rep = verify_log(tmp_path / "audit.jsonl", workers=2)
+    assert rep.ok, rep.errors
+    assert rep.records == rep.verified_through == 60
+
+    _fill(tmp_path, 5, start=60, segment_max_bytes=1500)
+    rep = verify_log(tmp_path / "audit.jsonl", workers=1)
+    assert rep.ok, rep.errors
+    assert rep.records == 5
+    assert rep.verified_through == 65
+
+    assert verify(str(tmp_path))["records"] == 0
+
+
+def test_detects_tampering(tmp_path):
+    _fill(tmp_path, 10)
+    path = tmp_path / "audit.jsonl"
+    lines = path.read_text(encoding="utf-8").splitlines()
+    rec = json.loads(lines[4])
+    rec["agent_id"] = "mallory"
+    lines[4] = json.dumps(rec, separators=(",", ":"), sort_keys=True)
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    rep = verify_log(path, full=True)
+    assert not rep.ok
+    assert rep.errors[0]["reason"] == "hash mismatch"
+    assert rep.verified_through == 3
+
+
+def test_incremental_across_retention(tmp_path):
+    kw = dict(segment_max_bytes=400, retain_segments=2)
+    _fill(tmp_path, 5, **kw)
+    assert verify_log(tmp_path / "audit.jsonl", workers=1).ok
+
+    # retention now prunes past the checkpointed segment
+    _fill(tmp_path, 40, start=5, **kw)
+    rep = verify_log(tmp_path / "audit.jsonl", workers=1)
+    assert rep.ok, rep.errors
+    assert rep.verified_through == 45
+
+    _fill(tmp_path, 10, start=45, **kw)
+    rep = verify_log(tmp_path / "audit.jsonl", workers=1)
+    assert rep.ok, rep.errors
+    assert rep.verified_through == 55
+    assert verify_log(tmp_path / "audit.jsonl", full=True).ok
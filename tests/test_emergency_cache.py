@@ -0,0 +1,103 @@
+import fnmatch
+import time
+
+import pytest
+
+from apps.api.rtp.emergency_cache import FLAGS_KEY, EmergencyCache, EmergencyState, flag_key, seed_registry
+from apps.api.rtp.redis_scripts import (
+    PRECHECK_EMERGENCY_ALL,
+    PRECHECK_EMERGENCY_PRINCIPAL,
+    PRECHECK_EMERGENCY_TOOL,
+    PRECHECK_OK,
+)
+
+
+class _Pipe:
+    def __init__(self, h, all_key):
+        self.h, self.all_key = h, all_key
+
+    def hgetall(self, _k):
+        pass
+
+    def get(self, _k):
+        pass
+
+    def execute(self):
+        return [dict(self.h), self.all_key]
+
+
+class _Client:
+    def __init__(self):
+        self.h = {}
+        self.all_key = None
+
+    def pipeline(self, transaction=True):
+        return _Pipe(self.h, self.all_key)
+
+
+def test_state_verdicts_follow_script_order():
+    st = EmergencyState.from_hash({"tool:shell": "1", "principal:bob": "1", "_ts_ns": "7"})
+    assert st.changed_ns == 7
+    assert st.code("shell", "bob") == PRECHECK_EMERGENCY_TOOL
+    assert st.code("read", "bob") == PRECHECK_EMERGENCY_PRINCIPAL
+    assert st.code("read", "alice") == PRECHECK_OK
+    assert EmergencyState.from_hash({}, legacy_all="1").code("read", None) == PRECHECK_EMERGENCY_ALL
+
+
+def test_cache_refresh_and_staleness_bound():
+    rc = _Client()
+    cache = EmergencyCache(lambda: rc, poll_sec=0.05, max_stale_sec=0.2)
+    assert cache.current() is None  # never loaded
+
+    assert cache.refresh()
+    assert cache.current().code("shell", None) == PRECHECK_OK
+
+    rc.h.update({"tool:shell": "1", "_ts_ns": str(time.time_ns())})
+    assert cache.refresh()
+    assert cache.current().code("shell", None) == PRECHECK_EMERGENCY_TOOL
+    assert cache.metrics()["propagation_ms"]["last"] is not None
+
+    cache._confirmed -= 1.0  # nothing confirmed the view for longer than the bound
+    assert cache.current() is None
+    assert cache.metrics()["trusted"] is False
+
+
+def test_unreachable_redis_is_never_trusted():
+    pytest.importorskip("redis")
+    from apps.api.rtp.redis_pool import get_redis
+
+    cache = EmergencyCache(lambda: get_redis("redis://127.0.0.1:3/0"), poll_sec=0.05)
+    assert cache.refresh() is False
+    assert cache.refresh_errors == 1
+    assert cache.current() is None
+
+
+class _Legacy(_Client):
+    """Flag keys written before the registry hash existed (SCAN + the seed script)."""
+
+    def __init__(self, keys):
+        super().__init__()
+        self.keys = dict(keys)
+
+    def scan_iter(self, match, count=None):
+        return [k.encode() for k in self.keys if fnmatch.fnmatchcase(k, match)]
+
+    def eval(self, _src, _n, key, hkey, field, ts_field, ts):
+        assert hkey == FLAGS_KEY
+        if key not in self.keys or field in self.h:
+            return 0
+        self.h[field] = "1"
+        self.h[ts_field] = ts
+        return 1
+
+
+def test_legacy_flag_keys_are_seeded_into_the_registry():
+    rc = _Legacy({flag_key("tool:shell"): "1", flag_key("principal:bob"): "1", flag_key("all"): None})
+    cache = EmergencyCache(lambda: rc, poll_sec=0.05)
+    cache.start()
+    cache.stop()
+    assert cache.seeded == 2
+    st = cache.current()
+    assert st.code("shell", None) == PRECHECK_EMERGENCY_TOOL
+    assert st.code("read", "bob") == PRECHECK_EMERGENCY_PRINCIPAL
+    assert seed_registry(rc) == 0  # already in the hash
@@ -0,0 +1,46 @@
+from apps.api.rtp.keyspace import KeySpace, cluster_keys_enabled, same_slot, slot_tag
+
+
+def test_single_node_keeps_the_historical_names():
+    ks = KeySpace(cluster=False)
+    assert ks.brittle_lock("a1") == "kasbah:brittle:lock:a1"
+    assert ks.brittle_strikes("a1") == "kasbah:brittle:strikes:a1"
+    assert ks.consumed("fp") == "kasbah:ticket:consumed:fp"
+    assert ks.rate_limit("decide", "tool:cost", "tool", "shell") == "kasbah:rl:decide:tool:cost:shell"
+    assert ks.bucket("login:1.2.3.4") == "kasbah:rl:login:1.2.3.4"
+    assert ks.emergency("all") == "kasbah:emergency:all"
+    assert ks.thermo("lock_until") == "kasbah:thermo:lock_until"
+
+
+def test_cluster_keys_share_a_slot_per_agent():
+    ks = KeySpace(cluster=True)
+    home = ks.brittle_lock("a1")
+    agent_keys = [
+        ks.brittle_strikes("a1"),
+        ks.rate_limit("decide", "agent", "agent", "a1"),
+        ks.rate_limit("consume", "agent:cost", "agent", "a1"),
+    ]
+    assert all(same_slot(k, home) for k in agent_keys)
+    assert not same_slot(home, ks.brittle_lock("a2"))
+    # shared limits: count and cost of one level together, apart from the agents
+    tool = ks.rate_limit("decide", "tool", "tool", "shell")
+    assert same_slot(tool, ks.rate_limit("decide", "tool:cost", "tool", "shell"))
+    assert not same_slot(tool, home)
+    assert same_slot(ks.emergency("flags"), ks.emergency("tool:shell"))
+    assert same_slot(ks.thermo("instances"), ks.thermo("lock_until"))
+    assert slot_tag(ks.bucket("login")) == "rl:login"
+
+
+def test_slot_tag_and_mode():
+    assert slot_tag("kasbah:{agent:a1}:x") == "agent:a1"
+    assert slot_tag("plain") == "plain"
+    assert slot_tag("a{}b{c}") == "a{}b{c}"  # an empty tag hashes the whole key
+    assert cluster_keys_enabled("redis+cluster://n1:7000", "auto")
+    assert not cluster_keys_enabled("redis+sentinel://s1/primary", "auto")
+    assert cluster_keys_enabled("redis://r:6379/0", "1")
+
+
+def test_consume_once_key_depends_on_the_ticket_only():
+    ks = KeySpace(cluster=True)
+    assert ks.consumed("fp") == "kasbah:{ticket:fp}:consumed"
+    assert not same_slot(ks.consumed("fp"), ks.brittle_lock("a1"))
@@ -0,0 +1,111 @@
+import asyncio
+
+from apps.api.rtp.quota_lease import QuotaLeaser
+from apps.api.rtp.redis_scripts import PRECHECK_BRITTLE, PRECHECK_OK, PRECHECK_RATE_LIMITED, RateLimit
+
+
+class _Acquire:
+    """Grants what is asked for while `budget` lasts; records every call."""
+
+    def __init__(self, budget=1000):
+        self.budget = budget
+        self.calls = []
+        self.fail = False
+
+    async def __call__(self, rc, brittle_key, items, now, brittle_enabled=True):
+        self.calls.append(list(items))
+        if self.fail:
+            raise ConnectionError("down")
+        for _lim, _want, ret in items:
+            self.budget += ret
+        wants = [want for _lim, want, _ret in items]
+        if any(w and self.budget < 1 for w in wants):
+            return PRECHECK_RATE_LIMITED, None, 250, items[0][0].scope, [0] * len(items)
+        granted = []
+        for w in wants:
+            g = min(w, self.budget)
+            self.budget -= g
+            granted.append(g)
+        return PRECHECK_OK, None, 0, None, granted
+
+
+LIM = RateLimit("agent", "kasbah:rl:decide:agent:a1", 100, 10)
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_requests_are_admitted_from_the_lease():
+    acq = _Acquire()
+    q = QuotaLeaser(error=0.1, acquire=acq)
+    codes = [_run(q.precheck(object(), "b", [LIM], now=0.0)).code for _ in range(10)]
+    assert codes == [PRECHECK_OK] * 10
+    assert len(acq.calls) == 1  # one lease of 10 tokens served all ten
+    assert acq.calls[0] == [(LIM, 10, 0)]
+    m = q.metrics()
+    assert m["local_hits"] == 10 and m["tokens_leased"] == 10 and m["tokens_held"] == 0
+
+
+def test_expired_lease_returns_unused_tokens():
+    acq = _Acquire()
+    q = QuotaLeaser(error=0.1, acquire=acq)
+    _run(q.precheck(object(), "b", [LIM], now=0.0))
+    q._leases[LIM.key].expires = 0.0  # window share over
+    _run(q.precheck(object(), "b", [LIM], now=1.0))
+    assert acq.calls[1] == [(LIM, 10, 9)]
+    assert q.metrics()["tokens_returned"] == 9
+
+
+def test_refusals_brittle_and_fallback():
+    acq = _Acquire(budget=0)
+    q = QuotaLeaser(error=0.1, acquire=acq)
+    pre = _run(q.precheck(object(), "b", [LIM], now=0.0))
+    assert pre.code == PRECHECK_RATE_LIMITED and pre.retry_after_sec == 1 and pre.limited_by == "agent"
+
+    q.note_brittle("b", until=1e12)
+    assert _run(q.precheck(object(), "b", [LIM], now=0.0)).code == PRECHECK_BRITTLE
+    assert _run(q.precheck(object(), "b", [LIM], now=0.0, brittle_enabled=False)).code == PRECHECK_RATE_LIMITED
+
+    acq.fail = True
+    assert _run(q.precheck(object(), "c", [LIM], now=0.0, brittle_enabled=False)) is None
+    assert _run(q.precheck(None, "c", [LIM], now=0.0)) is None
+    assert _run(q.precheck(object(), "c", [], now=0.0)) is None
+
+
+def test_cost_weighted_lease():
+    acq = _Acquire()
+    q = QuotaLeaser(error=0.1, acquire=acq)
+    budget = RateLimit("tool:cost", "kasbah:rl:decide:tool:cost:shell", 1000, 60, cost=40)
+    assert _run(q.precheck(object(), "b", [budget], now=0.0)).code == PRECHECK_OK
+    assert acq.calls[0] == [(budget, 100, 0)]
+    assert q.metrics()["tokens_held"] == 60
+    _run(q.precheck(object(), "b", [budget], now=0.0))
+    # 20 tokens left: not enough for the next request, handed back with the renewal
+    _run(q.precheck(object(), "b", [budget], now=0.0))
+    assert len(acq.calls) == 2 and acq.calls[1] == [(budget, 100, 20)]
+
+
+def test_release_all_calls_once_per_slot_and_counts_failures():
+    a1 = RateLimit("agent", "kasbah:{agent:a1}:rl:decide", 100, 10)
+    a1_tool = RateLimit("tool", "kasbah:{agent:a1}:rl:decide:tool:shell", 100, 10)
+    a2 = RateLimit("agent", "kasbah:{agent:a2}:rl:decide", 100, 10)
+    acq = _Acquire()
+    q = QuotaLeaser(error=0.1, acquire=acq)
+    _run(q.precheck(object(), "kasbah:{agent:a1}:brittle:lock", [a1, a1_tool], now=0.0))
+    _run(q.precheck(object(), "kasbah:{agent:a2}:brittle:lock", [a2], now=0.0))
+    acq.calls.clear()
+
+    class _FailFor(_Acquire):
+        async def __call__(self, rc, brittle_key, items, now, brittle_enabled=True):
+            assert not brittle_enabled and brittle_key == items[0][0].key
+            self.calls.append(list(items))
+            if any(lim is a2 for lim, _, _ in items):
+                raise ConnectionError("slot down")
+            return PRECHECK_OK, None, 0, None, [0] * len(items)
+
+    q.acquire = fail = _FailFor()
+    _run(q.release_all(object()))
+    assert sorted(len(c) for c in fail.calls) == [1, 2]  # one call per agent slot
+    m = q.metrics()
+    assert m["tokens_returned"] == 9 + 9 and m["release_failures"] == 1 and m["leases"] == 0
@@ -0,0 +1,65 @@
+import pytest
+
+redis = pytest.importorskip("redis")
+
+import asyncio  # noqa: E402
+
+from apps.api.rtp.redis_pool import (  # noqa: E402
+    close_async_redis,
+    get_async_redis,
+    get_redis,
+    parse_url,
+    pool_metrics,
+)
+
+
+def test_shared_client_and_pool_metrics():
+    url = "redis://127.0.0.1:1/0"  # nothing listens here
+    m = pool_metrics(url)
+    assert (m["available"], m["created"]) == (True, False)
+    rc = get_redis(url)
+    assert rc is get_redis(url)
+    with pytest.raises(redis.ConnectionError):
+        rc.get("k")
+    m = pool_metrics(url)
+    assert m["checkouts"] == 1 and m["checkout_errors"] == 1
+    assert m["in_use"] == 0 and m["max_connections"] >= 1
+
+
+def test_async_client_is_bound_to_its_loop():
+    url = "redis://127.0.0.1:2/0"
+
+    async def run():
+        rc = get_async_redis(url)
+        assert rc is get_async_redis(url)
+        with pytest.raises(redis.ConnectionError):
+            await rc.get("k")
+        return rc
+
+    first = asyncio.run(run())
+    m = pool_metrics(url)["async"]
+    assert m["checkouts"] == 1 and m["checkout_errors"] == 1
+
+    async def other_loop():
+        rc = get_async_redis(url)
+        await close_async_redis()
+        return rc
+
+    assert asyncio.run(other_loop()) is not first
+    assert get_async_redis(url) is None  # no running loop
+
+
+def test_sentinel_and_cluster_urls():
+    assert parse_url("redis://127.0.0.1:1/0") == {"mode": "single"}
+    cfg = parse_url("rediss+sentinel://u:p%40ss@s1,s2:26380/primary/2")
+    assert cfg["mode"] == "sentinel" and cfg["ssl"]
+    assert cfg["nodes"] == [("s1", 26379), ("s2", 26380)]
+    assert (cfg["service"], cfg["db"], cfg["username"], cfg["password"]) == ("primary", 2, "u", "p@ss")
+    assert parse_url("redis+cluster://[::1]:7000,n2")["nodes"] == [("::1", 7000), ("n2", 6379)]
+    with pytest.raises(ValueError):
+        parse_url("redis+sentinel://s1:26379")
+
+    # no cluster node reachable: no client, and no new attempt on every call
+    url = "redis+cluster://127.0.0.1:1"
+    assert get_redis(url) is None and get_redis(url) is None
+    assert pool_metrics(url)["mode"] == "cluster"
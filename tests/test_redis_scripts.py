@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from apps.api.rtp.redis_scripts import (
+    PRECHECK_EMERGENCY_TOOL,
+    PRECHECK_OK,
+    PRECHECK_REPLAY,
+    Precheck,
+    RateLimit,
+    _limit_args,
+    consume_gate,
+    consume_gate_async,
+    decide_precheck,
+    decide_precheck_async,
+    rate_limit,
+)
+
+BRITTLE = "kasbah:brittle:lock:a"
+EM = ["kasbah:emergency:all", "kasbah:emergency:tool:t", "kasbah:emergency:principal:p"]
+MARK = "kasbah:ticket:consumed:fp"
+LIMITS = [RateLimit("agent", "kasbah:rl:decide:agent:a", 5, 60), RateLimit("tool", "kasbah:rl:decide:tool:t", 9, 1)]
+
+
+def test_precheck_fails_open_without_redis():
+    assert decide_precheck(None, BRITTLE, EM, LIMITS, now=0.0) == Precheck(PRECHECK_OK, 5)
+    assert Precheck(PRECHECK_EMERGENCY_TOOL, 3).emergency == "emergency:tool"
+    assert Precheck(PRECHECK_OK, 3).emergency is None
+
+    pytest.importorskip("redis")
+    from apps.api.rtp.redis_pool import get_redis
+
+    rc = get_redis("redis://127.0.0.1:1/0")  # unreachable
+    assert decide_precheck(rc, BRITTLE, EM, LIMITS, now=0.0) == Precheck(PRECHECK_OK, 5)
+    assert rate_limit(rc, LIMITS) == Precheck(PRECHECK_OK, 5)
+
+
+def test_consume_gate_mark_fails_closed():
+    # verified ticket: cannot be marked consumed -> treated as replay
+    assert consume_gate(None, BRITTLE, EM, MARK, LIMITS, now=0.0, mark_ttl_sec=30).code == PRECHECK_REPLAY
+    # unverified ticket: only the fail-open checks ran
+    assert consume_gate(None, BRITTLE, EM, MARK, LIMITS, now=0.0, mark_ttl_sec=None).code == PRECHECK_OK
+
+    pytest.importorskip("redis")
+    from apps.api.rtp.redis_pool import get_redis
+
+    rc = get_redis("redis://127.0.0.1:1/0")
+    assert consume_gate(rc, BRITTLE, EM, MARK, LIMITS, now=0.0, mark_ttl_sec=30).code == PRECHECK_REPLAY
+
+
+def test_gcra_parameters_and_retry_after():
+    lim = RateLimit("agent", "k", 60, 60)
+    assert lim.interval_us == 1_000_000  # one request per second ...
+    assert lim.tolerance_us == 60_000_000  # ... after a burst of 60
+    assert Precheck(2, 0, retry_after_ms=1).retry_after_sec == 1
+    assert Precheck(2, 0, retry_after_ms=2001).retry_after_sec == 3
+
+
+def test_cost_weighted_limits_are_charged_their_cost():
+    limits = [RateLimit("global", "g", 100, 60), RateLimit("tool:cost", "tc", 1000, 60, cost=600)]
+    # (interval_us, tolerance_us, cost) per limit: a count limit takes 1 token, a budget the request's cost
+    assert _limit_args(limits) == [600_000, 60_000_000, 1, 60_000, 60_000_000, 600]
+
+
+def test_async_variants_keep_the_failure_modes():
+    pytest.importorskip("redis")
+    from apps.api.rtp.redis_pool import close_async_redis, get_async_redis
+
+    async def run():
+        rc = get_async_redis("redis://127.0.0.1:1/0")
+        try:
+            pre = await decide_precheck_async(rc, BRITTLE, EM, LIMITS, now=0.0)
+            marked = await consume_gate_async(rc, BRITTLE, EM, MARK, LIMITS, now=0.0, mark_ttl_sec=30)
+            unverified = await consume_gate_async(rc, BRITTLE, EM, MARK, LIMITS, now=0.0, mark_ttl_sec=None)
+        finally:
+            await close_async_redis()
+        return pre, marked, unverified
+
+    pre, marked, unverified = asyncio.run(run())
+    assert pre == Precheck(PRECHECK_OK, 5)
+    assert marked.code == PRECHECK_REPLAY
+    assert unverified.code == PRECHECK_OK
@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def client(api):
+    return TestClient(api.app)
+
+
+def _decide(client, agent_id):
+    r = client.post("/api/rtp/decide", json={"tool_name": "read.me", "agent_id": agent_id, "usage": {"args": {"p": 1}}})
+    assert r.status_code == 200, r.text
+    return r.json()["ticket"]
+
+
+def _consume(client, ticket, agent_id, tool_name="read.me"):
+    return client.post(
+        "/api/rtp/consume",
+        json={"ticket": ticket, "tool_name": tool_name, "agent_id": agent_id, "usage": {"args": {"p": 1}}},
+    )
+
+
+def test_consumed_ticket_is_a_replay_under_any_agent_id(client):
+    ticket = _decide(client, "replay-a1")
+    assert _consume(client, ticket, "replay-a1").status_code == 200
+    for agent_id in ("replay-a1", "replay-a2", "replay-a3"):
+        r = _consume(client, ticket, agent_id)
+        assert r.status_code == 403 and r.json()["detail"] == "replay"
+
+
+def test_ticket_is_bound_to_its_tool(client):
+    ticket = _decide(client, "bind-a1")
+    r = _consume(client, ticket, "bind-a1", tool_name="shell.exec")
+    assert r.status_code == 403 and r.json()["detail"] == "tool mismatch"
@@ -0,0 +1,43 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("cryptography")
+from crypto.secure_core import CryptoSecureCore, LedgerCorrupt  # noqa: E402
+
+
+def test_fold_keeps_torn_tail_and_later_appends(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    core = CryptoSecureCore()
+    for i in range(3):
+        core.update_merkle_ledger({"op": i})
+    core.sink.flush()
+    with open(".kasbah/ledger.leaves.jsonl", "ab") as f:
+        f.write(b'{"leaf":"ab')  # torn by a crash mid-write
+    ino = os.stat(".kasbah/ledger.leaves.jsonl").st_ino
+
+    again = CryptoSecureCore()
+    assert os.stat(".kasbah/ledger.leaves.jsonl").st_ino != ino  # replaced, not rewritten in place
+    assert not os.path.exists(".kasbah/ledger.leaves.jsonl.tmp")
+    assert again.leaves == core.leaves
+    assert json.load(open(".kasbah/ledger.json")) == [h.hex() for h in core.leaves]
+    assert open(".kasbah/ledger.leaves.jsonl", "rb").read() == b'{"leaf":"ab\n'
+
+    again.update_merkle_ledger({"op": 3})
+    again.sink.flush()
+    assert CryptoSecureCore().leaves == again.leaves
+
+
+def test_corrupt_snapshot_is_not_overwritten(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    core = CryptoSecureCore()
+    core.update_merkle_ledger({"op": 1})
+    core.sink.flush()
+    open(".kasbah/ledger.json", "w").write("[not json")
+    journal = open(".kasbah/ledger.leaves.jsonl", "rb").read()
+
+    with pytest.raises(LedgerCorrupt):
+        CryptoSecureCore()
+    assert open(".kasbah/ledger.json").read() == "[not json"
+    assert open(".kasbah/ledger.leaves.jsonl", "rb").read() == journal
@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+import pytest
+
+from apps.api.rtp.keyspace import KeySpace
+from apps.api.rtp.redis_scripts import (
+    PRECHECK_BRITTLE,
+    PRECHECK_EMERGENCY_TOOL,
+    PRECHECK_OK,
+    PRECHECK_RATE_LIMITED,
+    PRECHECK_REPLAY,
+    RateLimit,
+)
+from apps.api.rtp.state_backend import RedisBackend, StateBackend, make_backend
+from apps.api.rtp.state_memory import MemoryBackend, TimingWheel
+
+KS = KeySpace()
+BRITTLE = KS.brittle_lock("a1")
+EM = [KS.emergency("all"), KS.emergency("tool:shell"), KS.emergency("principal:p")]
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_decide_limits_are_atomic_and_report_the_level():
+    st = MemoryBackend(stripes=4)
+    limits = [
+        RateLimit("agent", KS.rate_limit("decide", "agent", "agent", "a1"), 3, 60),
+        RateLimit("tool:cost", KS.rate_limit("decide", "tool:cost", "tool", "shell"), 100, 60, cost=40),
+    ]
+    codes = [_run(st.decide_precheck(BRITTLE, EM, limits, now=0.0)).code for _ in range(3)]
+    assert codes == [PRECHECK_OK, PRECHECK_OK, PRECHECK_RATE_LIMITED]
+    refused = _run(st.decide_precheck(BRITTLE, EM, limits, now=0.0))
+    assert refused.limited_by == "tool:cost" and refused.retry_after_ms > 0
+    # the refusals charged nothing: one agent token is left
+    assert _run(st.decide_precheck(BRITTLE, EM, limits[:1], now=0.0)).code == PRECHECK_OK
+    assert _run(st.decide_precheck(BRITTLE, EM, limits[:1], now=0.0)).limited_by == "agent"
+
+
+def test_consume_gate_marks_once_and_respects_flags_and_brittleness():
+    st = MemoryBackend()
+    mark = KS.consumed("fp")
+    gate = lambda ttl: _run(st.consume_gate(BRITTLE, EM, mark, [], now=0.0, mark_ttl_sec=ttl))  # noqa: E731
+
+    st.set_emergency_flag("tool:shell", True)
+    assert st.emergency_flags().code("shell", None) == PRECHECK_EMERGENCY_TOOL
+    assert gate(30).code == PRECHECK_EMERGENCY_TOOL  # not marked ...
+    st.set_emergency_flag("tool:shell", False)
+    assert gate(None).code == PRECHECK_OK  # ... nor by an unverified ticket
+    assert gate(30).code == PRECHECK_OK
+    assert gate(30).code == PRECHECK_REPLAY
+    assert st.mark_once(mark, 30) is False
+
+    strike = lambda: _run(st.brittle_strike(KS.brittle_strikes("a1"), BRITTLE, 2, 60, 30, now=100.0))  # noqa: E731
+    assert strike() is None
+    assert strike() == 130.0
+    assert st.brittle_locked(BRITTLE, now=100.0) and not st.brittle_locked(BRITTLE, now=131.0)
+    assert gate(30).code == PRECHECK_BRITTLE
+
+
+def test_timing_wheel_expires_keys():
+    w = TimingWheel(tick_sec=0.1, slots=8, now=0.0)
+    w.schedule("soon", 0.25)
+    w.schedule("later", 2.0)  # more than one turn ahead
+    assert w.advance(0.2) == []
+    assert w.advance(0.35) == ["soon"]
+    assert w.advance(1.0) == []
+    assert w.advance(5.0) == ["later"]
+
+    w.schedule("k", 6.0)
+    w.schedule("k", 5.5)  # rescheduled: one deadline per key
+    assert w.scheduled == 1 and sum(map(len, w.slots)) == 1
+    assert w.advance(5.6) == ["k"] and w.advance(7.0) == []
+
+    st = MemoryBackend(tick_ms=1)
+    assert st.mark_once("k", 1)
+    st._data[st._stripe("k")]["k"] = ("1", 0.0)  # already expired: a read does not trust it
+    assert st.mark_once("k", 1)
+    st._expire_due(time.monotonic() + 3600.0)
+    assert st.metrics()["keys"] == 0
+
+    for _ in range(100):  # overwriting a key does not grow the wheel
+        st.mark_once("k", 1)
+        st._data[st._stripe("k")]["k"] = ("1", 0.0)
+    assert st.metrics()["wheel"]["scheduled"] == 1
+
+
+def test_backend_selection():
+    assert make_backend("memory").local
+    assert make_backend("redis", "redis://127.0.0.1:1/0").name == "redis"
+    with pytest.raises(ValueError):
+        make_backend("etcd")
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+class _Pipe:
+    def __init__(self, rc):
+        self.rc, self.cmds = rc, []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def incr(self, key):
+        self.cmds.append(("incr", key))
+
+    def expire(self, key, sec):
+        self.cmds.append(("expire", key, sec))
+
+    async def execute(self):
+        self.rc.transactions.append(self.cmds)
+        self.rc.n += 1
+        return [self.rc.n, True]
+
+
+class _AsyncRedis:
+    def __init__(self):
+        self.n, self.transactions, self.locks = 0, [], {}
+
+    def pipeline(self, transaction=True):
+        assert transaction
+        return _Pipe(self)
+
+    async def set(self, key, value, ex=None):
+        self.locks[key] = (value, ex)
+
+
+def test_redis_strike_counts_and_expires_in_one_transaction():
+    rc = _AsyncRedis()
+    st = RedisBackend("redis://127.0.0.1:1/0")
+    st.async_client = lambda: rc
+    strike = lambda: _run(st.brittle_strike("s", "l", 2, 60, 30, now=100.0))  # noqa: E731
+    assert strike() is None
+    assert strike() == 130.0
+    assert rc.transactions == [[("incr", "s"), ("expire", "s", 60)]] * 2
+    assert rc.locks == {"l": ("130.0", 32)}
+
+
+def test_replay_under_another_agent_id_is_refused():
+    st = MemoryBackend()
+    for ks in (KeySpace(), KeySpace(cluster=True)):
+        mark = ks.consumed("fp-" + str(ks.cluster))  # the same ticket, whoever claims it
+        codes = [
+            _run(st.consume_gate(ks.brittle_lock(agent), EM, mark, [], now=0.0, mark_ttl_sec=30)).code
+            for agent in ("a1", "a2", "a3")
+        ]
+        assert codes == [PRECHECK_OK, PRECHECK_REPLAY, PRECHECK_REPLAY]
+        # the cluster path marks in the ticket's own slot after the agent's gate
+        assert _run(st.mark_once_async(mark, 30)) is False
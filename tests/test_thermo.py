@@ -0,0 +1,39 @@
+import json
+import time
+
+from apps.api.rtp.thermo import ThermoBrake, merge
+
+
+def _entry(ema, n, ts):
+    return json.dumps({"ema_ms": ema, "n": n, "ts": ts})
+
+
+def test_merge_weights_by_recent_requests_and_drops_stale():
+    now = time.time()
+    entries = {
+        "a": _entry(100.0, 3, now),
+        "b": _entry(500.0, 1, now),
+        "idle": _entry(9000.0, 0, now),
+        "gone": _entry(9000.0, 50, now - 60),
+        "bad": "{",
+    }
+    ema, total, stale = merge(entries, now, ttl_sec=10)
+    assert ema == 200.0 and total == 4
+    assert sorted(stale) == ["bad", "gone"]
+
+
+def test_lockdown_without_redis_uses_the_local_ema():
+    brake = ThermoBrake(lambda: None, threshold_ms=300, alpha=0.5, cooldown_sec=10)
+    brake.observe(100)
+    brake.tick()
+    assert not brake.locked()
+
+    brake.observe(900)  # ema 500
+    assert not brake.locked()  # decided by the next merge, not on the request path
+    brake.tick()
+    assert brake.locked() and brake.metrics()["cluster_ema_ms"] == 500.0
+
+    brake._lock_until = 0.0  # cooldown over
+    brake.tick()  # no traffic since: no new evidence, no new lockdown
+    assert not brake.locked()
+    assert ThermoBrake(lambda: None, 300, 0.5, 10, force=True).locked()
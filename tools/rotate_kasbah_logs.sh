@@ -19,6 +19,16 @@ rotate_one() {
   ls -1t "${f}."* 2>/dev/null | awk "NR>${KEEP}" | xargs -r rm -f
 }
 
+# NOTE: the hash-chained audit log (audit.jsonl) is NOT rotated here.
+# The API seals it into $DIR/audit.segments/ itself (KASBAH_AUDIT_SEGMENT_MAX_BYTES,
+# KASBAH_AUDIT_SEGMENT_MAX_AGE_SEC, KASBAH_AUDIT_RETAIN_*), under the writer's
+# flock, so the prev_hash chain survives rotation. Never mv/truncate it.
+# Sealed segments (*.jsonl, or *.bin with KASBAH_AUDIT_FORMAT=bin) are compressed
+# to *.z (+ .zidx frame index) by the API as well (KASBAH_AUDIT_COMPRESS,
+# KASBAH_AUDIT_CODEC); do not gzip them here.
+# rtp_audit.log / decisions.jsonl are appended by the API's buffered sinks, which
+# reopen the file after a mv. ledger.leaves.jsonl is folded into ledger.json on
+# start; do not rotate it.
 rotate_one "$DIR/rtp_audit.log"
 rotate_one "$DIR/decisions.jsonl"
 rotate_one "$DIR/rtp_used_jti.jsonl"